@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the replay of the events of the `EventStore` (`cern/cache.py`).
+
+`events` HepMC-like events are written by a fake generator (a Python
+subprocess, much faster than PYTHIA) to a pipe read by a reader process
+(in place of Rivet), while being recorded in a temporary store. The same
+events are then replayed from the store (`EventReplay`). Reported: the
+events per second read by the reader in both cases, and the size of the
+stored events.
+
+Usage: python benchmarks/event_store.py [events]
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.cache import EventStore
+from cern.simulation import EventReplay
+from cern.transport import PipeTransport, attached, close_inherited
+
+# Writes `argv[2]` events of about 2 kB to `argv[1]`
+GENERATOR = """
+import sys
+particle = "P 10001 211 1.0e+00 2.0e+00 3.0e+00 4.0e+00 1.4e-01 1 0 0 0 0\\n"
+with open(sys.argv[1], 'w') as f:
+    for i in xrange(int(sys.argv[2])):
+        f.write("E {} 0 -1.0 -1.0 -1.0 0 0 30 0 0 0 0\\n".format(i) + particle * 24)
+"""
+
+
+class Console(object):
+    def put(self, msg, block=True):
+        pass
+
+
+def read_events(transport, _q):
+    close_inherited(transport)
+
+    events = 0
+    with attached(transport.reader_path):
+        f = open(transport.reader_path, 'r')
+    with f:
+        for line in f:
+            if line.startswith('E '):
+                events += 1
+
+    _q.put(events)
+
+
+def measure(tmpdir, feed, events):
+    """
+    Events per second read from a pipe written by `feed(transport)`.
+    """
+
+    with PipeTransport(tmpdir, 'events', 1024 * 1024) as transport:
+        start = time.time()
+        _q = multiprocessing.Queue()
+        reader = multiprocessing.Process(target=read_events, args=(transport, _q))
+        reader.start()
+        feed(transport)
+        read = _q.get()
+        reader.join()
+
+    assert read == events, read
+    return events / (time.time() - start)
+
+
+def generate(tmpdir, events, recorder):
+    """
+    Run the fake generator, copying its events to the transport and
+    the `recorder` (as `Pythia` does).
+    """
+
+    def feed(transport):
+        source = PipeTransport(tmpdir, 'source')
+        source.open()
+        generator = subprocess.Popen([sys.executable, '-c', GENERATOR, source.writer_path, str(events)],
+            preexec_fn=source.preexec)
+        source.started()
+
+        writer = open(transport.writer_path, 'wb')
+        transport.started()
+        while True:
+            data = os.read(source.reader_fd(), 1048576)
+            if not data:
+                break
+            writer.write(data)
+            recorder.write(data)
+        writer.close()
+        generator.wait()
+        source.close()
+        recorder.commit()
+
+    return feed
+
+
+def replay(filename):
+    def feed(transport):
+        thread = EventReplay(filename, transport, Console())
+        thread.start()
+        thread.join()
+
+    return feed
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        store = EventStore(os.path.join(tmpdir, 'store'), 1024 ** 3)
+
+        print "{:>10} {:>12}".format('source', 'events/s')
+        print "{:>10} {:>12.0f}".format('generator', measure(tmpdir, generate(tmpdir, events, store.recorder('bench')), events))
+        print "{:>10} {:>12.0f}".format('replay', measure(tmpdir, replay(store.get('bench')), events))
+        print "stored: {:.1f} kB".format(os.path.getsize(store.filename('bench')) / 1024.)
+    finally:
+        shutil.rmtree(tmpdir, True)
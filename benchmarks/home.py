@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the analysis list of the home page (`MainHandler.get`).
+
+Compare the time needed to get the LHC analyses:
+
+- `plugins`: loading every Rivet analysis plugin (previous implementation,
+  on each page view)
+- `build`: building the `AnalysisCatalogue` (first startup)
+- `index`: loading the saved catalogue (next startups)
+- `memory`: from the loaded catalogue (each page view)
+
+Usage: python benchmarks/home.py [repeats]
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.rivettools import AnalysisCatalogue, config
+
+import rivet
+
+
+def plugins():
+    rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+    analyses = rivet.AnalysisLoader.analysisNames()
+    return [a for a in analyses if rivet.AnalysisLoader.getAnalysis(a).collider().startswith('LHC')]
+
+
+def build(filename):
+    catalogue = AnalysisCatalogue(filename)
+    catalogue.build()
+    catalogue.save(catalogue.signature())
+    return catalogue.lhc_analyses()
+
+
+def index(filename):
+    catalogue = AnalysisCatalogue(filename)
+    catalogue.load()
+    return catalogue.lhc_analyses()
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    filename = os.path.join(tempfile.mkdtemp(), 'analyses.json')
+    build(filename)
+    catalogue = AnalysisCatalogue(filename)
+    catalogue.load()
+
+    modes = [
+        ('plugins', plugins),
+        ('build', lambda: build(filename)),
+        ('index', lambda: index(filename)),
+        ('memory', catalogue.lhc_analyses)
+        ]
+
+    print "{:>10} {:>12}".format('mode', 'time (ms)')
+    for name, target in modes:
+        t = timeit.timeit(target, number=repeats) / repeats
+        print "{:>10} {:>12.3f}".format(name, t * 1000)
+
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
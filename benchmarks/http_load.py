@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the web server: requests per second on the home page
+under concurrent load (the server must be running, `python main.py`).
+
+`concurrency` clients send `requests` requests in total, either without
+cache validator (full page) or with the ETag of the page (revalidation,
+304 responses).
+
+Usage: python benchmarks/http_load.py [url] [requests] [concurrency]
+"""
+
+import sys
+import time
+
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+
+@tornado.gen.coroutine
+def load(url, requests, concurrency, headers=None):
+    """
+    Requests per second and status codes of `requests` GET `url`.
+    """
+
+    client = tornado.httpclient.AsyncHTTPClient(max_clients=concurrency)
+    codes = dict()
+    remaining = [requests]
+
+    @tornado.gen.coroutine
+    def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            response = yield client.fetch(url, headers=headers, raise_error=False)
+            codes[response.code] = codes.get(response.code, 0) + 1
+
+    start = time.time()
+    yield [worker() for i in range(concurrency)]
+
+    raise tornado.gen.Return((requests / (time.time() - start), codes))
+
+
+@tornado.gen.coroutine
+def main(url, requests, concurrency):
+    response = yield tornado.httpclient.AsyncHTTPClient().fetch(url)
+    etag = response.headers.get('Etag')
+
+    modes = [('full', None)]
+    if etag:
+        modes.append(('revalidate', {'If-None-Match': etag}))
+
+    print "{:>12} {:>10} {:>16}".format('mode', 'req/s', 'status codes')
+    for name, headers in modes:
+        rate, codes = yield load(url, requests, concurrency, headers)
+        print "{:>12} {:>10.0f} {:>16}".format(name, rate, codes)
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:8888/'
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+
+    tornado.ioloop.IOLoop.current().run_sync(lambda: main(url, requests, concurrency))
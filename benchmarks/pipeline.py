@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of the simulations, with stand-ins for PYTHIA and
+Rivet (no physics software needed).
+
+The server runs in a temporary sandbox (its own `config.ini`, with a
+SQLite result store): a fake generator (`generate`) writes synthetic
+HepMC events at a controlled `rate` (events per second, 0: as fast as
+possible) to the transport of the events, analysed by the Rivet workers
+with the stub `rivet` and `yoda` modules of `benchmarks/stubs`. Each run
+has its own random seed (no cached results). Reported per run:
+
+- `simulation`: `Simulation.run` sending its messages to an in-memory
+  channel (serialized as JSON)
+- `websocket` and `websocket-json`: a client of the web socket handler
+  (`WSHandler`), with and without binary frames
+
+the events per second, the time to the first histogram, and the
+messages and bytes (per second) sent to the client. Measured separately
+(`conversion`): the time spent on each histogram update (snapshot of
+the Rivet histograms, delta, serialization of the message).
+
+The results are written as JSON (with the commit of the repository),
+so that different versions of the server can be compared.
+
+Usage: python benchmarks/pipeline.py [events] [rate] [output.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import socket
+import struct
+import platform
+import tempfile
+import threading
+import subprocess
+import collections
+import ConfigParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(ROOT, 'benchmarks', 'stubs')
+
+# Settings of the runs, passed to the stubs (and the generator) through
+# the environment
+SETTINGS = {
+    'particles': 100,
+    'histos': 20,
+    'bins': 50,
+    'analyses': 2,
+    'histointerval': 500
+    }
+
+# Generator run by `Pythia` (`./bench.exe params output`)
+GENERATOR = """#!{python}
+import sys
+sys.path.insert(0, {benchmarks!r})
+import pipeline
+pipeline.generate(sys.argv[1], sys.argv[2])
+"""
+
+
+def particles(seed, n):
+    """
+    HepMC lines of `n` random final state particles.
+    """
+
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        pt = rng.expovariate(2.)
+        phi = rng.uniform(0., 2 * math.pi)
+        pz = rng.gauss(0., 20.)
+        e = math.sqrt(pt * pt + pz * pz + 0.0195)
+        lines.append("P {} 211 {!r} {!r} {!r} {!r} 1.396e-01 1 0 0 -2 0\n".format(
+            10003 + i, pt * math.cos(phi), pt * math.sin(phi), pz, e))
+    return lines
+
+
+def generate(cmndfile, output):
+    """
+    Stand-in for PYTHIA: write the events of the cmnd file (number of
+    events, random seed) to `output`, at `BENCH_RATE` events per second.
+    """
+
+    rate = float(os.environ.get('BENCH_RATE', 0))
+    nparticles = int(os.environ.get('BENCH_PARTICLES', SETTINGS['particles']))
+
+    settings = dict()
+    for line in open(cmndfile):
+        if '=' in line and line.strip()[:1] not in ['!', '#']:
+            name, value = line.split('=', 1)
+            settings[name.strip()] = value.split('!')[0].strip()
+    events = int(settings.get('Main:numberOfEvents', 1000))
+    seed = int(settings.get('Random:seed', 0))
+
+    # Events are slices of a pool of particles
+    pool = particles(seed, 4 * nparticles)
+    rng = random.Random(seed)
+    batch = max(1, int(rate / 100))
+
+    start = time.time()
+    with open(output, 'w') as f:
+        f.write("\nHepMC::Version 2.06.09\nHepMC::IO_GenEvent-START_EVENT_LISTING\n")
+        for n in xrange(events):
+            offset = rng.randint(0, 3 * nparticles)
+            f.write("E {} -1 -1.0 -1.0 -1.0 0 0 1 10001 10002 0 1 1.0\nU GEV MM\nV -1 0 0 0 0 0 0 {} 0\n".format(n, nparticles))
+            f.write(''.join(pool[offset:offset + nparticles]))
+            if rate and n % batch == batch - 1:
+                delay = start + (n + 1) / rate - time.time()
+                if delay > 0:
+                    f.flush()
+                    time.sleep(delay)
+        f.write("HepMC::IO_GenEvent-END_EVENT_LISTING\n")
+
+    print " Stand-in generator: {} events in {:.3f} s".format(events, time.time() - start)
+
+
+def sandbox(tmpdir, events):
+    """
+    Configuration and files of the server in `tmpdir`.
+    """
+
+    config = ConfigParser.RawConfigParser()
+    config.read(os.path.join(ROOT, 'config.ini'))
+
+    pythia = os.path.join(tmpdir, 'pythia')
+    for name in ['pythia', 'output', 'refdata', 'events']:
+        os.mkdir(os.path.join(tmpdir, name))
+
+    overrides = {
+        'paths': {
+            'static': os.path.join(ROOT, 'static'),
+            'pythia': pythia + os.sep,
+            'rivet_output': os.path.join(tmpdir, 'output') + os.sep,
+            'analysis_lib': tmpdir,
+            'refdata': os.path.join(tmpdir, 'refdata') + os.sep,
+            'catalogue': os.path.join(tmpdir, 'output', 'analyses.json')
+            },
+        'rivet': {'workers': 1, 'preload': ''},
+        'pool': {'workers': 1},
+        'cache': {'backend': 'sqlite', 'sqlite': os.path.join(tmpdir, 'output', 'results.db'),
+            'health_interval': 0, 'final_workers': 1},
+        'refdata': {'prewarm': ''},
+        'events': {'directory': os.path.join(tmpdir, 'events') + os.sep, 'max_mb': 0}
+        }
+    for section, options in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for option, value in options.items():
+            config.set(section, option, value)
+
+    with open(os.path.join(tmpdir, 'config.ini'), 'w') as f:
+        config.write(f)
+
+    generator = os.path.join(pythia, 'bench.exe')
+    with open(generator, 'w') as f:
+        f.write(GENERATOR.format(python=sys.executable, benchmarks=os.path.join(ROOT, 'benchmarks')))
+    os.chmod(generator, 0755)
+
+    with open(os.path.join(pythia, 'bench.cmnd'), 'w') as f:
+        f.write("Main:numberOfEvents = {} ! number of events to generate\n".format(events))
+        f.write("Random:setSeed = on\nRandom:seed = 1\n")
+
+
+def write_refdata(tmpdir):
+    """
+    Reference histograms of the stub analyses.
+    """
+
+    import rivet
+    import yoda
+
+    for analysis in rivet.ANALYSES:
+        scatters = []
+        for histo in rivet.Analysis(analysis).histos:
+            width = (histo.edges.high - histo.edges.low) / len(histo.bins())
+            points = []
+            for b in histo.bins():
+                x = b.edges.low + width / 2
+                y = math.exp(-2. * x / histo.edges.high)
+                points.append(yoda.Point2D(x, width / 2, width / 2, y, 0.05 * y, 0.05 * y))
+            scatters.append(yoda.Scatter2D(points, "/REF{}".format(histo.path)))
+        yoda.writeYODA(scatters, os.path.join(tmpdir, 'refdata', "{}.yoda".format(analysis)))
+
+
+class Recorder(object):
+    """
+    Messages received by a client during a run.
+    """
+
+    def __init__(self):
+        from cern.tools import SIM_END, SIM_ERR, SIM_STP
+
+        self.final = [SIM_END, SIM_ERR, SIM_STP]
+        self.start = time.time()
+        self.first_histos = None
+        self.end = None
+        self.signal = None
+        self.events = 0
+        self.updates = 0
+        self.types = collections.defaultdict(lambda: {'messages': 0, 'bytes': 0})
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, message, nbytes):
+        with self._lock:
+            now = time.time()
+            self.types[message['type']]['messages'] += 1
+            self.types[message['type']]['bytes'] += nbytes
+
+            if message['type'] == 'histos_update':
+                self.updates += 1
+                if self.first_histos is None:
+                    self.first_histos = now - self.start
+            elif message['type'] == 'progress':
+                self.events = message['content']['events']
+            elif message['type'] == 'signal' and message['content'] in self.final:
+                self.end = now
+                self.signal = message['content']
+                self.done.set()
+
+    def results(self):
+        duration = (self.end or time.time()) - self.start
+        messages = sum(t['messages'] for t in self.types.values())
+        nbytes = sum(t['bytes'] for t in self.types.values())
+        return {
+            'signal': self.signal,
+            'events': self.events,
+            'duration_s': duration,
+            'events_per_s': self.events / duration if duration > 0 else 0.,
+            'first_histogram_s': self.first_histos,
+            'updates': self.updates,
+            'messages': messages,
+            'bytes': nbytes,
+            'bytes_per_s': nbytes / duration if duration > 0 else 0.,
+            'types': dict(self.types)
+            }
+
+
+class Channel(object):
+    """
+    In-memory client of a `Simulation` (messages serialized as by the
+    `WSChannel`, then counted).
+    """
+
+    maxsize = 100
+
+    def __init__(self, recorder, binary=False):
+        self.recorder = recorder
+        self.binary = binary
+
+    def put(self, msg, block=True):
+        from cern.tools import BINARY_MESSAGES, encode_binary, json_default
+
+        message = {'type': msg[0], 'content': msg[1]}
+        if len(msg) > 2:
+            message['analysis'] = msg[2]
+        if self.binary and msg[0] in BINARY_MESSAGES:
+            frame = encode_binary(message)
+        else:
+            frame = json.dumps(message, default=json_default)
+        self.recorder.record(message, len(frame))
+
+    def qsize(self):
+        return 0
+
+
+def run_simulation(analyses, seed):
+    """
+    Run a `Simulation` directly (no web socket).
+    """
+
+    from cern.simulation import Simulation
+
+    recorder = Recorder()
+    simulation = Simulation('bench.exe', 'bench.cmnd', 'bench.fifo', Channel(recorder), {'Random:seed': seed})
+    simulation.set_analysis(analyses)
+    simulation.set_histointerval(SETTINGS['histointerval'])
+    simulation.freeze_params()
+    simulation.follow()
+    simulation.run()
+    return recorder.results()
+
+
+def run_websocket(port, analyses, seed, binary, timeout):
+    """
+    Run a simulation as a client of the web socket handler.
+    """
+
+    import tornado.gen
+    import tornado.ioloop
+    import tornado.websocket
+
+    recorder = Recorder()
+
+    @tornado.gen.coroutine
+    def client():
+        url = "ws://127.0.0.1:{}/ws?binary={}".format(port, 1 if binary else 0)
+        conn = yield tornado.websocket.websocket_connect(url)
+
+        def send(**data):
+            conn.write_message(json.dumps(data))
+
+        send(action='init', generator='bench.exe', params='bench.cmnd', fifo='bench.fifo')
+        send(action='save_params', params=[{'name': 'Random-seed', 'currentValue': seed}])
+        recorder.start = time.time()
+        send(action='run', analysis=analyses, histointerval=SETTINGS['histointerval'], refs=True, more=False)
+
+        while not recorder.done.is_set():
+            frame = yield conn.read_message()
+            if frame is None:
+                break
+            if isinstance(frame, unicode):
+                frame = frame.encode('utf-8')
+                message = json.loads(frame)
+            else:
+                # Binary frame: only the JSON header is decoded
+                length = struct.unpack('<I', frame[:4])[0]
+                message = json.loads(frame[4:4 + length])
+            recorder.record(message, len(frame))
+
+        conn.close()
+
+    tornado.ioloop.IOLoop.current().run_sync(client, timeout)
+    return recorder.results()
+
+
+def conversion(analyses, updates):
+    """
+    Time spent on each histogram update: snapshot of the histograms of
+    the Rivet process (`snapshot_histos`), merge and delta by analysis
+    (`HistoStream`), serialization of the messages (JSON and binary).
+    """
+
+    from cern.rivettools import snapshot_histos
+    from cern.histogramming import HistoStream, merge_histos
+    from cern.tools import LatencyStats, encode_binary, json_default
+    import rivet
+
+    ah = rivet.AnalysisHandler()
+    for analysis in analyses:
+        ah.addAnalysis(analysis)
+
+    pool = particles(1, 4 * SETTINGS['particles'])
+    rng = random.Random(1)
+    streams = dict((analysis, HistoStream(normalize=True)) for analysis in analyses)
+    stats = dict((name, LatencyStats()) for name in ['snapshot', 'delta', 'json', 'binary'])
+    sizes = {'json': 0, 'binary': 0}
+
+    for i in range(updates):
+        for n in xrange(SETTINGS['histointerval']):
+            offset = rng.randint(0, 3 * SETTINGS['particles'])
+            ah.analyze(pool[offset:offset + SETTINGS['particles']])
+
+        with stats['snapshot'].measure():
+            histos = merge_histos([snapshot_histos(ah)])
+
+        for analysis in analyses:
+            with stats['delta'].measure():
+                content = streams[analysis].encode([h for h in histos if h['annotations']['Path'].split('/')[1] == analysis])
+            message = {'type': 'histos_update', 'content': content, 'analysis': analysis}
+            with stats['json'].measure():
+                sizes['json'] += len(json.dumps(message, default=json_default))
+            with stats['binary'].measure():
+                sizes['binary'] += len(encode_binary(message))
+
+    results = dict((name, s.stats()) for name, s in stats.items())
+    for name, size in sizes.items():
+        results[name]['bytes'] = size / (updates * len(analyses))
+    return results
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.
+    output = sys.argv[3] if len(sys.argv) > 3 else 'pipeline.json'
+
+    os.environ.update({
+        'BENCH_RATE': str(rate),
+        'BENCH_PARTICLES': str(SETTINGS['particles']),
+        'BENCH_HISTOS': str(SETTINGS['histos']),
+        'BENCH_BINS': str(SETTINGS['bins']),
+        'BENCH_ANALYSES': str(SETTINGS['analyses'])
+        })
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        sandbox(tmpdir, events)
+
+        # The server modules read the `config.ini` of the sandbox and use
+        # the stub `rivet` and `yoda` modules
+        sys.path[0:0] = [tmpdir, STUBS, ROOT]
+
+        import rivet
+        write_refdata(tmpdir)
+        analyses = rivet.ANALYSES
+
+        import main
+        import tornado.web
+        import tornado.netutil
+        import tornado.httpserver
+        from cern.tools import WSPump
+        from cern.pool import SimulationPool
+        from cern.cache import FinalResultCache
+        from cern.simulation import RivetPool
+
+        # As in `main.py` (processes forked before any thread is started)
+        main.pump = WSPump()
+        finals = FinalResultCache.instance()
+        rivets = RivetPool.instance()
+        main.pool = SimulationPool(1, 0)
+
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1', socket.AF_INET)
+        port = sockets[0].getsockname()[1]
+        server = tornado.httpserver.HTTPServer(tornado.web.Application([(r'/ws', main.WSHandler)]))
+        server.add_sockets(sockets)
+
+        timeout = max(60., 10 * events / rate if rate else 600.)
+        runs = collections.OrderedDict()
+        runs['simulation'] = run_simulation(analyses, 1001)
+        runs['websocket'] = run_websocket(port, analyses, 1002, True, timeout)
+        runs['websocket-json'] = run_websocket(port, analyses, 1003, False, timeout)
+
+        results = {
+            'benchmark': 'pipeline',
+            'commit': commit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'settings': dict(SETTINGS, events=events, rate=rate,
+                transport=main.config.get('transport', 'backend'), shards=main.config.getint('simulation', 'shards')),
+            'runs': runs,
+            'conversion': conversion(analyses, 20)
+            }
+
+        server.stop()
+        main.pool.shutdown()
+        rivets.shutdown()
+        finals.workers.terminate()
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print "{:>15} {:>10} {:>10} {:>12} {:>9} {:>12}".format('run', 'events/s', '1st histo', 'updates', 'messages', 'kB/s')
+    for name, run in runs.items():
+        print "{:>15} {:>10.0f} {:>10.3f} {:>12} {:>9} {:>12.1f}".format(
+            name, run['events_per_s'], run['first_histogram_s'] or float('nan'), run['updates'], run['messages'], run['bytes_per_s'] / 1024)
+
+    print "{:>15} {:>10} {:>10} {:>12}".format('update', 'mean (ms)', 'p99 (ms)', 'bytes')
+    for name in ['snapshot', 'delta', 'json', 'binary']:
+        stats = results['conversion'][name]
+        print "{:>15} {:>10.3f} {:>10.3f} {:>12}".format(name, stats['mean_ms'], stats['p99_ms'], stats.get('bytes', ''))
+
+    print "Results written to {}".format(output)
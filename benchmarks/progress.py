@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the progress reporting of the event loop.
+
+A producer process runs a loop of cheap "events" and reports its progress
+through a `multiprocessing.Queue` drained by the parent (like the Rivet
+process and `Simulation`), either:
+
+- `per-event`: one message per event (previous implementation)
+- `batched`: at most one message every `PROGRESS_INTERVAL` (`ProgressMeter`)
+
+Usage: python benchmarks/progress.py [events]
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.tools import ProgressMeter
+
+
+def event():
+    """
+    Stand-in for the processing of a simple event.
+    """
+
+    return sum(xrange(50))
+
+
+def per_event(_q, events):
+    for evtnum in xrange(1, events + 1):
+        event()
+        _q.put(['rivet', "Event no. {} processed\n".format(evtnum)])
+    _q.put(None)
+
+
+def batched(_q, events):
+    meter = ProgressMeter()
+    for evtnum in xrange(1, events + 1):
+        event()
+        if meter.due():
+            _q.put(['progress', 0, evtnum, meter.rate(evtnum)])
+    _q.put(['progress', 0, events, meter.rate(events)])
+    _q.put(None)
+
+
+def measure(target, events):
+    """
+    Events per second and number of messages of the `target` loop,
+    including the time needed by the parent to receive the messages.
+    """
+
+    _q = multiprocessing.Queue()
+    start = time.time()
+    p = multiprocessing.Process(target=target, args=(_q, events))
+    p.start()
+
+    messages = 0
+    while _q.get() is not None:
+        messages += 1
+    p.join()
+
+    return events / (time.time() - start), messages
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    print "{:>10} {:>14} {:>10}".format('mode', 'events/s', 'messages')
+    for name, target in [('per-event', per_event), ('batched', batched)]:
+        rate, messages = measure(target, events)
+        print "{:>10} {:>14.0f} {:>10}".format(name, rate, messages)
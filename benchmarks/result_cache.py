@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the result cache lookups (`cern/cache.py`) under load.
+
+`threads` threads look up the results of `runs` parameter sets (stored
+first) with the `backend` (`mongo` or `sqlite`, by default the one
+configured in `config.ini`), with the LRU cache in front of it (as the
+simulations do) and without it, i.e. a new connection to the backend for
+each run (previous implementation). The `sqlite` backend uses a
+temporary database, so that no MongoDB server is needed.
+
+Usage: python benchmarks/result_cache.py [threads] [runs] [backend]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.cache import ResultCache, params_key
+from cern.tools import LatencyStats, PythiaDB, SQLiteDB
+
+import ConfigParser
+
+config = ConfigParser.RawConfigParser()
+config.read(os.path.join(sys.path[0], 'config.ini'))
+
+
+def params(i):
+    return {'Main:numberOfEvents': '1000', 'Beams:eCM': str(7000 + i), '_analysis': 'BENCH'}
+
+
+def backend_factory(backend, tmpdir):
+    """
+    Function returning a new connection to the `backend`.
+    """
+
+    if backend == 'sqlite':
+        filename = os.path.join(tmpdir, 'results.db')
+        return lambda: SQLiteDB(filename)
+
+    return lambda: PythiaDB(params_key,
+        config.get('mongodb', 'host'),
+        config.getint('mongodb', 'port'),
+        config.getint('mongodb', 'pool_size'),
+        config.getint('mongodb', 'timeout'))
+
+
+def load(lookup, threads, runs):
+    """
+    Latency of `lookup` called for each run by each thread.
+    """
+
+    latency = LatencyStats(threads * runs)
+
+    def work():
+        for i in range(runs):
+            with latency.measure():
+                lookup(params(i))
+
+    workers = [threading.Thread(target=work) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return latency.stats()
+
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    backend = sys.argv[3] if len(sys.argv) > 3 else config.get('cache', 'backend')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        new_backend = backend_factory(backend, tmpdir)
+
+        results = ResultCache(new_backend(), config.getint('cache', 'lru_size'))
+        for i in range(runs):
+            results.add(params(i), "final-bench-{}.yoda".format(i), 1000)
+
+        modes = [
+            ('new client', lambda p: new_backend().lookup(params_key(p))),
+            ('shared', results.get)
+            ]
+
+        print "backend: {}".format(backend)
+        print "{:>12} {:>10} {:>10} {:>10}".format('mode', 'mean (ms)', 'p99 (ms)', 'max (ms)')
+        for name, lookup in modes:
+            stats = load(lookup, threads, runs)
+            print "{:>12} {:>10.3f} {:>10.3f} {:>10.3f}".format(name, stats['mean_ms'], stats['p99_ms'], stats['max_ms'])
+
+        for i in range(runs):
+            results.remove(params(i))
+    finally:
+        shutil.rmtree(tmpdir, True)
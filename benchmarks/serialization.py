@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the histogram conversion (yoda object to dict).
+
+Compare, for Histo1D with different numbers of bins, the previous
+representation (one dict per bin, with all the derived values) and
+the columnar one (one array per field, see `cern/histogramming.py`):
+
+- conversion time per histogram
+- size of the JSON message per histogram
+- size of the raw float64 columns (binary frames)
+
+Usage: python benchmarks/serialization.py [repeats]
+"""
+
+import os
+import sys
+import json
+import random
+import timeit
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.histogramming import Histogram
+from cern.tools import json_default
+
+import rivet
+import yoda
+
+NBINS = [10, 50, 200, 1000]
+
+
+def legacy_toDict(histogram):
+    """
+    Previous conversion: one dict per bin.
+    """
+
+    plotparser = rivet.PlotParser()
+
+    bins = []
+    for bin in histogram.bins():
+        mean = 0
+        rms = 0
+        stdDev = 0
+        stdErr = 0
+        try:
+            mean = bin.mean
+            rms = bin.rms
+            stdDev = bin.stdDev
+            stdErr = bin.stdErr
+        except:
+            pass
+
+        bins.append({
+            '_type': 'Histo1D',
+            '_yRangeLow': bin.height - bin.heightErr,
+            '_yRangeHigh': bin.height + bin.heightErr,
+            'area': bin.area,
+            'areaErr': bin.areaErr,
+            'edgeLow': bin.edges.low,
+            'edgeHigh': bin.edges.high,
+            'effNumEntries': bin.effNumEntries,
+            'focus': bin.focus,
+            'height': bin.height,
+            'heightErr': bin.heightErr,
+            'mean': mean,
+            'midpoint': bin.midpoint,
+            'numEntries': bin.numEntries,
+            'relErr': bin.relErr,
+            'rms': rms,
+            'stdDev': stdDev,
+            'stdErr': stdErr,
+            'sumW': bin.sumW,
+            'sumW2': bin.sumW2,
+            'sumWX': bin.sumWX,
+            'sumWX2': bin.sumWX2,
+            'width': bin.width
+            })
+
+    return {
+        'type': 'Histo1D',
+        'plotHeaders': plotparser.getHeaders(histogram.annotations()['Path']),
+        'annotations': histogram.annotations(),
+        'bins': bins,
+        'edgeLow': histogram.edges.low,
+        'edgeHigh': histogram.edges.high
+        }
+
+
+def make_histo(nbins):
+    """
+    Histo1D with `nbins` bins filled with random values.
+    """
+
+    histo = yoda.Histo1D(nbins, 0., 10., "/BENCH/d01-x01-y01")
+    for i in xrange(100 * nbins):
+        histo.fill(random.uniform(0., 10.), random.uniform(0.5, 1.5))
+    return histo
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    print "{:>6} {:>14} {:>14} {:>12} {:>12} {:>12}".format(
+        'bins', 'dicts (ms)', 'columns (ms)', 'dicts (B)', 'columns (B)', 'binary (B)')
+
+    for nbins in NBINS:
+        histo = make_histo(nbins)
+
+        legacy = legacy_toDict(histo)
+        columnar = Histogram(histo).toDict()
+
+        legacy_time = timeit.timeit(lambda: legacy_toDict(histo), number=repeats) / repeats
+        columnar_time = timeit.timeit(lambda: Histogram(histo).toDict(), number=repeats) / repeats
+
+        legacy_size = len(json.dumps(legacy))
+        columnar_size = len(json.dumps(columnar, default=json_default))
+        binary_size = sum(len(column) * column.itemsize for column in columnar['bins'].values())
+
+        print "{:>6} {:>14.3f} {:>14.3f} {:>12} {:>12} {:>12}".format(
+            nbins, legacy_time * 1000, columnar_time * 1000, legacy_size, columnar_size, binary_size)
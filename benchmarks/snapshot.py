@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the intermediate histogram snapshots of the Rivet event loop.
+
+Run an analysis over a HepMC file and report the number of events
+processed per second for several histogram update intervals, with:
+
+- `none`: no intermediate histograms
+- `disk`: yoda file written to (and read back from) the output directory
+- `memory`: `snapshot_histos` (tmpfs, see `snapshots` in `config.ini`)
+
+Usage: python benchmarks/snapshot.py ANALYSIS events.hepmc [max_events]
+"""
+
+import os
+import sys
+import time
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.rivettools import convert_histos, snapshot_histos
+
+import rivet
+import yoda
+import ConfigParser
+
+config = ConfigParser.RawConfigParser()
+config.read(os.path.join(sys.path[0], 'config.ini'))
+
+INTERVALS = [10, 100, 1000]
+
+
+def disk_snapshot(ah):
+    """
+    Previous implementation: yoda file in the output directory.
+    """
+
+    yodafile = os.path.join(config.get('paths', 'rivet_output'), "bench-{}.yoda".format(os.getpid()))
+    ah.writeData(yodafile)
+    histos = convert_histos(yoda.readYODA(yodafile))
+    os.unlink(yodafile)
+    return histos
+
+
+def events_per_second(analysis, hepmc, interval, snapshot, max_events):
+    """
+    Process at most `max_events` events of `hepmc`, taking a snapshot
+    every `interval` events.
+    """
+
+    ah = rivet.AnalysisHandler()
+    ah.setIgnoreBeams(True)
+    ah.addAnalysis(analysis)
+
+    run = rivet.Run(ah)
+    if not run.init(hepmc):
+        raise RuntimeError("Unable to read {}".format(hepmc))
+
+    evtnum = 0
+    start = time.time()
+    while evtnum < max_events and run.readEvent() and run.processEvent():
+        evtnum += 1
+        if snapshot and evtnum % interval == 0:
+            snapshot(ah)
+    elapsed = time.time() - start
+
+    run.finalize()
+
+    return evtnum / elapsed if elapsed > 0 else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(1)
+
+    analysis = sys.argv[1]
+    hepmc = sys.argv[2]
+    max_events = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+
+    rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+
+    methods = [('none', None), ('disk', disk_snapshot), ('memory', snapshot_histos)]
+
+    print "{:>10} {:>12} {:>12} {:>12}".format('interval', *[m[0] for m in methods])
+    for interval in INTERVALS:
+        rates = [events_per_second(analysis, hepmc, interval, snapshot, max_events) for name, snapshot in methods]
+        print "{:>10} {:>12.1f} {:>12.1f} {:>12.1f}".format(interval, *rates)
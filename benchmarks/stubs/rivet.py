@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for Rivet used by `benchmarks/pipeline.py`.
+
+The analyses `BENCH_<i>` book `BENCH_HISTOS` histograms (`BENCH_BINS`
+bins each, environment variables read at import): the charged
+multiplicity and the transverse momentum of the first particles of
+each event, so that the benchmark measures the server rather than the
+analyses.
+"""
+
+import os
+import math
+import yoda
+
+HISTOS = int(os.environ.get('BENCH_HISTOS', 20))
+BINS = int(os.environ.get('BENCH_BINS', 50))
+ANALYSES = ["BENCH_{}".format(i) for i in range(int(os.environ.get('BENCH_ANALYSES', 4)))]
+
+
+def version():
+    return '2.0.0-bench'
+
+
+def addAnalysisLibPath(path):
+    pass
+
+
+class util(object):
+    @staticmethod
+    def check_python_version():
+        pass
+
+    @staticmethod
+    def set_process_name(name):
+        pass
+
+
+class AnalysisInfo(object):
+    """
+    Metadata of an analysis (see `ANALYSIS_DETAILS` in `cern/rivettools.py`).
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def summary(self):
+        return "Benchmark analysis {}".format(self._name)
+
+    def description(self):
+        return self.summary()
+
+    def authors(self):
+        return []
+
+    def references(self):
+        return []
+
+    def requiredBeams(self):
+        return []
+
+    def requiredEnergies(self):
+        return []
+
+    def bibKey(self):
+        return ''
+
+    def bibTeX(self):
+        return ''
+
+    def collider(self):
+        return 'LHC'
+
+    def experiment(self):
+        return 'BENCH'
+
+    def inspireId(self):
+        return ''
+
+    def spiresId(self):
+        return ''
+
+    def runInfo(self):
+        return ''
+
+    def status(self):
+        return 'VALIDATED'
+
+    def year(self):
+        return '2017'
+
+
+class AnalysisLoader(object):
+    @staticmethod
+    def analysisNames():
+        return list(ANALYSES)
+
+    @staticmethod
+    def getAnalysis(name):
+        return AnalysisInfo(name) if name in ANALYSES else None
+
+
+class Analysis(object):
+    """
+    Histograms of a `BENCH_<i>` analysis.
+    """
+
+    def __init__(self, name):
+        self.histos = [yoda.Histo1D(BINS, 0., 200., "/{}/d01-x01-y01".format(name), "Multiplicity")]
+        for i in range(1, HISTOS):
+            self.histos.append(yoda.Histo1D(BINS, 0., 5., "/{}/d{:02d}-x01-y01".format(name, i + 1), "pT"))
+
+    def analyze(self, particles):
+        self.histos[0].fill(len(particles))
+        for histo, line in zip(self.histos[1:], particles):
+            fields = line.split(None, 6)
+            histo.fill(math.hypot(float(fields[3]), float(fields[4])))
+
+
+class AnalysisHandler(object):
+    def __init__(self):
+        self.analyses = []
+        self.events = 0
+
+    def setIgnoreBeams(self, ignore):
+        pass
+
+    def addAnalysis(self, name):
+        if name not in ANALYSES:
+            raise ValueError("Unknown analysis {}".format(name))
+        self.analyses.append(Analysis(name))
+
+    def analyze(self, particles):
+        self.events += 1
+        for analysis in self.analyses:
+            analysis.analyze(particles)
+
+    def finalize(self):
+        # Histograms normalized to the number of events
+        for analysis in self.analyses:
+            for histo in analysis.histos:
+                histo.scaleW(1. / max(self.events, 1))
+
+    def writeData(self, filename):
+        yoda.writeYODA([h for analysis in self.analyses for h in analysis.histos], filename)
+
+
+class Run(object):
+    """
+    Event loop reading HepMC (IO_GenEvent) events.
+    """
+
+    def __init__(self, ah):
+        self.ah = ah
+        self._file = None
+        self._next = None
+        self._particles = []
+
+    def init(self, filename):
+        # Wait for the first event (kept for `readEvent`)
+        self._file = open(filename)
+        self._next = self._file.readline()
+        while self._next and not self._next.startswith('E '):
+            self._next = self._file.readline()
+        return bool(self._next)
+
+    def readEvent(self):
+        if not self._next:
+            return False
+
+        self._next = None
+        particles = []
+        for line in iter(self._file.readline, ''):
+            if line.startswith('P '):
+                particles.append(line)
+            elif line.startswith('E '):
+                self._next = line
+                break
+        self._particles = particles
+        return True
+
+    def processEvent(self):
+        self.ah.analyze(self._particles)
+        return True
+
+    def finalize(self):
+        if self._file:
+            self._file.close()
+
+
+class PlotParser(object):
+    def getHeaders(self, path):
+        return {'Title': path, 'XLabel': '$p_\\perp$ [GeV]', 'YLabel': '$1/N \\, dN/dp_\\perp$'}
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for yoda used by `benchmarks/pipeline.py`: Histo1D and
+Scatter2D objects read from (and written to) the YODA text format.
+"""
+
+import core
+from core import *
+
+
+def writeYODA(objects, filename):
+    """
+    Write yoda objects to a file (YODA text format).
+    """
+
+    with open(filename, 'w') as f:
+        for o in objects:
+            annotations = o.annotations()
+            if isinstance(o, Histo1D):
+                f.write("# BEGIN YODA_HISTO1D {}\n".format(o.path))
+                for key, value in sorted(annotations.items()):
+                    f.write("{}={}\n".format(key, value))
+                f.write("# ID\t ID\t sumw\t sumw2\t sumwx\t sumwx2\t numEntries\n")
+                for label, dbn in [('Total', o.totalDbn), ('Underflow', o.underflow), ('Overflow', o.overflow)]:
+                    f.write("{0}\t{0}\t{1!r}\t{2!r}\t{3!r}\t{4!r}\t{5}\n".format(label, *dbn.values()))
+                f.write("# xlow\t xhigh\t sumw\t sumw2\t sumwx\t sumwx2\t numEntries\n")
+                for b in o.bins():
+                    f.write("{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{}\n".format(b.edges.low, b.edges.high, *b.values()))
+                f.write("# END YODA_HISTO1D\n\n")
+            else:
+                f.write("# BEGIN YODA_SCATTER2D {}\n".format(o.path))
+                for key, value in sorted(annotations.items()):
+                    f.write("{}={}\n".format(key, value))
+                f.write("# xval\t xerr-\t xerr+\t yval\t yerr-\t yerr+\n")
+                for p in o.points():
+                    f.write("{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{!r}\n".format(*p.values()))
+                f.write("# END YODA_SCATTER2D\n\n")
+
+
+def _histo1D(annotations, rows):
+    histo = Histo1D(path=annotations.get('Path', ''))
+    histo._annotations.update(annotations)
+    dbns = {}
+    for row in rows:
+        if row[0] in ('Total', 'Underflow', 'Overflow'):
+            dbns[row[0]] = Dbn1D(*[float(v) for v in row[2:6]] + [int(row[6])])
+        else:
+            histo._bins.append(HistoBin1D(float(row[0]), float(row[1]), *[float(v) for v in row[2:6]] + [int(row[6])]))
+
+    histo.totalDbn = dbns.get('Total', Dbn1D())
+    histo.underflow = dbns.get('Underflow', Dbn1D())
+    histo.overflow = dbns.get('Overflow', Dbn1D())
+    if histo._bins:
+        histo.edges = Edges(histo._bins[0].edges.low, histo._bins[-1].edges.high)
+    return histo
+
+
+def _scatter2D(annotations, rows):
+    scatter = Scatter2D([Point2D(*[float(v) for v in row]) for row in rows])
+    scatter._annotations.update(annotations)
+    return scatter
+
+
+def readYODA(filename):
+    """
+    List of the yoda objects of a file (YODA text format).
+    """
+
+    objects = []
+    kind = None
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('# BEGIN '):
+                kind, annotations, rows = line.split()[2], {}, []
+            elif line.startswith('# END '):
+                objects.append(_histo1D(annotations, rows) if kind == 'YODA_HISTO1D' else _scatter2D(annotations, rows))
+                kind = None
+            elif kind is None or not line or line.startswith('#'):
+                continue
+            elif '=' in line and not line[0].isdigit() and line[0] not in '-.':
+                key, value = line.split('=', 1)
+                annotations[key] = value
+            else:
+                rows.append(line.split())
+
+    return objects
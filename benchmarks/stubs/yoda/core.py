@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for the histogram classes of yoda (what the server and the
+benchmarks use).
+"""
+
+import math
+
+
+class Dbn1D(object):
+    """
+    Raw statistics of a distribution.
+    """
+
+    def __init__(self, sumW=0., sumW2=0., sumWX=0., sumWX2=0., numEntries=0):
+        self.sumW = sumW
+        self.sumW2 = sumW2
+        self.sumWX = sumWX
+        self.sumWX2 = sumWX2
+        self.numEntries = numEntries
+
+    def fill(self, x, w=1.):
+        self.sumW += w
+        self.sumW2 += w * w
+        self.sumWX += w * x
+        self.sumWX2 += w * x * x
+        self.numEntries += 1
+
+    def scaleW(self, factor):
+        self.sumW *= factor
+        self.sumW2 *= factor * factor
+        self.sumWX *= factor
+        self.sumWX2 *= factor
+
+    def values(self):
+        return [self.sumW, self.sumW2, self.sumWX, self.sumWX2, self.numEntries]
+
+    # Derived values (as yoda, the moments raise an exception when the
+    # distribution is empty)
+
+    @property
+    def effNumEntries(self):
+        return self.sumW ** 2 / self.sumW2 if self.sumW2 else 0.
+
+    @property
+    def mean(self):
+        return self.sumWX / self.sumW
+
+    @property
+    def variance(self):
+        return (self.sumWX2 - self.sumWX ** 2 / self.sumW) / (self.sumW - self.sumW2 / self.sumW)
+
+    @property
+    def stdDev(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def stdErr(self):
+        return self.stdDev / math.sqrt(self.effNumEntries)
+
+    @property
+    def rms(self):
+        return math.sqrt(self.sumWX2 / self.sumW)
+
+
+class Edges(object):
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+
+class HistoBin1D(Dbn1D):
+    def __init__(self, low, high, *values):
+        Dbn1D.__init__(self, *values)
+        self.edges = Edges(low, high)
+
+    @property
+    def width(self):
+        return self.edges.high - self.edges.low
+
+    @property
+    def midpoint(self):
+        return (self.edges.low + self.edges.high) / 2
+
+    @property
+    def focus(self):
+        return self.mean if self.sumW else self.midpoint
+
+    @property
+    def area(self):
+        return self.sumW
+
+    @property
+    def areaErr(self):
+        return math.sqrt(self.sumW2)
+
+    @property
+    def height(self):
+        return self.area / self.width
+
+    @property
+    def heightErr(self):
+        return self.areaErr / self.width
+
+    @property
+    def relErr(self):
+        return self.areaErr / self.area if self.area else 0.
+
+
+class Histo1D(object):
+    """
+    Histogram with uniform bins.
+    """
+
+    def __init__(self, nbins=0, low=0., high=1., path='', title=''):
+        self._annotations = {'Path': path, 'Title': title, 'Type': 'Histo1D'}
+        width = (high - low) / nbins if nbins else 0.
+        self._bins = [HistoBin1D(low + i * width, low + (i + 1) * width) for i in range(nbins)]
+        self.edges = Edges(low, high)
+        self.totalDbn = Dbn1D()
+        self.underflow = Dbn1D()
+        self.overflow = Dbn1D()
+
+    @property
+    def path(self):
+        return self._annotations['Path']
+
+    def annotations(self):
+        return dict(self._annotations)
+
+    def bins(self):
+        return self._bins
+
+    def fill(self, x, w=1.):
+        self.totalDbn.fill(x, w)
+        if x < self.edges.low:
+            self.underflow.fill(x, w)
+        elif x >= self.edges.high:
+            self.overflow.fill(x, w)
+        else:
+            i = int((x - self.edges.low) / (self.edges.high - self.edges.low) * len(self._bins))
+            self._bins[min(i, len(self._bins) - 1)].fill(x, w)
+
+    def scaleW(self, factor):
+        for dbn in self._bins + [self.totalDbn, self.underflow, self.overflow]:
+            dbn.scaleW(factor)
+
+    def normalize(self, area=1.):
+        integral = sum(b.sumW for b in self._bins)
+        if integral:
+            self.scaleW(area / integral)
+
+
+class Errs(object):
+    def __init__(self, minus, plus):
+        self.minus = minus
+        self.plus = plus
+
+
+class Point2D(object):
+    def __init__(self, x, xErrMinus, xErrPlus, y, yErrMinus, yErrPlus):
+        self.x = x
+        self.xErrs = Errs(xErrMinus, xErrPlus)
+        self.y = y
+        self.yErrs = Errs(yErrMinus, yErrPlus)
+
+    def values(self):
+        return [self.x, self.xErrs.minus, self.xErrs.plus, self.y, self.yErrs.minus, self.yErrs.plus]
+
+
+class Scatter2D(object):
+    def __init__(self, points=(), path='', title=''):
+        self._annotations = {'Path': path, 'Title': title, 'Type': 'Scatter2D'}
+        self._points = list(points)
+
+    @property
+    def path(self):
+        return self._annotations['Path']
+
+    def annotations(self):
+        return dict(self._annotations)
+
+    def points(self):
+        return self._points
+
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the transports of the events (`cern/transport.py`).
+
+A fake generator (a Python subprocess writing HepMC-like events, in place
+of PYTHIA) streams `events` events to a reader process (in place of
+Rivet) through each transport. The reader is started after
+`Transport.wait_ready`, or after a fixed `sleep(0.5)` for `fifo+sleep`
+(previous implementation). Reported per transport: the time to the first
+event read (from the start of the generator) and the events per second
+(from the start of the generator to the last event read).
+
+Usage: python benchmarks/transport.py [events]
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+
+# Run from the root of the repository (`config.ini`, `cern` module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cern.transport import TRANSPORTS, close_inherited
+
+# Writes `argv[2]` events of about 2 kB to `argv[1]`
+GENERATOR = """
+import sys
+particle = "P 10001 211 1.0e+00 2.0e+00 3.0e+00 4.0e+00 1.4e-01 1 0 0 0 0\\n"
+with open(sys.argv[1], 'w') as f:
+    for i in xrange(int(sys.argv[2])):
+        f.write("E {} 0 -1.0 -1.0 -1.0 0 0 30 0 0 0 0\\n".format(i) + particle * 24)
+"""
+
+
+def read_events(transport, start, _q):
+    """
+    Count the events read from the `transport`, report the times of the
+    first and last events (relative to `start`).
+    """
+
+    close_inherited(transport)
+
+    events = 0
+    first = None
+    with open(transport.reader_path, 'r') as f:
+        for line in f:
+            if line.startswith('E '):
+                events += 1
+                if first is None:
+                    first = time.time() - start
+
+    _q.put((events, first, time.time() - start))
+
+
+def measure(name, events, sleep=False):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with TRANSPORTS[name](tmpdir, 'events', 1024 * 1024) as transport:
+            start = time.time()
+            generator = subprocess.Popen([sys.executable, '-c', GENERATOR, transport.writer_path, str(events)],
+                preexec_fn=transport.preexec)
+            transport.started()
+
+            if sleep:
+                time.sleep(0.5)
+            elif not transport.wait_ready(lambda: generator.poll() is None):
+                raise RuntimeError("{}: no events".format(name))
+
+            _q = multiprocessing.Queue()
+            reader = multiprocessing.Process(target=read_events, args=(transport, start, _q))
+            reader.start()
+            result = _q.get()
+            reader.join()
+            generator.wait()
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+    read, first, total = result
+    assert read == events, (name, read)
+    return first, events / total
+
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    print "{:>12} {:>18} {:>12}".format('transport', 'first event (ms)', 'events/s')
+    for label, name, sleep in [('fifo+sleep', 'fifo', True), ('fifo', 'fifo', False), ('pipe', 'pipe', False), ('file', 'file', False)]:
+        first, rate = measure(name, events, sleep)
+        print "{:>12} {:>18.1f} {:>12.0f}".format(label, first * 1000, rate)
@@ -0,0 +1,680 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of the results of the simulations.
+
+The results are stored by a `PythiaDB` (MongoDB) or `SQLiteDB` backend
+(see the `cache` section of `config.ini`) under the key of their
+parameter set (`params_key`), with an in-process LRU cache in front of it.
+
+The converted reference histograms of the analyses are kept in memory
+by the `RefDataCache`, and the histograms of the final yoda files by the
+`FinalResultCache`. The events generated by PYTHIA are kept on disk by
+the `EventStore`.
+"""
+
+from rivettools import convert_histos
+from histogramming import histos_nbytes
+from cmnd import CmndFile
+from tools import PythiaDB, SQLiteDB, LatencyStats, DB_ERRORS
+from metrics import Metrics
+
+import collections
+import multiprocessing
+import threading
+import hashlib
+import json
+import glob
+import gzip
+import tempfile
+import time
+import traceback
+import ConfigParser
+import yoda
+import os
+import sys
+
+# Import configuration (paths to PYTHIA and Rivet...)
+# See `config.ini` file
+config = ConfigParser.RawConfigParser()
+config.read(os.path.join(sys.path[0], 'config.ini'))
+
+# Seconds during which the result store is not used after an error, when
+# it is not health-checked (see `ResultCache`)
+RETRY_INTERVAL = 10
+
+# Entries stored with the parameters which are not part of the key
+RESULT_FIELDS = ['_id', '_key', '_yoda', '_events']
+
+# Equivalent spellings of the PYTHIA flags
+FLAGS = {'on': 'on', 'yes': 'on', 'true': 'on', 'off': 'off', 'no': 'off', 'false': 'off'}
+
+
+def normalize_params(p):
+    """
+    Canonical form of the parameter set `p`.
+
+    PYTHIA setting names are case insensitive, numbers and flags can be
+    written in different ways ("7000", "7000.", "7.0e3", "on", "yes"...).
+    The internal `_` entries (`_analysis`...) are kept as they are.
+    """
+
+    norm = dict()
+    for name, value in p.items():
+        if name in RESULT_FIELDS:
+            continue
+        if name.startswith('_'):
+            norm[name] = value
+            continue
+
+        value = str(value).strip()
+        try:
+            value = repr(float(value))
+        except ValueError:
+            value = FLAGS.get(value.lower(), value)
+        norm[' '.join(name.split()).lower()] = value
+
+    return norm
+
+
+def params_key(p):
+    """
+    Key (SHA-1 hex digest) of the parameter set `p` (with the analysis).
+    """
+
+    return hashlib.sha1(json.dumps(sorted(normalize_params(p).items()))).hexdigest()
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping keeping the most recently used items, up to a
+    total size of `maxsize` (the number of items, or the sum of the
+    `sizeof` the items, e.g. in bytes).
+    """
+
+    def __init__(self, maxsize=128, sizeof=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.maxsize and len(self._items) > 1:
+                self._remove(next(iter(self._items)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._remove(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def keys(self):
+        """
+        The keys, from the least recently used.
+        """
+
+        with self._lock:
+            return list(self._items)
+
+    def stats(self):
+        return {'items': len(self._items), 'size': self.size, 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def _remove(self, key, default=None):
+        """
+        (must be called with `self._lock` acquired)
+        """
+
+        try:
+            value, size = self._items.pop(key)
+        except KeyError:
+            return default
+        self.size -= size
+        return value
+
+
+class ResultCache(object):
+    """
+    Yoda files of the runs, by parameter set, with their number of events
+    (fewer than the `Main:numberOfEvents` of the parameters for the
+    checkpoint of a stopped run, more for continued results).
+
+    Lookups go through the LRU cache first: hits do not touch the backend.
+    The backend is checked every `health_interval` seconds: while it is
+    down, lookups are misses (the simulations run) instead of errors, and
+    the results are not stored.
+    Without health checks, the backend is used again `RETRY_INTERVAL`
+    seconds after an error.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, backend, size=1024, health_interval=0):
+        """
+        `backend` the store (`PythiaDB` or `SQLiteDB`)
+        `size` the number of entries of the LRU cache
+        `health_interval` the time (s) between two health checks (0: none)
+        """
+
+        self.backend = backend
+        self.lru = LRUCache(size)
+        self.healthy = True
+        self.monitored = health_interval > 0
+        self.failed = None
+
+        # Whether the backend has been set up (see `_setup`)
+        self.ready = False
+
+        self.latency = {
+            'get': LatencyStats(),
+            'lookup': LatencyStats(),
+            'ping': LatencyStats()
+            }
+
+        self._setup()
+
+        if health_interval > 0:
+            monitor = threading.Thread(target=self._monitor, args=(health_interval,), name="ResultCacheMonitor")
+            monitor.daemon = True
+            monitor.start()
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide cache, with a single (pooled) connection to the
+        backend shared by all the simulations (created on first use, see
+        `config.ini`).
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                if config.get('cache', 'backend') == 'sqlite':
+                    backend = SQLiteDB(config.get('cache', 'sqlite'))
+                else:
+                    backend = PythiaDB(params_key,
+                        config.get('mongodb', 'host'),
+                        config.getint('mongodb', 'port'),
+                        config.getint('mongodb', 'pool_size'),
+                        config.getint('mongodb', 'timeout'))
+                cls._instance = cls(backend, config.getint('cache', 'lru_size'), config.getfloat('cache', 'health_interval'))
+
+            return cls._instance
+
+    @classmethod
+    def current(cls):
+        """
+        Process-wide cache if it has been created, None otherwise (does not
+        connect to the backend, e.g. from the IOLoop).
+        """
+
+        return cls._instance
+
+    def get(self, p):
+        """
+        Yoda file and number of events of the results of the parameters `p`
+        (`(yodafile, events)`), None if unknown.
+        """
+
+        with self.latency['get'].measure():
+            entry = self._get(p)
+
+        Metrics.instance().inc('t4t_result_cache_lookups_total', (('result', 'miss' if entry is None else 'hit'),))
+        return entry
+
+    def _get(self, p):
+        key = params_key(p)
+        entry = self.lru.get(key)
+        if entry is None and self._available():
+            try:
+                with self.latency['lookup'].measure():
+                    doc = self.backend.lookup(key)
+            except DB_ERRORS:
+                self._failure()
+                return None
+
+            if doc is None:
+                return None
+            # Documents stored before the number of events was recorded
+            # are complete runs
+            entry = (str(doc['_yoda']), int(doc.get('_events', p.get('Main:numberOfEvents', 1000))))
+            self.lru.put(key, entry)
+
+        return entry
+
+    def add(self, p, yodafile, events):
+        """
+        Store (or update) the `yodafile` of the results of the parameters
+        `p`, obtained with `events` events.
+        """
+
+        key = params_key(p)
+        doc = dict(p)
+        doc['_yoda'] = yodafile
+        doc['_events'] = events
+        self.lru.put(key, (yodafile, events))
+
+        if not self._available():
+            return
+        try:
+            self.backend.store(key, doc)
+        except DB_ERRORS:
+            self._failure()
+
+    def remove(self, p):
+        key = params_key(p)
+        self.lru.pop(key)
+
+        if not self._available():
+            return
+        try:
+            self.backend.remove(key)
+        except DB_ERRORS:
+            self._failure()
+
+    def check(self):
+        """
+        Health check of the backend.
+        """
+
+        try:
+            with self.latency['ping'].measure():
+                self.backend.ping()
+        except DB_ERRORS:
+            if self.healthy:
+                traceback.print_exc()
+            self.healthy = False
+        else:
+            self.healthy = True
+            if not self.ready:
+                self._setup()
+
+        return self.healthy
+
+    def _setup(self):
+        """
+        Prepare the backend (indexes). If it is down, the cache is created
+        anyway (lookups are misses) and the backend is set up again once
+        it is available.
+        """
+
+        try:
+            self.backend.setup()
+        except DB_ERRORS:
+            self._failure()
+        else:
+            self.ready = True
+
+    def _failure(self):
+        """
+        Error of the backend (not used until it is healthy again).
+        """
+
+        traceback.print_exc()
+        self.healthy = False
+        self.failed = time.time()
+
+    def _available(self):
+        """
+        Whether the backend can be used (retried after `RETRY_INTERVAL`
+        seconds if there are no health checks).
+        """
+
+        if not self.healthy and not self.monitored and time.time() - self.failed >= RETRY_INTERVAL:
+            self.healthy = True
+            if not self.ready:
+                self._setup()
+        return self.healthy
+
+    def stats(self):
+        stats = {'healthy': self.healthy, 'lru': self.lru.stats()}
+        for name, latency in self.latency.items():
+            stats[name] = latency.stats()
+        return stats
+
+    def _monitor(self, interval):
+        while True:
+            time.sleep(interval)
+            self.check()
+
+
+class RefDataCache(object):
+    """
+    Converted reference histograms, by analysis.
+
+    The refdata files are read and converted once: an entry is reloaded
+    when its file is modified (mtime). The cache is bounded by memory
+    (`maxbytes`), the least recently used analyses being evicted first.
+    The histograms are shared by the simulations and must not be modified.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, refdata, maxbytes):
+        """
+        `refdata` the directory of the refdata files (`<analysis>.yoda`)
+        `maxbytes` the memory available for the histograms
+        """
+
+        self.refdata = refdata
+        self.lru = LRUCache(maxbytes, lambda entry: histos_nbytes(entry[1]))
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide cache (created on first use, see `config.ini`).
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(config.get('paths', 'refdata'), config.getint('refdata', 'max_mb') * 1024 * 1024)
+
+            return cls._instance
+
+    def get(self, analysis):
+        """
+        Reference histograms of `analysis`, None if there is no refdata.
+        """
+
+        filename = os.path.join(self.refdata, "{}.yoda".format(analysis))
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return None
+
+        entry = self.lru.get(analysis)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, convert_histos(yoda.readYODA(filename)))
+            self.lru.put(analysis, entry)
+
+        return entry[1]
+
+    def prewarm(self, analyses):
+        """
+        Load the reference histograms of `analyses`.
+        """
+
+        for analysis in analyses:
+            try:
+                self.get(analysis)
+            except Exception:
+                traceback.print_exc()
+
+
+def load_final(filename):
+    """
+    Converted histograms of a final yoda file, None if it cannot be read.
+
+    (run by the workers of the `FinalResultCache`)
+    """
+
+    try:
+        return convert_histos(yoda.readYODA(filename))
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+class FinalResultCache(object):
+    """
+    Converted histograms of the final yoda files, by file.
+
+    The final files are never modified once written: a file is identified
+    by its path, inode, size and mtime, so an entry is never outdated.
+    The cache is bounded by memory (`maxbytes`, LRU eviction) and the
+    misses of `load` are converted in parallel by a pool of `workers`
+    processes. The histograms are shared and must not be modified.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, maxbytes, workers):
+        self.lru = LRUCache(maxbytes, histos_nbytes)
+        self.workers = multiprocessing.Pool(workers)
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide cache (see `config.ini`).
+
+        (should be created before the threads of the server are started,
+        as the worker processes are forked)
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(config.getint('cache', 'final_mb') * 1024 * 1024, config.getint('cache', 'final_workers'))
+
+            return cls._instance
+
+    def get(self, filename):
+        """
+        Histograms of `filename` (converted by the calling thread if they
+        are not in the cache), None if the file cannot be read.
+        """
+
+        key = self._key(filename)
+        if key is None:
+            return None
+
+        histos = self.lru.get(key)
+        if histos is None:
+            histos = load_final(filename)
+            if histos is not None:
+                self.lru.put(key, histos)
+
+        return histos
+
+    def put(self, filename, histos):
+        """
+        Keep the `histos` of the new final file `filename`.
+        """
+
+        key = self._key(filename)
+        if key is not None:
+            self.lru.put(key, histos)
+
+    def load(self, filenames, callback):
+        """
+        Get the histograms of `filenames` without blocking: `callback` is
+        called with the list of their histograms (None for the files which
+        cannot be read), directly if they are all in the cache, otherwise
+        from another thread once the misses are converted.
+        """
+
+        keys = [self._key(filename) for filename in filenames]
+        results = [self.lru.get(key) if key is not None else None for key in keys]
+        misses = [i for i, key in enumerate(keys) if key is not None and results[i] is None]
+
+        if not misses:
+            callback(results)
+            return
+
+        def loaded(histos):
+            for i, h in zip(misses, histos):
+                results[i] = h
+                if h is not None:
+                    self.lru.put(keys[i], h)
+            callback(results)
+
+        self.workers.map_async(load_final, [filenames[i] for i in misses], callback=loaded)
+
+    def _key(self, filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (os.path.realpath(filename), stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class EventStore(object):
+    """
+    Compressed HepMC events generated by PYTHIA, by generator settings.
+
+    The events of a complete PYTHIA run are recorded (see `EventRecorder`)
+    under the key of the generator and the parameters of its cmnd file
+    (including the random seed, whatever the analysis), and replayed by
+    the next runs with the same settings (see `EventReplay`). The store is
+    bounded by disk space (`maxbytes`), the least recently used event
+    files being removed first.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, directory, maxbytes):
+        """
+        `directory` the directory of the event files (`<key>.hepmc.gz`)
+        `maxbytes` the disk space available for the events (0: disabled)
+        """
+
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+
+        if self.enabled and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide store (see `config.ini`).
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(config.get('events', 'directory'), config.getint('events', 'max_mb') * 1024 * 1024)
+
+            return cls._instance
+
+    @property
+    def enabled(self):
+        return self.maxbytes > 0
+
+    def key(self, generator, cmndfile):
+        """
+        Key of the events generated by `generator` with `cmndfile`.
+        """
+
+        p = dict(CmndFile(cmndfile).params)
+        p['_generator'] = generator
+        return params_key(p)
+
+    def filename(self, key):
+        return os.path.join(self.directory, "{}.hepmc.gz".format(key))
+
+    def get(self, key):
+        """
+        Event file of `key`, None if the events are not stored.
+        """
+
+        filename = self.filename(key)
+        try:
+            # Most recently used
+            os.utime(filename, None)
+        except OSError:
+            return None
+        return filename
+
+    def recorder(self, key):
+        return EventRecorder(self, key)
+
+    def evict(self):
+        """
+        Remove the least recently used event files exceeding `maxbytes`.
+        """
+
+        with self._lock:
+            files = []
+            for filename in glob.glob(os.path.join(self.directory, "*.hepmc.gz")):
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filename))
+
+            size = sum(f[1] for f in files)
+            for mtime, filesize, filename in sorted(files):
+                if size <= self.maxbytes:
+                    break
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                size -= filesize
+
+    def stats(self):
+        files = glob.glob(os.path.join(self.directory, "*.hepmc.gz"))
+        return {'files': len(files), 'size': sum(os.path.getsize(f) for f in files if os.path.exists(f)), 'maxsize': self.maxbytes}
+
+
+class EventRecorder(object):
+    """
+    Events of a PYTHIA run being written to the `EventStore`.
+
+    The events are compressed to a temporary file, renamed once the run
+    is complete (`commit`), or removed (`abort`, also when the file
+    becomes larger than the store).
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+        fd, self.tmpfile = tempfile.mkstemp(suffix='.tmp', dir=store.directory)
+        self.file = os.fdopen(fd, 'wb')
+        self.gz = gzip.GzipFile(fileobj=self.file, mode='wb', compresslevel=1)
+
+    def write(self, data):
+        if self.gz is None:
+            return
+
+        self.gz.write(data)
+        if self.file.tell() > self.store.maxbytes:
+            self.abort()
+
+    def commit(self):
+        if self.gz is None:
+            return
+
+        self.gz.close()
+        self.file.close()
+        self.gz = None
+        os.rename(self.tmpfile, self.store.filename(self.key))
+        self.store.evict()
+
+    def abort(self):
+        if self.gz is None:
+            return
+
+        self.gz.close()
+        self.file.close()
+        self.gz = None
+        os.remove(self.tmpfile)
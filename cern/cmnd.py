@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+"""
+PYTHIA cmnd files.
+
+The cmnd files are parsed once (and again when they are modified) and
+never written: the parameters changed by a user are an overlay applied
+to a copy of the file written for each run (see `CmndFile.write`).
+"""
+
+import collections
+import threading
+import os
+
+
+def parse_line(line):
+    """
+    (name, value) of a cmnd file line, None if it does not set a parameter.
+    """
+
+    if line[0] in ['', '#', '!'] or '=' not in line:
+        return None
+
+    part = line.partition('=')
+    return part[0].strip(), part[2].partition('#')[0].partition('!')[0].strip()
+
+
+class CmndFile(object):
+    """
+    Parsed PYTHIA cmnd file (the parameters by name, in file order).
+    """
+
+    _cache = dict()
+    _lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        self.params = collections.OrderedDict()
+
+        with open(filename, 'r') as f:
+            self.lines = f.readlines()
+
+        for line in self.lines:
+            param = parse_line(line)
+            if param:
+                self.params[param[0]] = param[1]
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Parsed `filename` (cached until the file is modified).
+        """
+
+        mtime = os.path.getmtime(filename)
+        with cls._lock:
+            cmnd = cls._cache.get(filename)
+            if cmnd is None or cmnd.mtime != mtime:
+                cmnd = cls(filename)
+                cls._cache[filename] = cmnd
+
+            return cmnd
+
+    def effective(self, overlay=None):
+        """
+        Parameters of the file with the `overlay` (name: value) applied.
+        """
+
+        p = dict(self.params)
+        if overlay:
+            p.update(overlay)
+        return p
+
+    def write(self, filename, overlay):
+        """
+        Write a copy of the file with the `overlay` (name: value) applied
+        (the overlaid lines are replaced by lines at the end of the file).
+        """
+
+        with open(filename, 'w') as f:
+            for line in self.lines:
+                param = parse_line(line)
+                if not param or param[0] not in overlay:
+                    f.write(line if line.endswith('\n') else line + '\n')
+            for name, value in overlay.items():
+                f.write("{} = {}\n".format(name, value))
@@ -2,10 +2,68 @@
 
 """
 Histogram handling classes.
+
+Histograms are converted to columnar dicts: the bins (or points) are
+stored as one array of floats per field, e.g. `histo['bins']['sumW']`.
+Only the raw statistics are kept, the derived values (height, errors,
+mean...) are computed on the client side (see `HistoStats` in
+`static/js/histogram.js`). The plot options of the histograms are not
+part of the dicts, they are sent once per path (see `plot_headers`).
 """
 
 import rivet
 import yoda
+import math
+import array
+import threading
+
+# Raw statistics of a distribution, the only values which can be
+# combined (added) when merging histograms.
+DBN_FIELDS = ['sumW', 'sumW2', 'sumWX', 'sumWX2', 'numEntries']
+
+# Columns of the histograms (one array per field)
+COLUMNS = {
+    'Histo1D': ['edgeLow', 'edgeHigh'] + DBN_FIELDS,
+    'Scatter2D': ['x', 'xErrMinus', 'xErrPlus', 'y', 'yErrMinus', 'yErrPlus']
+    }
+
+# Values sent for each changed bin/point in the histogram deltas
+DELTA_FIELDS = {
+    'Histo1D': DBN_FIELDS,
+    'Scatter2D': COLUMNS['Scatter2D']
+    }
+
+# Name of the columns container of each type
+ELEMENTS = {
+    'Histo1D': 'bins',
+    'Scatter2D': 'points'
+    }
+
+
+# Rivet plot parser shared by all the histograms (see `plot_headers`)
+_plotparser = None
+_plotheaders = dict()
+_plotlock = threading.Lock()
+
+
+def plot_headers(path):
+    """
+    Plot options (title, labels, log axis...) of the histogram `path`,
+    read from Rivet's .plot files.
+
+    A single `rivet.PlotParser` is used and the headers are memoized
+    (they do not change while the server is running).
+    """
+
+    global _plotparser
+
+    with _plotlock:
+        if path not in _plotheaders:
+            if _plotparser is None:
+                _plotparser = rivet.PlotParser()
+            _plotheaders[path] = _plotparser.getHeaders(path)
+
+        return _plotheaders[path]
 
 
 class UnsupportedHistogramError(Exception):
@@ -20,6 +78,14 @@ class UnsupportedHistogramError(Exception):
         return repr(self.type)
 
 
+def _column(values=()):
+    """
+    Column of a histogram (array of doubles).
+    """
+
+    return array.array('d', values)
+
+
 class Histogram(object):
     """
     Class handling the conversion of yoda histogram objects
@@ -31,10 +97,6 @@ class Histogram(object):
         self.histogram = histogram
         self.normalize = normalize
 
-        # Rivet plot parser retrieves histogram options from
-        # Rivet's .plot files (title, labels, log axis...)
-        self.plotparser = rivet.PlotParser()
-
     def toDict(self):
         """
         Convert yoda histogram object to Python dict.
@@ -63,84 +125,25 @@ class Histogram(object):
             except:
                 pass
 
-        bins = []
+        bins = dict((field, _column()) for field in COLUMNS['Histo1D'])
         for bin in self.histogram.bins():
-            mean = 0
-            rms = 0
-            stdDev = 0
-            stdErr = 0
-            # These values may not be well defined
-            try:
-                mean = bin.mean
-                rms = bin.rms
-                stdDev = bin.stdDev
-                stdErr = bin.stdErr
-            except:
-                pass
-
-            bins.append({
-                '_type': 'Histo1D',
-                '_yRangeLow': bin.height - bin.heightErr,
-                '_yRangeHigh': bin.height + bin.heightErr,
-                'area': bin.area,
-                'areaErr': bin.areaErr,
-                'edgeLow': bin.edges.low,
-                'edgeHigh': bin.edges.high,
-                'effNumEntries': bin.effNumEntries,
-                'focus': bin.focus,
-                'height': bin.height,
-                'heightErr': bin.heightErr,
-                'mean': mean,
-                'midpoint': bin.midpoint,
-                'numEntries': bin.numEntries,
-                'relErr': bin.relErr,
-                'rms': rms,
-                'stdDev': stdDev,
-                'stdErr': stdErr,
-                'sumW': bin.sumW,
-                'sumW2': bin.sumW2,
-                'sumWX': bin.sumWX,
-                'sumWX2': bin.sumWX2,
-                'width': bin.width
-                })
-
-        mean = 0
-        rms = 0
-        stdDev = 0
-        stdErr = 0
-        variance = 0
-        # These values may not be well defined
-        try:
-            mean = self.histogram.totalDbn.mean
-            rms = self.histogram.totalDbn.rms
-            stdDev = self.histogram.totalDbn.stdDev
-            stdErr = self.histogram.totalDbn.stdErr
-            variance = self.histogram.totalDbn.variance
-        except:
-            pass
-
-        totalDbn = {
-            'effNumEntries': self.histogram.totalDbn.effNumEntries,
-            'mean': mean,
-            'numEntries': self.histogram.totalDbn.numEntries,
-            'rms': rms,
-            'stdDev': stdDev,
-            'stdErr': stdErr,
-            'sumW': self.histogram.totalDbn.sumW,
-            'sumW2': self.histogram.totalDbn.sumW2,
-            'sumWX': self.histogram.totalDbn.sumWX,
-            'sumWX2': self.histogram.totalDbn.sumWX2,
-            'variance': variance
-            }
+            bins['edgeLow'].append(bin.edges.low)
+            bins['edgeHigh'].append(bin.edges.high)
+            bins['sumW'].append(bin.sumW)
+            bins['sumW2'].append(bin.sumW2)
+            bins['sumWX'].append(bin.sumWX)
+            bins['sumWX2'].append(bin.sumWX2)
+            bins['numEntries'].append(bin.numEntries)
 
         return {
             'type': 'Histo1D',
-            'plotHeaders': self.plotparser.getHeaders(self.histogram.annotations()['Path']),
             'annotations': self.histogram.annotations(),
             'bins': bins,
             'edgeLow': self.histogram.edges.low,
             'edgeHigh': self.histogram.edges.high,
-            'totalDbn': totalDbn
+            'totalDbn': _dbnToDict(self.histogram.totalDbn),
+            'underflow': _dbnToDict(self.histogram.underflow),
+            'overflow': _dbnToDict(self.histogram.overflow)
             }
 
     def _scatter2DtoDict(self):
@@ -148,26 +151,317 @@ class Histogram(object):
         Scatter2D to dict conversion.
         """
 
-        points = []
+        points = dict((field, _column()) for field in COLUMNS['Scatter2D'])
         for point in self.histogram.points():
-            points.append({
-                '_type': 'Scatter2D',
-                'x': point.x,
-                'y': point.y,
-                'xErrMinus': point.xErrs.minus,
-                'xErrPlus': point.xErrs.plus,
-                'yErrMinus': point.yErrs.minus,
-                'yErrPlus': point.yErrs.plus,
-                'xRangeLow': point.xRange.low,
-                'xRangeHigh': point.xRange.high,
-                'yRangeLow': point.yRange.low,
-                'yRangeHigh': point.yRange.high
-                })
+            points['x'].append(point.x)
+            points['xErrMinus'].append(point.xErrs.minus)
+            points['xErrPlus'].append(point.xErrs.plus)
+            points['y'].append(point.y)
+            points['yErrMinus'].append(point.yErrs.minus)
+            points['yErrPlus'].append(point.yErrs.plus)
 
         return {
             'type': 'Scatter2D',
-            'plotHeaders': self.plotparser.getHeaders(self.histogram.annotations()['Path']),
             'annotations': self.histogram.annotations(),
             'points': points,
             }
 
+
+def _dbnToDict(dbn):
+    """
+    Raw statistics of a yoda `Dbn1D` as a dict.
+    """
+
+    return {
+        'sumW': dbn.sumW,
+        'sumW2': dbn.sumW2,
+        'sumWX': dbn.sumWX,
+        'sumWX2': dbn.sumWX2,
+        'numEntries': dbn.numEntries
+        }
+
+
+def _mergeDbns(dbns, weights):
+    """
+    Weighted sum of the raw statistics `dbns`.
+
+    Scaling a distribution by `w` multiplies sumW, sumWX and sumWX2
+    by `w` and sumW2 by `w` squared, the number of entries is unchanged.
+    """
+
+    merged = dict.fromkeys(DBN_FIELDS, 0)
+
+    for dbn, w in zip(dbns, weights):
+        merged['sumW'] += w * dbn['sumW']
+        merged['sumW2'] += w * w * dbn['sumW2']
+        merged['sumWX'] += w * dbn['sumWX']
+        merged['sumWX2'] += w * dbn['sumWX2']
+        merged['numEntries'] += dbn['numEntries']
+
+    return merged
+
+
+def _mergeHisto1D(histos, weights):
+    """
+    Merge Histo1D dicts with identical binning (bin-wise weighted sum).
+    """
+
+    first = histos[0]['bins']
+    bins = {
+        'edgeLow': _column(first['edgeLow']),
+        'edgeHigh': _column(first['edgeHigh'])
+        }
+    for field in DBN_FIELDS:
+        bins[field] = _column([0.] * len(first[field]))
+
+    for histo, w in zip(histos, weights):
+        scale = {'sumW': w, 'sumW2': w * w, 'sumWX': w, 'sumWX2': w, 'numEntries': 1}
+        for field in DBN_FIELDS:
+            merged, column, s = bins[field], histo['bins'][field], scale[field]
+            for i in xrange(len(merged)):
+                merged[i] += s * column[i]
+
+    merged = dict(histos[0])
+    merged.update({
+        'bins': bins,
+        'totalDbn': _mergeDbns([h['totalDbn'] for h in histos], weights),
+        'underflow': _mergeDbns([h['underflow'] for h in histos], weights),
+        'overflow': _mergeDbns([h['overflow'] for h in histos], weights)
+        })
+
+    return merged
+
+
+def _mergeScatter2D(histos, weights):
+    """
+    Merge Scatter2D dicts with identical points (weighted mean of the
+    y values, errors added in quadrature).
+    """
+
+    first = histos[0]['points']
+    points = dict((field, _column(first[field])) for field in ['x', 'xErrMinus', 'xErrPlus'])
+    points['y'] = _column(sum(w * h['points']['y'][i] for h, w in zip(histos, weights)) for i in xrange(len(first['y'])))
+    for field in ['yErrMinus', 'yErrPlus']:
+        points[field] = _column(math.sqrt(sum((w * h['points'][field][i]) ** 2 for h, w in zip(histos, weights))) for i in xrange(len(first[field])))
+
+    merged = dict(histos[0])
+    merged['points'] = points
+
+    return merged
+
+
+def merge_histos(runs, weights=None):
+    """
+    Merge the histograms (dicts) of several `runs` of the same analysis.
+
+    `runs` is a list of histogram lists (as returned by `convert_histos`).
+    Histograms are matched by path and their raw statistics (sumW, sumW2,
+    sumWX...) are combined bin-wise, each run being scaled by its weight:
+
+    - unnormalized histograms of independent runs are simply added
+      (all weights 1, the default)
+    - finalized histograms (normalized per event by Rivet) are averaged,
+      each run weighted by its fraction of the total number of events
+
+    Histograms which are not present in every run, or whose binning
+    differs, are taken from the first run containing them.
+    """
+
+    if weights is None:
+        weights = [1.] * len(runs)
+
+    paths = []
+    byPath = dict()
+    for run, w in zip(runs, weights):
+        for histo in run:
+            path = histo['annotations']['Path']
+            if path not in byPath:
+                paths.append(path)
+                byPath[path] = ([], [])
+            byPath[path][0].append(histo)
+            byPath[path][1].append(w)
+
+    merged = []
+    for path in paths:
+        histos, w = byPath[path]
+        first = histos[0]
+
+        if len(histos) != len(runs) or any(_size(h) != _size(first) for h in histos):
+            merged.append(first)
+        elif first['type'] == 'Histo1D':
+            merged.append(_mergeHisto1D(histos, w))
+        else:
+            merged.append(_mergeScatter2D(histos, w))
+
+    return merged
+
+
+def _size(histo):
+    """
+    Number of bins (or points) of a histogram dict.
+    """
+
+    el = histo[ELEMENTS[histo['type']]]
+    return len(el[COLUMNS[histo['type']][0]])
+
+
+def histos_nbytes(histos):
+    """
+    Approximate memory used by histogram dicts (bytes).
+    """
+
+    nbytes = 0
+    for histo in histos:
+        nbytes += 1024
+        for column in histo[ELEMENTS[histo['type']]].values():
+            nbytes += len(column) * column.itemsize
+    return nbytes
+
+
+def _rows(histo, fields):
+    """
+    Bins (or points) of a histogram dict as lists of `fields` values.
+    """
+
+    el = histo[ELEMENTS[histo['type']]]
+    return zip(*[el[field] for field in fields])
+
+
+def write_yoda(histos, filename):
+    """
+    Write histogram dicts to a yoda file (YODA text format), e.g. the
+    result of `merge_histos`, so that it can be read back with yoda.
+    """
+
+    with open(filename, 'w') as f:
+        for histo in histos:
+            path = histo['annotations']['Path']
+
+            if histo['type'] == 'Histo1D':
+                f.write("# BEGIN YODA_HISTO1D {}\n".format(path))
+                for key, value in sorted(histo['annotations'].items()):
+                    f.write("{}={}\n".format(key, value))
+                f.write("# ID\t ID\t sumw\t sumw2\t sumwx\t sumwx2\t numEntries\n")
+                for label, dbn in [('Total', histo['totalDbn']), ('Underflow', histo['underflow']), ('Overflow', histo['overflow'])]:
+                    f.write("{0}\t{0}\t{1!r}\t{2!r}\t{3!r}\t{4!r}\t{5}\n".format(
+                        label, dbn['sumW'], dbn['sumW2'], dbn['sumWX'], dbn['sumWX2'], int(dbn['numEntries'])))
+                f.write("# xlow\t xhigh\t sumw\t sumw2\t sumwx\t sumwx2\t numEntries\n")
+                for edgeLow, edgeHigh, sumW, sumW2, sumWX, sumWX2, numEntries in _rows(histo, COLUMNS['Histo1D']):
+                    f.write("{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{}\n".format(
+                        edgeLow, edgeHigh, sumW, sumW2, sumWX, sumWX2, int(numEntries)))
+                f.write("# END YODA_HISTO1D\n\n")
+            else:
+                f.write("# BEGIN YODA_SCATTER2D {}\n".format(path))
+                for key, value in sorted(histo['annotations'].items()):
+                    f.write("{}={}\n".format(key, value))
+                f.write("# xval\t xerr-\t xerr+\t yval\t yerr-\t yerr+\n")
+                for point in _rows(histo, COLUMNS['Scatter2D']):
+                    f.write("{!r}\t{!r}\t{!r}\t{!r}\t{!r}\t{!r}\n".format(*point))
+                f.write("# END YODA_SCATTER2D\n\n")
+
+
+def _rawValues(histo):
+    """
+    Values of `histo` compared between two snapshots.
+    """
+
+    values = {'el': _rows(histo, DELTA_FIELDS[histo['type']])}
+
+    if histo['type'] == 'Histo1D':
+        for dbn in ['totalDbn', 'underflow', 'overflow']:
+            values[dbn] = [histo[dbn][f] for f in DBN_FIELDS]
+
+    return values
+
+
+class HistoStream(object):
+    """
+    Encode the successive intermediate histograms of a run for the
+    `histos_update` web socket messages.
+
+    The first update is a full snapshot of the (unnormalized) histogram
+    dicts. The following ones only contain, for each histogram path, the
+    bins (or points) which changed since the previous update, as lists
+    `[index, value, ...]` of the `DELTA_FIELDS` values, as well as the
+    overall distributions of the changed Histo1D. Each update has a version
+    number, a delta only applies to the previous version.
+
+    The client recomputes the derived values (height, errors, mean...)
+    from these raw statistics and normalizes the histograms if requested.
+    """
+
+    def __init__(self, normalize=False):
+        self.normalize = normalize
+        self.version = 0
+        self._sent = None
+        self._last = None
+
+    def encode(self, histos):
+        """
+        Return the content of the `histos_update` message for `histos`.
+        """
+
+        self.version += 1
+        state = dict((histo['annotations']['Path'], _rawValues(histo)) for histo in histos)
+        self._last = (self.version, histos)
+
+        if self._sent is None or not self._compatible(state):
+            self._sent = state
+            return {
+                'version': self.version,
+                'full': True,
+                'normalize': self.normalize,
+                'fields': DELTA_FIELDS,
+                'histos': histos
+                }
+
+        delta = dict()
+        for histo in histos:
+            path = histo['annotations']['Path']
+            new, old = state[path], self._sent[path]
+            changed = [[i] + list(values) for i, values in enumerate(new['el']) if values != old['el'][i]]
+
+            if changed:
+                delta[path] = {ELEMENTS[histo['type']]: changed}
+                if histo['type'] == 'Histo1D':
+                    delta[path].update(totalDbn=new['totalDbn'], underflow=new['underflow'], overflow=new['overflow'])
+
+        self._sent = state
+
+        return {
+            'version': self.version,
+            'full': False,
+            'histos': delta
+            }
+
+    def snapshot(self):
+        """
+        Full snapshot of the last encoded version (for a client joining the
+        stream), None before the first update.
+        """
+
+        if self._last is None:
+            return None
+
+        version, histos = self._last
+        return {
+            'version': version,
+            'full': True,
+            'normalize': self.normalize,
+            'fields': DELTA_FIELDS,
+            'histos': histos
+            }
+
+    def _compatible(self, state):
+        """
+        Whether deltas can be computed (same histograms, same binning).
+        """
+
+        if set(state) != set(self._sent):
+            return False
+
+        for path, new in state.items():
+            if len(new['el']) != len(self._sent[path]['el']) or len(new) != len(self._sent[path]):
+                return False
+
+        return True
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+"""
+Operational metrics of the server, exposed in the Prometheus text format
+(see `MetricsHandler` in `main.py`).
+
+The counters and latency histograms are cheap enough to be always on:
+they are updated without lock, each thread incrementing its own copy
+(`threading.local`), and the copies are summed up when the metrics are
+collected (on scrape).
+"""
+
+import bisect
+import collections
+import threading
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5]
+
+# Metrics recorded with `Metrics.inc` (name: description)
+COUNTERS = collections.OrderedDict([
+    ('t4t_ws_messages_total', "Messages sent through the web sockets"),
+    ('t4t_ws_bytes_total', "Bytes sent through the web sockets"),
+    ('t4t_events_total', "Events analysed by the simulations"),
+    ('t4t_result_cache_lookups_total', "Lookups of the stored results, by result (hit, miss)"),
+    ('t4t_rivet_jobs_total', "Rivet jobs finished, by exit code")
+    ])
+
+# Metrics recorded with `Metrics.observe` (name: description)
+HISTOGRAMS = collections.OrderedDict([
+    ('t4t_histogram_update_seconds', "Time spent on the intermediate histograms, by stage "
+        "(snapshot of the Rivet histograms, merge, delta, serialization)")
+    ])
+
+
+def _labels(labels):
+    """
+    Labels of a sample (tuple of `(label, value)` pairs).
+    """
+
+    if not labels:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join('{}="{}"'.format(label, escape(value)) for label, value in labels) + '}'
+
+
+def _value(value):
+    value = float(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
+
+
+class Exposition(object):
+    """
+    Metrics in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lines = []
+
+    def add(self, name, type, help, samples=()):
+        """
+        Add the metric `name` (`type`: counter or gauge), with its
+        `samples` (`(labels, value)`, `labels` a tuple of `(label,
+        value)` pairs).
+        """
+
+        self._header(name, type, help)
+        for labels, value in samples:
+            self._lines.append("{}{} {}".format(name, _labels(labels), _value(value)))
+
+    def histogram(self, name, help, buckets, samples=()):
+        """
+        Add the histogram `name`, with its `samples` (`(labels, counts,
+        sum)`, `counts` the number of values of each bucket, then of the
+        values above the last one).
+        """
+
+        self._header(name, 'histogram', help)
+        for labels, counts, total in samples:
+            cumulative = 0
+            for bound, count in zip(list(buckets) + [float('inf')], counts):
+                cumulative += count
+                self._lines.append("{}_bucket{} {}".format(name, _labels(labels + (('le', _value(bound)),)), _value(cumulative)))
+            self._lines.append("{}_sum{} {}".format(name, _labels(labels), _value(total)))
+            self._lines.append("{}_count{} {}".format(name, _labels(labels), _value(cumulative)))
+
+    def summary(self, name, help, samples=()):
+        """
+        Add the summary `name`, with its `samples` (`(labels, stats)`,
+        `stats` the statistics of a `LatencyStats`).
+        """
+
+        self._header(name, 'summary', help)
+        for labels, stats in samples:
+            for quantile in ['0.5', '0.99']:
+                value = stats['p{}_ms'.format(int(float(quantile) * 100))] / 1000
+                self._lines.append("{}{} {}".format(name, _labels(labels + (('quantile', quantile),)), _value(value)))
+            self._lines.append("{}_sum{} {}".format(name, _labels(labels), _value(stats['mean_ms'] * stats['count'] / 1000)))
+            self._lines.append("{}_count{} {}".format(name, _labels(labels), _value(stats['count'])))
+
+    def text(self):
+        return '\n'.join(self._lines) + '\n'
+
+    def _header(self, name, type, help):
+        self._lines.append("# HELP {} {}".format(name, help))
+        self._lines.append("# TYPE {} {}".format(name, type))
+
+
+class Metrics(object):
+    """
+    Counters (`inc`) and latency histograms (`observe`) of the process,
+    by name (see `COUNTERS` and `HISTOGRAMS`) and labels (tuple of
+    `(label, value)` pairs).
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+
+        self._local = threading.local()
+        # Copies of the threads (thread, counters, histograms), and the
+        # totals of the threads which have exited
+        self._copies = []
+        self._retired = (collections.defaultdict(float), dict())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide metrics.
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+
+            return cls._instance
+
+    def inc(self, name, labels=(), value=1):
+        """
+        Add `value` to the counter `name`.
+        """
+
+        self._copy()[0][(name, labels)] += value
+
+    def observe(self, name, seconds, labels=()):
+        """
+        Record a duration in the histogram `name`.
+        """
+
+        histograms = self._copy()[1]
+        counts = histograms.get((name, labels))
+        if counts is None:
+            # Count of each bucket (and above the last one), sum
+            counts = histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.]
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def collect(self):
+        """
+        Totals of the counters and histograms of all the threads
+        (`({(name, labels): value}, {(name, labels): counts})`).
+        """
+
+        counters = collections.defaultdict(float)
+        histograms = dict()
+
+        with self._lock:
+            alive = []
+            for thread, copy in self._copies:
+                if thread.is_alive():
+                    alive.append((thread, copy))
+                else:
+                    self._merge(self._retired, copy)
+            self._copies = alive
+
+            self._merge((counters, histograms), self._retired)
+            for thread, copy in alive:
+                self._merge((counters, histograms), copy)
+
+        return counters, histograms
+
+    def value(self, name, labels=()):
+        """
+        Total of the counter `name`.
+        """
+
+        return self.collect()[0].get((name, labels), 0)
+
+    def export(self, exposition):
+        """
+        Add the counters and histograms to the `exposition`.
+        """
+
+        counters, histograms = self.collect()
+
+        for name, help in COUNTERS.items():
+            samples = sorted((labels, value) for (n, labels), value in counters.items() if n == name)
+            exposition.add(name, 'counter', help, samples)
+
+        for name, help in HISTOGRAMS.items():
+            samples = sorted((labels, counts[:-1], counts[-1]) for (n, labels), counts in histograms.items() if n == name)
+            exposition.histogram(name, help, self.buckets, samples)
+
+    def _copy(self):
+        """
+        Counters and histograms of the current thread.
+        """
+
+        try:
+            return self._local.copy
+        except AttributeError:
+            copy = (collections.defaultdict(float), dict())
+            self._local.copy = copy
+            with self._lock:
+                self._copies.append((threading.current_thread(), copy))
+            return copy
+
+    @staticmethod
+    def _merge(totals, copy):
+        """
+        Add the values of a `copy` to the `totals`.
+
+        (the copy is read while its thread may update it: `items` and
+        `list` are atomic)
+        """
+
+        for key, value in copy[0].items():
+            totals[0][key] += value
+        for key, counts in copy[1].items():
+            counts = list(counts)
+            if key in totals[1]:
+                totals[1][key] = [a + b for a, b in zip(totals[1][key], counts)]
+            else:
+                totals[1][key] = counts
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bounded pool of worker threads running the simulations.
+
+Instead of starting one PYTHIA + Rivet pipeline per web socket, the
+`run` requests are submitted to a `SimulationPool` which schedules them
+on a fixed number of workers (see the `pool` section of `config.ini`).
+"""
+
+from tools import SIM_ERR, SIM_QUE
+
+import collections
+import multiprocessing
+import threading
+import time
+import traceback
+
+# Job status
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_CANCELLED = 'cancelled'
+
+
+class Job(object):
+    """
+    A simulation scheduled on the `SimulationPool`.
+    """
+
+    def __init__(self, simulation, pool=None):
+        self.simulation = simulation
+        self.pool = pool
+        self.status = JOB_QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+
+class SimulationPool(object):
+    """
+    Run `Simulation` objects on a bounded number of worker threads.
+
+    Jobs wait in a FIFO queue until a worker is free. At most `max_queued`
+    jobs can wait at the same time (admission control), further
+    submissions are rejected. Waiting jobs receive their position in the
+    queue through their web socket queue (`['queue', position]`).
+    """
+
+    def __init__(self, workers=0, max_queued=0):
+        """
+        `workers` the number of simulations running at the same time
+            (0 to size the pool according to the number of cores)
+        `max_queued` the maximum number of waiting jobs (0 for no limit)
+        """
+
+        if workers <= 0:
+            # Each simulation runs PYTHIA and Rivet, i.e. two busy processes
+            workers = max(1, multiprocessing.cpu_count() // 2)
+
+        self.size = workers
+        self.max_queued = max_queued
+
+        self._jobs = collections.deque()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._workers = []
+        for i in range(self.size):
+            worker = threading.Thread(target=self._work, name="SimulationWorker-{}".format(i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, simulation):
+        """
+        Queue `simulation` and return the corresponding `Job`.
+
+        Return None if the simulation cannot be admitted (queue full).
+        Otherwise the client is told that the simulation is queued before
+        a worker can take it (and send the end of a fast run).
+        """
+
+        with self._cond:
+            if self._closed or (self.max_queued and len(self._jobs) >= self.max_queued):
+                return None
+
+            simulation._ws.put(['signal', SIM_QUE], block=False)
+            job = Job(simulation, self)
+            self._jobs.append(job)
+            self._notify_positions()
+            self._cond.notify()
+
+        return job
+
+    def cancel(self, job):
+        """
+        Remove `job` from the queue.
+
+        Return False if the job is not waiting anymore (already running
+        or finished), in which case the simulation has to be stopped.
+        """
+
+        with self._cond:
+            if job.status != JOB_QUEUED:
+                return False
+
+            self._jobs.remove(job)
+            job.status = JOB_CANCELLED
+            job.finished = time.time()
+            self._notify_positions()
+
+        return True
+
+    def position(self, job):
+        """
+        Position (starting at 1) of `job` in the queue, 0 if not waiting.
+        """
+
+        with self._cond:
+            for i, queued in enumerate(self._jobs):
+                if queued is job:
+                    return i + 1
+            return 0
+
+    def stats(self):
+        """
+        Number of running and waiting jobs.
+        """
+
+        with self._cond:
+            return {'running': len(self._running), 'queued': len(self._jobs), 'workers': self.size}
+
+    def running(self):
+        """
+        The running simulations.
+        """
+
+        with self._cond:
+            return [job.simulation for job in self._running]
+
+    def shutdown(self):
+        """
+        Cancel the waiting jobs and stop the running simulations.
+        """
+
+        with self._cond:
+            self._closed = True
+            while self._jobs:
+                job = self._jobs.popleft()
+                job.status = JOB_CANCELLED
+            running = list(self._running)
+            self._cond.notify_all()
+
+        for job in running:
+            job.simulation.stop()
+
+    def _notify_positions(self):
+        """
+        Send their queue position to the waiting jobs.
+
+        (must be called with `self._cond` acquired, hence `block=False`)
+        """
+
+        for i, job in enumerate(self._jobs):
+            job.simulation._ws.put(['queue', i + 1], block=False)
+
+    def _work(self):
+        """
+        Worker loop: take the next job and run its simulation.
+        """
+
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+
+                job = self._jobs.popleft()
+                job.status = JOB_RUNNING
+                job.started = time.time()
+                self._running.add(job)
+                self._notify_positions()
+
+            try:
+                job.simulation.run()
+            except Exception:
+                traceback.print_exc()
+                job.simulation._ws.put(['error', "Simulation failed - see server log"])
+                job.simulation._ws.put(['signal', SIM_ERR])
+            finally:
+                with self._cond:
+                    self._running.discard(job)
+                    job.status = JOB_DONE
+                    job.finished = time.time()
@@ -7,9 +7,13 @@ Some useful functions for Rivet.
 from histogramming import Histogram, UnsupportedHistogramError
 
 import rivet
+import yoda
 import ConfigParser
+import json
 import os
 import sys
+import tempfile
+import threading
 
 # Import configuration (paths to PYTHIA and Rivet...)
 # See `config.ini` file
@@ -17,15 +21,134 @@ config = ConfigParser.RawConfigParser()
 config.read(os.path.join(sys.path[0], 'config.ini'))
 
 
+# Details of the analyses kept in the `AnalysisCatalogue`
+# (names of the methods of the Rivet analysis objects)
+ANALYSIS_DETAILS = ['authors', 'bibKey', 'bibTeX', 'collider', 'description',
+    'experiment', 'inspireId', 'name', 'references', 'requiredBeams',
+    'requiredEnergies', 'runInfo', 'spiresId', 'status', 'summary', 'year']
+
+
 def get_all_analyses():
-    rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
-    return rivet.AnalysisLoader.analysisNames()
+    return AnalysisCatalogue.instance().names()
 
 
 def get_lhc_analyses():
-    rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
-    analyses = rivet.AnalysisLoader.analysisNames()
-    return [a for a in analyses if rivet.AnalysisLoader.getAnalysis(a).collider().startswith('LHC')]
+    return AnalysisCatalogue.instance().lhc_analyses()
+
+
+class AnalysisCatalogue(object):
+    """
+    Index of the details of the installed Rivet analyses.
+
+    Loading all the analysis plugins is slow, so the index is built once
+    and saved to a JSON file (see `config.ini`). It is rebuilt when the
+    Rivet version or the analysis lib and refdata directories change.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, filename=None):
+        """
+        `filename` the JSON file of the index (None: not saved)
+        """
+
+        self.filename = filename
+        self.analyses = None
+        self.order = None
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide catalogue (loaded on first use).
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                # Extra analyses (and their .plot files)
+                rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+
+                catalogue = cls(config.get('paths', 'catalogue'))
+                catalogue.load()
+                cls._instance = catalogue
+
+            return cls._instance
+
+    def signature(self):
+        """
+        Rivet version and last modification of the analysis lib and
+        refdata directories (and of their files).
+        """
+
+        mtime = 0
+        for path in [config.get('paths', 'analysis_lib'), config.get('paths', 'refdata')]:
+            try:
+                mtime = max([mtime, os.path.getmtime(path)] +
+                    [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)])
+            except OSError:
+                pass
+
+        return {'rivet': rivet.version(), 'mtime': mtime}
+
+    def load(self):
+        """
+        Load the saved index, or build it if it is missing or outdated.
+        """
+
+        signature = self.signature()
+
+        try:
+            with open(self.filename, 'r') as f:
+                index = json.load(f)
+            if index['signature'] == signature:
+                self.order = index['order']
+                self.analyses = index['analyses']
+                return
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+        self.build()
+        self.save(signature)
+
+    def build(self):
+        """
+        Load every analysis plugin and keep its details.
+        """
+
+        rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+
+        self.order = []
+        self.analyses = dict()
+        for name in rivet.AnalysisLoader.analysisNames():
+            ana = rivet.AnalysisLoader.getAnalysis(name)
+            if ana:
+                self.order.append(name)
+                self.analyses[name] = dict((field, getattr(ana, field)()) for field in ANALYSIS_DETAILS)
+
+    def save(self, signature):
+        if not self.filename:
+            return
+
+        try:
+            tmpfile = "{}.tmp".format(self.filename)
+            with open(tmpfile, 'w') as f:
+                json.dump({'signature': signature, 'order': self.order, 'analyses': self.analyses}, f)
+            os.rename(tmpfile, self.filename)
+        except IOError:
+            print "Unable to save the analysis catalogue to {}".format(self.filename)
+
+    def names(self):
+        return list(self.order)
+
+    def lhc_analyses(self):
+        return [a for a in self.order if self.analyses[a]['collider'].startswith('LHC')]
+
+    def get(self, analysis):
+        """
+        Details of `analysis` (None if it is not installed).
+        """
+
+        return self.analyses.get(analysis)
 
 
 def convert_histos(histos, normalize=False):
@@ -43,3 +166,36 @@ def convert_histos(histos, normalize=False):
 
     return histosList
 
+
+
+def snapshot_dir():
+    """
+    Directory where the intermediate histograms are written.
+
+    It should be memory-backed (tmpfs, `/dev/shm` by default, see
+    `config.ini`) so that snapshots never touch the disk.
+    """
+
+    path = config.get('paths', 'snapshots')
+    if os.path.isdir(path):
+        return path
+    return tempfile.gettempdir()
+
+
+def snapshot_histos(ah, normalize=False):
+    """
+    Convert the current histograms of the Rivet analysis handler `ah`.
+
+    The Rivet Python bindings can only write the histograms to a file, so
+    they are written to (and read back from) a temporary file in the
+    memory-backed `snapshot_dir`, which is immediately deleted.
+    """
+
+    fd, yodafile = tempfile.mkstemp(suffix='.yoda', dir=snapshot_dir())
+    os.close(fd)
+
+    try:
+        ah.writeData(yodafile)
+        return convert_histos(yoda.readYODA(yodafile), normalize)
+    finally:
+        os.unlink(yodafile)
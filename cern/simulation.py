@@ -4,8 +4,13 @@
 The core classes controlling PYTHIA and Rivet.
 """
 
-from rivettools import convert_histos
-from tools import FIFOFile, PythiaDB, SIM_END, PYT_RUN, RIV_RUN, RIV_STP, SIM_ERR, PARAMS_SAVED, PARAMS_ERROR, SIM_STP
+from rivettools import AnalysisCatalogue, convert_histos, snapshot_histos
+from histogramming import HistoStream, merge_histos, plot_headers, write_yoda
+from cache import LRUCache, ResultCache, RefDataCache, FinalResultCache, EventStore, params_key
+from cmnd import CmndFile
+from transport import PipeTransport, attached, make_transport, close_inherited, write_all
+from metrics import Metrics
+from tools import Broadcast, LogTail, ProgressMeter, SIM_END, PYT_RUN, RIV_RUN, RIV_STP, SIM_ERR, PARAMS_SAVED, PARAMS_ERROR, SIM_STP, SIM_QUE
 
 import os
 import sys
@@ -14,8 +19,16 @@ import subprocess
 import multiprocessing
 import threading
 import signal
+import select
 import time
-import fileinput
+import contextlib
+import itertools
+import random
+import mmap
+import zlib
+import traceback
+import shutil
+import tempfile
 import rivet
 import yoda
 import Queue
@@ -36,15 +49,21 @@ class StdRedirect(object):
     a simple redirect of sys.stdout wouldn't work for this.
     """
 
-    def __init__(self):
+    def __init__(self, out, err):
+        """
+        `out`, `err` the log files (created or truncated)
+        """
+
+        self.out = out
+        self.err = err
         self.old_out = os.dup(1)
         self.old_err = os.dup(2)
 
     def __enter__(self):
         sys.stdout.flush()
         sys.stderr.flush()
-        rivet_out = os.open(os.path.join(sys.path[0], 'rivet_out.log'), os.O_TRUNC | os.O_WRONLY)
-        rivet_err = os.open(os.path.join(sys.path[0], 'rivet_err.log'), os.O_TRUNC | os.O_WRONLY)
+        rivet_out = os.open(self.out, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0644)
+        rivet_err = os.open(self.err, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0644)
         os.dup2(rivet_out, 1)
         os.dup2(rivet_err, 2)
         os.close(rivet_out)
@@ -62,458 +81,1446 @@ class Pythia(threading.Thread):
     The thread running PYTHIA.
     """
 
-    def __init__(self, generator, params, fifofile, _ws):
+    def __init__(self, generator, params, transport, _ws, recorder=None):
         """
         `generator` the PYTHIA program to run (e.g. `main42.exe`)
         `params` the PYTHIA cmnd file (e.g. `main42.cmnd`)
-        `fifofile` the path to the FIFO file
+        `transport` the `Transport` of the events
         `_ws` the queue used to communicate with the web socket
+        `recorder` the `EventRecorder` keeping the events (None: not kept)
         """
 
         threading.Thread.__init__(self)
         self.generator = generator
         self.params = params
-        self.fifofile = fifofile
+        self.transport = transport
         self._ws = _ws
+        self.recorder = recorder
+        self.stopped = False
+        self.p = None
 
     def run(self):
         """
-        Run PYTHIA in a subprocess and pipe the stdout
-        to the web socket (one line at a time).
-        """
+        Run PYTHIA in a subprocess and pipe the stdout to the web
+        socket (the output is batched, see `ProgressMeter`).
 
-        # Change to the PYTHIA directory before running the generator
-        os.chdir(config.get('paths', 'pythia'))
-        self.p = subprocess.Popen([os.path.join(".", self.generator), self.params, self.fifofile], stdout=subprocess.PIPE)
+        The recorded events are written by PYTHIA to a pipe read by this
+        thread, which copies them to the transport and the recorder.
+        """
 
-        # Send each line of the stdout through the web socket
-        for line in iter(self.p.stdout.readline, ''):
-            self._ws.put(['pythia', line])
+        source = self.transport
+        if self.recorder:
+            source = PipeTransport(os.path.dirname(self.transport.filename), 'recorder', self.transport.pipe_size)
+            source.open()
+
+        # Run the generator from the PYTHIA directory
+        self.p = subprocess.Popen([os.path.join(".", self.generator), self.params, source.writer_path],
+            stdout=subprocess.PIPE, cwd=config.get('paths', 'pythia'), preexec_fn=source.preexec)
+        source.started()
+
+        # Send the output accumulated during the last interval in a single
+        # message (waiting at most one interval for new output)
+        meter = ProgressMeter()
+        fd = self.p.stdout.fileno()
+        fds = [fd]
+        output = []
+
+        if self.recorder:
+            events = source.reader_fd()
+            writer = self.transport.open_writer()
+            fds.append(events)
+
+        while fds:
+            ready = select.select(fds, [], [], meter.interval)[0]
+            if fd in ready:
+                data = os.read(fd, 65536)
+                if data:
+                    output.append(data)
+                else:
+                    fds.remove(fd)
+            if self.recorder and events in ready:
+                data = os.read(events, 1048576)
+                if data:
+                    self._record(writer, data)
+                else:
+                    fds.remove(events)
+            if output and meter.due():
+                self._ws.put(['pythia', ''.join(output)])
+                output = []
+
+        if output:
+            self._ws.put(['pythia', ''.join(output)])
+
+        self.p.wait()
+
+        # Only keep the events of complete runs
+        if self.recorder:
+            if self.p.returncode == 0:
+                self.recorder.commit()
+            else:
+                self.recorder.abort()
+            self.transport.close_writer(writer)
+            source.close()
 
         self.p = None
 
+    def _record(self, writer, data):
+        try:
+            written = write_all(writer, data, lambda: self.stopped)
+        except OSError:
+            # Rivet is gone (the simulation fails)
+            written = False
+            self.terminate()
+
+        if written:
+            self.recorder.write(data)
+        else:
+            self.recorder.abort()
+
     def terminate(self):
         """
         Used to kill the subprocess.
         """
 
-        if self.p:
-            self.p.send_signal(signal.SIGKILL)
+        self.stopped = True
+        p = self.p
+        if p:
+            p.send_signal(signal.SIGKILL)
 
 
-class Rivet(multiprocessing.Process):
+class EventReplay(threading.Thread):
     """
-    The Rivet process.
+    The thread writing the events of the `EventStore` to the transport
+    (in place of `Pythia`).
+
+    The compressed event file is memory-mapped and decompressed chunk by
+    chunk.
     """
 
-    def __init__(self, analysis, fifofile, histointerval, _q, _ws, _y):
+    # Size of the compressed chunks
+    CHUNK = 262144
+
+    def __init__(self, filename, transport, _ws):
         """
-        `analysis` the name of the analysis to run
-        `fifofile` the path of the FIFO file
-        `histointerval` the update frequency (no. of events)
-        `_q` the queue used to communicate with the process
+        `filename` the event file (`.hepmc.gz`)
+        `transport` the `Transport` of the events
         `_ws` the queue used to communicate with the web socket
-        `_y` the queue used to send back the yoda filename to `Simulation`
         """
 
-        multiprocessing.Process.__init__(self)
-        self.analysis = analysis
-        self.fifofile = fifofile
-        self.histointerval = histointerval
-        self._q = _q
+        threading.Thread.__init__(self)
+        self.filename = filename
+        self.transport = transport
         self._ws = _ws
-        self._y = _y
+        self.stopped = False
 
     def run(self):
-        with StdRedirect():
-            # Change to the `output` directory, where the yoda
-            # histogram files will be stored.
-            os.chdir(config.get('paths', 'rivet_output'))
+        writer = self.transport.open_writer()
+        self.transport.started()
+        self._ws.put(['pythia', "Replaying the stored events of these settings\n"])
 
-            rivet.util.check_python_version()
-            rivet.util.set_process_name('rivet')
+        try:
+            with open(self.filename, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
-            # Add an analysis lib path for extra analyses
-            # (path specified in `config.ini`)
-            rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+            try:
+                inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                for offset in xrange(0, len(data), self.CHUNK):
+                    if not write_all(writer, inflate.decompress(data[offset:offset + self.CHUNK]), lambda: self.stopped):
+                        break
+                else:
+                    write_all(writer, inflate.flush(), lambda: self.stopped)
+            finally:
+                data.close()
+        except (OSError, IOError, zlib.error) as e:
+            self._ws.put(['pythia', "Unable to replay the stored events ({})\n".format(e)])
+        finally:
+            self.transport.close_writer(writer)
 
-            ah = rivet.AnalysisHandler()
-            ah.setIgnoreBeams(False)
-            ah.addAnalysis(self.analysis)
+    def terminate(self):
+        self.stopped = True
 
-            run = rivet.Run(ah)
 
-            # Retrieve reference histograms if they exist
-            ref_histos = None
-            ref_histos_sent = False
+class RivetWorker(multiprocessing.Process):
+    """
+    A pre-initialized Rivet process, running the jobs of the `RivetPool`.
+
+    The Rivet libraries (and the `preload` analyses) are loaded once, then
+    the worker analyses the events of one job at a time (see `RivetJob`),
+    and exits after `max_jobs` jobs to contain the leaks of the C++ code.
+    """
+
+    def __init__(self, preload=(), max_jobs=0):
+        """
+        `preload` the analyses to load at startup
+        `max_jobs` the number of jobs before the worker exits (0: no limit)
+        """
+
+        multiprocessing.Process.__init__(self)
+        self.daemon = True
+        self.preload = list(preload)
+        self.max_jobs = max_jobs
+
+        # Number of jobs done by the worker and analyses loaded (counted
+        # by the pool)
+        self.jobs = 0
+        self.loaded = len(self.preload)
+
+        # Jobs (dicts, None to exit), control messages (`(msg, job id)`)
+        # and messages sent back (`['done', status]` at the end of a job)
+        self._jobs = multiprocessing.Queue()
+        self._q = multiprocessing.Queue()
+        self._h = multiprocessing.Queue()
+
+    def run(self):
+        # Do not keep the transports of the running simulations open
+        close_inherited()
+
+        rivet.util.check_python_version()
+        rivet.util.set_process_name('rivet')
+
+        # Add an analysis lib path for extra analyses
+        # (path specified in `config.ini`)
+        rivet.addAnalysisLibPath(config.get('paths', 'analysis_lib'))
+
+        for analysis in self.preload:
+            self._load(analysis)
+
+        jobs = 0
+        while not self.max_jobs or jobs < self.max_jobs:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if 'preload' in job:
+                self._load(job['preload'])
+                continue
 
             try:
-                ref_file = os.path.join(config.get('paths', 'refdata'), "{}.yoda".format(self.analysis))
-                ref_histos = convert_histos(yoda.readYODA(ref_file))
-            except IOError:
-                print "No refdata for {}".format(self.analysis)
+                self._analyse(job)
+                status = 0
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            self._h.put(['done', status])
+            jobs += 1
+
+    def _load(self, analysis):
+        """
+        Load the plugin library of `analysis`.
+        """
+
+        try:
+            rivet.AnalysisLoader.getAnalysis(analysis)
+        except Exception:
+            traceback.print_exc()
+
+    def _control(self, job, block=False):
+        """
+        Next control message of `job` (None if there is none).
+        """
+
+        while True:
+            try:
+                msg, jobid = self._q.get(block)
+            except Queue.Empty:
+                return None
+            if jobid == job['id']:
+                return msg
+
+    def _analyse(self, job):
+        """
+        Analyse the events of a `job` (see `RivetJob`).
+        """
+
+        shard = job['shard']
+
+        with StdRedirect(*job['logfiles']):
+            ah = rivet.AnalysisHandler()
+            ah.setIgnoreBeams(False)
+            for analysis in job['analyses']:
+                ah.addAnalysis(analysis)
+
+            run = rivet.Run(ah)
 
             # Initialize
-            if run.init(self.fifofile):
+            with attached(job['reader']):
+                ready = run.init(job['reader'])
+
+            if ready:
                 evtnum = 0
+                meter = ProgressMeter()
 
                 # Event loop
                 while True:
                     # Pause/resume loop
-                    try:
-                        msg = self._q.get(False)
-                        if msg == 'pause':
-                            self._ws.put(['signal', RIV_STP])
-                            while True:
-                                msg = self._q.get(True)
-                                if msg == 'resume':
-                                    self._ws.put(['signal', RIV_RUN])
-                                    break
-                        elif msg == 'stop':
-                            break
-                    except Queue.Empty:
-                        pass
+                    msg = self._control(job)
+                    if msg == 'pause':
+                        self._h.put(['ws', ['signal', RIV_STP]])
+                        while self._control(job, True) != 'resume':
+                            pass
+                        self._h.put(['ws', ['signal', RIV_RUN]])
+                    elif msg == 'stop':
+                        break
 
                     # Read and process current event
                     if not run.readEvent() or not run.processEvent():
                         break
                     evtnum += 1
 
-                    self._ws.put(['rivet', "Event no. {} processed\n".format(evtnum)])
-
-                    # Intermediate histograms
-                    if evtnum % self.histointerval == 0:
-                        now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
-                        yodafile = "{}.yoda".format(now)
-
-                        # Write histograms to yoda file
-                        ah.writeData(yodafile)
-
-                        # Read the file with yoda and normalize the histograms
-                        histos = convert_histos(yoda.readYODA(yodafile), True)
+                    # Rate-limited progress report
+                    if meter.due():
+                        self._h.put(['progress', shard, evtnum, meter.rate(evtnum)])
 
-                        # Delete the file (no need to keep intermediate histogram files)
-                        os.unlink(yodafile)
+                    # Intermediate histograms (normalized by `Simulation`
+                    # after merging the different shards), with the time
+                    # taken by the snapshot
+                    if evtnum % job['histointerval'] == 0:
+                        start = time.time()
+                        histos = snapshot_histos(ah)
+                        self._h.put(['snapshot', shard, histos, time.time() - start])
 
-                        self._ws.put(['histos', histos])
-
-                        if not ref_histos_sent and ref_histos:
-                            self._ws.put(['histos', ref_histos])
-                            ref_histos_sent = True
-
-                self._ws.put(['rivet', "Finished event loop\n"])
+                self._h.put(['progress', shard, evtnum, meter.rate(evtnum)])
+                self._h.put(['ws', ['rivet', "Finished event loop\n"]])
 
                 # Finalization
                 run.finalize()
                 ah.finalize()
-                now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
-                yodafile = "final-{}.yoda".format(now)
 
                 # Write final histograms to yoda file (and keep it)
-                ah.writeData(yodafile)
+                ah.writeData(job['yodafile'])
 
                 # Read the file with yoda
-                histos = convert_histos(yoda.readYODA(yodafile))
+                histos = convert_histos(yoda.readYODA(job['yodafile']))
 
-                self._ws.put(['histos', histos])
+                self._h.put(['final', shard, histos, evtnum])
 
-                if ref_histos:
-                    self._ws.put(['histos', ref_histos])
 
-                # Send the yoda file name to the client
-                # (used to later compare different runs of an analysis)
-                self._ws.put(['yoda', "final-{}".format(now)])
+class RivetJob(threading.Thread):
+    """
+    A job run by a `RivetWorker` of the `pool`.
+
+    The thread forwards the messages of the worker to the queue `_h` of
+    the simulation until the job is done. It is used like a Rivet process
+    (`pause`, `resume`, `stop`, `is_alive`, `join`, `exitcode`).
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, pool, job, _h):
+        """
+        `pool` the `RivetPool`
+        `job` the job (analyses, reader path of the transport, update
+            interval, yoda file, log files, shard)
+        `_h` the queue used to send the histograms (and the messages for
+            the web socket, `['ws', msg]`) back to `Simulation`
+        """
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pool = pool
+        self.job = dict(job, id=next(self._ids))
+        self._h = _h
+        self.worker = None
+        self.exitcode = None
+
+    def start(self):
+        self.worker = self.pool.acquire()
+        self.worker._jobs.put(self.job)
+        threading.Thread.start(self)
+
+    def run(self):
+        worker = self.worker
+        try:
+            while True:
+                try:
+                    msg = worker._h.get(True, 0.5)
+                except Queue.Empty:
+                    # The worker died (exception in the C++ code)
+                    if not worker.is_alive() and worker._h.empty():
+                        self.exitcode = worker.exitcode or -1
+                        break
+                    continue
 
-                self._y.put(yodafile)
+                if msg[0] == 'done':
+                    self.exitcode = msg[1]
+                    break
+                self._h.put(msg)
+        finally:
+            Metrics.instance().inc('t4t_rivet_jobs_total', (('exitcode', self.exitcode),))
+            self.pool.release(worker)
 
     def pause(self):
-        self._q.put('pause')
+        self.worker._q.put(('pause', self.job['id']))
 
     def resume(self):
-        self._q.put('resume')
+        self.worker._q.put(('resume', self.job['id']))
 
     def stop(self):
-        self._q.put('stop')
+        self.worker._q.put(('stop', self.job['id']))
 
 
-class Simulation(threading.Thread):
+class RivetPool(object):
     """
-    The `Simulation` thread.
+    Pool of idle `RivetWorker`s (see the `rivet` section of `config.ini`).
+
+    A job is given to an idle worker, or to a new (cold) worker when they
+    are all busy. The workers which exit (recycled or crashed) are
+    replaced, the surplus workers exit once their job is done.
+
+    The first workers are forked when the pool is created, before the
+    threads of the server are started. The next ones (cold workers,
+    replacements) are forked by a single thread (see `_spawner`).
     """
 
-    def __init__(self, generator, params, fifo, _ws):
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, size, preload=(), max_jobs=0, recent=0):
+        """
+        `size` the number of idle workers
+        `preload` the analyses loaded by the workers at startup
+        `max_jobs` the number of jobs of a worker before it is replaced
+            (0: no limit)
+        `recent` the number of analyses selected by the users (see
+            `preload`) loaded by the workers as well (0: none)
+        """
+
+        self.size = size
+        self.analyses = list(preload)
+        self.max_jobs = max_jobs
+        self.recent = LRUCache(recent)
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+        for i in range(size):
+            self._idle.append(self._spawn())
+
+        # Requests to the spawner thread: `('spawn', queue)` for a cold
+        # worker (put in the queue), `('retire', worker)` for a worker
+        # which exits (joined and replaced)
+        self._requests = Queue.Queue()
+        spawner = threading.Thread(target=self._spawner, name="RivetSpawner")
+        spawner.daemon = True
+        spawner.start()
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide pool (see `config.ini`).
+
+        (should be created before the threads of the server are started,
+        as the first workers are forked then)
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                preload = [a.strip() for a in config.get('rivet', 'preload').split(',') if a.strip()]
+                cls._instance = cls(config.getint('rivet', 'workers'), preload, config.getint('rivet', 'max_jobs'),
+                    config.getint('rivet', 'preload_recent'))
+
+            return cls._instance
+
+    def acquire(self):
+        """
+        A worker for a new job.
+        """
+
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+
+        # Cold worker
+        spawned = Queue.Queue(1)
+        self._requests.put(('spawn', spawned))
+        worker = spawned.get()
+        if isinstance(worker, Exception):
+            raise worker
+        return worker
+
+    def release(self, worker):
+        """
+        Give back the `worker` of a finished job (the workers which exit
+        are joined and replaced by the spawner thread, not by the caller).
+        """
+
+        worker.jobs += 1
+        recycled = self.max_jobs and worker.jobs >= self.max_jobs
+
+        if worker.is_alive() and not recycled:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(worker)
+                    return
+            worker._jobs.put(None)
+
+        self._requests.put(('retire', worker))
+
+    def preload(self, analysis):
+        """
+        Load `analysis` in the idle workers (and the next ones), as one of
+        the `recent` analyses selected by the users: the least recently
+        selected are not loaded by the next workers anymore, and a worker
+        loads at most `recent` analyses besides its startup ones.
+        """
+
+        with self._lock:
+            if not self.recent.maxsize or analysis in self.analyses or self.recent.get(analysis):
+                return
+            self.recent.put(analysis, True)
+            limit = len(self.analyses) + self.recent.maxsize
+            for worker in self._idle:
+                if worker.loaded < limit:
+                    worker.loaded += 1
+                    worker._jobs.put({'preload': analysis})
+
+    def stats(self):
+        return {'size': self.size, 'idle': len(self._idle), 'preloaded': len(self.analyses) + len(self.recent)}
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._idle:
+                worker._jobs.put(None)
+            self._idle = []
+
+    def _spawn(self):
+        worker = RivetWorker(self.analyses + self.recent.keys(), self.max_jobs)
+        worker.start()
+        return worker
+
+    def _spawner(self):
+        """
+        Fork the workers started while the server is running, one at a
+        time, off the path of the runs (which do not wait for the exiting
+        workers either).
+
+        Forking a process with threads is only safe if the child does not
+        need a lock held by another thread at that time (it would never be
+        released in the child): the workers only use their own queues and
+        Rivet, but a worker may still hang if it is forked while another
+        thread writes to stdout. This risk is limited to the cold workers
+        and the replacements (enough idle `workers` and a high `max_jobs`
+        in `config.ini` make them rare).
+        """
+
+        while True:
+            request, arg = self._requests.get()
+            try:
+                if request == 'spawn':
+                    arg.put(self._spawn())
+                    continue
+
+                arg.join(5)
+                with self._lock:
+                    missing = len(self._idle) < self.size
+                if missing:
+                    worker = self._spawn()
+                    with self._lock:
+                        self._idle.append(worker)
+            except Exception as e:
+                traceback.print_exc()
+                if request == 'spawn':
+                    arg.put(e)
+
+
+class SingleFlight(object):
+    """
+    Registry of the runs in progress (queued or running), by key of their
+    parameters and analyses: the identical runs requested meanwhile follow
+    them instead of generating the same events (see `Simulation.follow`).
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._runs = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        Process-wide registry.
+        """
+
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+
+            return cls._instance
+
+    def join(self, simulation):
+        """
+        Subscribe `simulation` to the run in progress with the same key and
+        return the simulation running it, or register `simulation` as the
+        run of its key (and return it) if there is none.
+        """
+
+        greeting = [['signal', SIM_QUE], ['rivet', "Following an identical simulation in progress\n"]]
+
+        while True:
+            with self._lock:
+                leader = self._runs.get(simulation.key)
+                if leader is None:
+                    self._runs[simulation.key] = simulation
+                    return simulation
+
+            # Without holding the lock (the state of the run is sent to the
+            # client, see `Broadcast.subscribe`)
+            if leader.flight.subscribe(simulation._client, greeting):
+                return leader
+
+            # The run does not accept new clients anymore
+            with self._lock:
+                if self._runs.get(simulation.key) is leader:
+                    self._runs[simulation.key] = simulation
+                    return simulation
+
+    def remove(self, simulation):
+        with self._lock:
+            if self._runs.get(simulation.key) is simulation:
+                del self._runs[simulation.key]
+
+    def stats(self):
+        """
+        Number of runs in progress and of clients following them.
+        """
+
+        with self._lock:
+            runs = self._runs.values()
+
+        return {'runs': len(runs), 'clients': sum(run.flight.clients() for run in runs)}
+
+
+class Simulation(object):
+    """
+    The `Simulation` object, run by a worker of the `SimulationPool`.
+    """
+
+    def __init__(self, generator, params, fifo, _ws, session_params=None, headers_sent=None):
         """
         `generator` the PYTHIA program to run (e.g. `main42.exe`)
         `params` the PYTHIA cmnd file (e.g. `main42.cmnd`)
-        `fifo` the FIFO file name
+        `fifo` the name of the transports of the events
         `_ws` the queue used to communicate with the web socket
+            (`WSChannel`)
+        `session_params` the parameters saved by the user (name: value,
+            overlay of the cmnd file kept by the web socket session)
+        `headers_sent` the paths of the plot headers already sent to the
+            client (kept by the web socket session, the client keeps them
+            between the runs)
         """
 
-        threading.Thread.__init__(self)
         self.generator = generator
         self.params = params
         self.fifo = fifo
         self._ws = _ws
+        self._client = _ws
+        self.session_params = session_params if session_params is not None else dict()
 
-        self.analysis = None
+        # Overlay used by the run (copy of `session_params`, see `freeze_params`)
+        self.overlay = dict()
+
+        self.analyses = []
         self.histointerval = None
-        self.pythia = None
-        self.rivet = None
+        self.more_events = 0
+        self.send_refs = True
+        self.refs_sent = set()
+        self.headers_sent = headers_sent if headers_sent is not None else set()
+
+        # `Job` of the run on the `SimulationPool` (set by `main.py`)
+        self.job = None
+        self.pythias = []
+        self.rivets = []
+        self.logs = []
+
+        # Number of PYTHIA instances (and Rivet processes) sharing the events
+        self.shards = max(1, config.getint('simulation', 'shards'))
 
         self.error = False
         self.stopped = False
+        self.started = None
 
-        self._q = multiprocessing.Queue()
-        self._y = multiprocessing.Queue()
+        # Last progress of the run (see `_progress`)
+        self.progress = None
+
+        self._h = Queue.Queue()
+
+        # Run followed by the client (see `follow`): key of the run, queue
+        # of its messages (`Broadcast`, also `_ws` when running the run),
+        # simulation running it (None when running the run)
+        self.key = None
+        self.flight = None
+        self.leader = None
+
+        # Histogram streams and results of the run (see `state`)
+        self.streams = dict()
+        self.results = []
 
     def set_analysis(self, analysis):
-        self.analysis = analysis
+        """
+        `analysis` the name of the analysis to run, or a list of names
+        (analysed together, on the same events).
+        """
+
+        analyses = analysis if isinstance(analysis, list) else [analysis]
+        self.analyses = [a for i, a in enumerate(analyses) if a and a not in analyses[:i]]
 
     def set_histointerval(self, histointerval):
         self.histointerval = histointerval
 
-    def run(self):
+    def set_more_events(self, events):
+        """
+        `events` the number of events to add to the stored results of the
+        analyses ("continue" them, True for the number of events of the
+        settings), 0 to run them as usual.
+        """
+
+        self.more_events = events
+
+    def freeze_params(self):
+        """
+        Use the parameters currently saved in the session for the run
+        (they can be changed again while the simulation is waiting or
+        running without affecting it).
+        """
+
+        self.overlay = dict(self.session_params)
+
+    def set_send_refs(self, send_refs):
+        """
+        Whether the reference histograms have to be sent, or the list of
+        the analyses whose reference histograms have to be sent (the
+        client keeps them between the runs of an analysis).
+        """
+
+        self.send_refs = send_refs
+
+    def follow(self):
+        """
+        Follow the identical run (same parameters and analyses) of another
+        client if there is one in progress, instead of running the
+        simulation: return True in this case. Otherwise the simulation
+        becomes the run followed by the next identical requests (and has
+        to be run).
+        """
+
+        self._ws = self._client
+        self.flight = None
+        self.leader = None
+        self.streams = dict()
+        self.results = []
+
+        if not self.analyses or self.histointerval == None:
+            return False
+
+        p = self._run_params()
+        p['_analyses'] = sorted(self.analyses)
+        if self.more_events:
+            p['_more'] = self.more_events
+        self.key = params_key(p)
+
+        self.flight = Broadcast(self._client, self.state)
+        self._ws = self.flight
+
+        leader = SingleFlight.instance().join(self)
+        if leader is self:
+            return False
+
+        self._ws = self._client
+        self.flight = leader.flight
+        self.leader = leader
+        return True
+
+    def unregister(self):
+        """
+        Do not accept new clients following the run anymore.
         """
-        Run the simulation if the analysis and update interval were set.
 
-        Create the `FIFOFile` (in `/tmp`), run PYTHIA and then Rivet.
+        if self.flight is not None and self.leader is None:
+            SingleFlight.instance().remove(self)
+            self.flight.seal()
+
+    def detach(self):
+        """
+        Leave a run shared with other clients (see `follow`), which goes on
+        without this client. Return False if the client is the only one
+        following the run, which has to be stopped.
         """
 
-        if self.analysis == None or self.histointerval == None:
+        if self.flight is None:
+            return False
+
+        if not self.flight.unsubscribe(self._client):
+            if self.leader is None:
+                self.unregister()
+                return False
+            # Last client of a run started by another one (removed from
+            # the queue if it has not started yet)
+            job = self.leader.job
+            if job is not None and job.pool.cancel(job):
+                self.leader.unregister()
+                self._client.put(['signal', SIM_STP])
+            else:
+                self.leader.stop()
+            return True
+
+        self._client.put(['signal', SIM_STP])
+        return True
+
+    def renew(self):
+        """
+        New `Simulation` for the next runs of the client (after `detach`,
+        this one goes on for the other clients).
+        """
+
+        simulation = Simulation(self.generator, self.params, self.fifo, self._client, self.session_params, self.headers_sent)
+        simulation.refs_sent = set(self.refs_sent)
+
+        # The headers sent from now on by this run go to the other clients
+        self.headers_sent = set(self.headers_sent)
+        return simulation
+
+    def state(self, joining=False):
+        """
+        Messages bringing a client following the run up to date (see
+        `Broadcast`): the last intermediate histograms of the analyses and,
+        for a `joining` client, the plot headers, the results already sent
+        and the reference histograms.
+        """
+
+        msgs = []
+        results = list(self.results)
+        streams = self.streams.items()
+
+        if joining:
+            analyses = set(self.analyses)
+            paths = [path for path in list(self.headers_sent) if path.split('/')[1] in analyses]
+            if paths:
+                msgs.append(['plot_headers', dict((path, plot_headers(path)) for path in paths)])
+
+            for analysis, histos, yodafile in results:
+                msgs.append(['histos', histos, analysis])
+                msgs.append(['yoda', yodafile.partition('.yoda')[0], analysis])
+
+        sent = [analysis for analysis, histos, yodafile in results]
+        for analysis, stream in streams:
+            snapshot = stream.snapshot()
+            if snapshot is not None:
+                msgs.append(['histos_update', snapshot, analysis])
+                sent.append(analysis)
+
+        if joining:
+            for analysis in sent:
+                ref_histos = self._ref_histos(analysis)
+                if ref_histos:
+                    msgs.append(['histos', ref_histos, analysis])
+
+        return msgs
+
+    def run(self):
+        """
+        Run the simulation if the analyses and update interval were set.
+
+        The results of the analyses which have already been run with the
+        same parameters are retrieved from the cache, the other analyses
+        are run together on the same events (see `_simulate`). The stored
+        results with fewer events than requested (checkpoints of stopped
+        runs), or all of them when continuing the analyses (see
+        `set_more_events`), are completed with new events.
+        """
+
+        try:
+            # Reference histograms sent to the clients joining the run
+            # (loaded here rather than from the IOLoop, see `state`)
+            if self.flight is not None and self.leader is None:
+                RefDataCache.instance().prewarm(self.analyses)
+
+            self._run()
+        finally:
+            self.unregister()
+
+    def _run(self):
+        if not self.analyses or self.histointerval == None:
             self._ws.put(['error', "Missing analysis or histointerval property - nothing done"])
+        elif self.stopped:
+            self._ws.put(['signal', SIM_STP])
         else:
-            p = self.read_cmnd_file()
-            p['_analysis'] = self.analysis
-            db = PythiaDB()
-            # If this analysis has already been run successfully with the supplied
-            # parameters, just retrieve and display the stored results.
-            if db.exists(p):
-                yodafile = db.get_yoda(p)
-                ref_histos = None
-                try:
-                    ref_file = os.path.join(config.get('paths', 'refdata'), "{}.yoda".format(self.analysis))
-                    ref_histos = convert_histos(yoda.readYODA(ref_file))
-                except IOError:
-                    print "No refdata for {}".format(self.analysis)
-                try:
-                    histos = convert_histos(yoda.readYODA(os.path.join(config.get('paths', 'rivet_output'), yodafile)))
-                    self._ws.put(['histos', histos])
-                    if ref_histos:
-                        self._ws.put(['histos', ref_histos])
-                    self._ws.put(['yoda', yodafile.partition('.yoda')[0]])
-                    self._ws.put(['signal', SIM_END])
-                except IOError:
-                    self._ws.put(['error', "Unable to retrieve saved histograms"])
-                    self._ws.put(['signal', SIM_ERR])
+            p = self._run_params()
+            results = ResultCache.instance()
+            requested = int(p.get('Main:numberOfEvents', 1000))
+            more = requested if self.more_events is True else int(self.more_events)
+
+            # If an analysis has already been run with the supplied parameters,
+            # just retrieve and display the stored results (unless they have
+            # to be completed).
+            analyses = []
+            bases = dict()
+            for analysis in self.analyses:
+                entry = results.get(self._analysis_params(p, analysis))
+                histos = None
+                if entry:
+                    yodafile, events = entry
+                    histos = FinalResultCache.instance().get(os.path.join(config.get('paths', 'rivet_output'), yodafile))
+                    if histos is None:
+                        print "Unable to retrieve saved histograms of {}".format(analysis)
+
+                if histos is not None and events >= requested and not more:
+                    self._send_results(analysis, histos, yodafile)
+                else:
+                    analyses.append(analysis)
+                    if histos is not None:
+                        bases[analysis] = (histos, events)
+
+            if analyses:
+                # Events shared by the analyses: the additional events, or
+                # the events missing from the least advanced checkpoint
+                nevents = more or max(requested - bases.get(analysis, (None, 0))[1] for analysis in analyses)
+                self._simulate(p, analyses, nevents, bases)
             else:
-                with FIFOFile(self.fifo) as fifofile:
-                    # Generate events with PYTHIA
-                    self._generate(fifofile)
-
-                    # Small sleep time to allow PYTHIA subprocess to start
-                    time.sleep(0.5)
-
-                    # Analyse events with Rivet
-                    self._analyse(fifofile)
-
-                    self.rivet.join()
-
-                    # If Rivet does not terminate correctly (because of an exception
-                    # in the C code that cannot be caught in Python), kill PYTHIA,
-                    # otherwise a lot of "setting badbit" errors would appear in the
-                    # console, and PYTHIA wouldn't stop.
-                    if self.rivet.exitcode != 0:
-                        self._ws.put(['rivet', "Rivet process terminated... Killing PYTHIA\n"])
-                        self.pythia.terminate()
-                        self._ws.put(['error', "Rivet error - see console for details"])
-                        self._ws.put(['signal', SIM_ERR])
-                        self.error = True
-                    self.pythia.join()
-
-                # Back to the initial directory (of `main.py`)
-                os.chdir(sys.path[0])
-
-                if not self.error:
-                    if self.stopped:
-                        self._ws.put(['signal', SIM_STP])
+                self._ws.put(['signal', SIM_END])
+
+    def _simulate(self, p, analyses, nevents, bases=None):
+        """
+        Run PYTHIA and Rivet with the parameters `p` for the `analyses`.
+
+        Create the transports of the events (see `config.ini`), run PYTHIA
+        and then Rivet, as soon as the first events are available. The
+        analyses share the same Rivet analysis handler. With more than one
+        shard (see `config.ini`), the events are generated by several
+        PYTHIA instances using different random seeds, each one analysed
+        by its own Rivet process, and their histograms are merged.
+
+        `nevents` events are generated. The results of the analyses with
+        stored results (`bases`, `{analysis: (histos, events)}`) are merged
+        with them, the new events using a fresh random seed. The results
+        are stored even if the run is stopped (checkpoint).
+        """
+
+        bases = bases or dict()
+        results = ResultCache.instance()
+        now = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
+        tmpdir = tempfile.mkdtemp()
+        transports = [make_transport(tmpdir, "{}.{}".format(self.fifo, i)) for i in range(self.shards)]
+
+        # The events generated with a fresh random seed are not kept (they
+        # could never be replayed)
+        overlay = self.overlay
+        replayable = True
+        if bases or nevents != int(p.get('Main:numberOfEvents', 1000)):
+            replayable = False
+            overlay = dict(overlay)
+            overlay.update({
+                'Main:numberOfEvents': nevents,
+                'Random:setSeed': 'on',
+                'Random:seed': random.randint(1, 800000000)
+                })
+
+        with contextlib.nested(*transports):
+            # Generate events with PYTHIA
+            self._generate(transports, self._shard_params(tmpdir, overlay), replayable)
+
+            # Analyse events with Rivet once PYTHIA has started
+            # generating them
+            if self._wait_ready(transports):
+                self._analyse(transports, tmpdir, analyses)
+
+                histos, events = self._collect(analyses, nevents)
+
+                for r in self.rivets:
+                    r.join()
+            else:
+                if self.stopped:
+                    self._ws.put(['signal', SIM_STP])
+                else:
+                    self._ws.put(['error', "PYTHIA error - see console for details"])
+                    self._ws.put(['signal', SIM_ERR])
+                for pythia in self.pythias:
+                    pythia.terminate()
+                self.error = True
+
+            # If Rivet does not terminate correctly (because of an exception
+            # in the C code that cannot be caught in Python), kill PYTHIA,
+            # otherwise a lot of "setting badbit" errors would appear in the
+            # console, and PYTHIA wouldn't stop.
+            if not self.error and (any(r.exitcode != 0 for r in self.rivets) or histos is None):
+                self._ws.put(['rivet', "Rivet process terminated... Killing PYTHIA\n"])
+                for pythia in self.pythias:
+                    pythia.terminate()
+                self._ws.put(['error', "Rivet error - see console for details"])
+                self._ws.put(['signal', SIM_ERR])
+                self.error = True
+            for pythia in self.pythias:
+                pythia.join()
+
+        # The final results are not part of the state of the run
+        self.unregister()
+
+        if not self.error:
+            for analysis, analysis_histos in self._split(histos, analyses):
+                # Add the new events to the stored results (finalized
+                # histograms, averaged like the shards)
+                total = events
+                if analysis in bases:
+                    base, base_events = bases[analysis]
+                    total += base_events
+                    if events:
+                        analysis_histos = merge_histos([base, analysis_histos], [float(base_events) / total, float(events) / total])
                     else:
-                        # Store successful analyses
-                        yodafile = self._y.get(True)
-                        p['_yoda'] = yodafile
-                        db.add(p)
-                        self._ws.put(['signal', SIM_END])
+                        analysis_histos = base
+
+                # Keep the final histograms of each analysis (merged if
+                # there are several shards)
+                if len(analyses) == 1:
+                    yodafile = "final-{}.yoda".format(now)
+                else:
+                    yodafile = "final-{}-{}.yoda".format(now, analysis)
+                final = os.path.join(config.get('paths', 'rivet_output'), yodafile)
+                if self.shards == 1 and len(analyses) == 1 and analysis not in bases:
+                    shutil.move(os.path.join(tmpdir, "final-0.yoda"), final)
+                else:
+                    write_yoda(analysis_histos, final)
+                FinalResultCache.instance().put(final, analysis_histos)
+
+                self._send_results(analysis, analysis_histos, yodafile)
+
+                # Store the results (if the run was stopped, as a
+                # checkpoint completed by the next identical run)
+                if total:
+                    results.add(self._analysis_params(p, analysis), yodafile, total)
+
+            self._ws.put(['signal', SIM_STP if self.stopped else SIM_END])
+
+        self._send_logs(final=True)
+        shutil.rmtree(tmpdir, True)
+
+    def _run_params(self):
+        """
+        Parameters of the run (with the number of shards).
+        """
+
+        p = self.read_cmnd_file()
+        if self.shards > 1:
+            p['_shards'] = self.shards
+        return p
+
+    def _analysis_params(self, p, analysis):
+        """
+        Parameters `p` of the run of `analysis` (key of its results).
+        """
 
-                with open(os.path.join(sys.path[0], 'rivet_out.log'), 'r') as f:
-                    for line in f.readlines():
-                        self._ws.put(['rivet_out', line])
+        p = dict(p)
+        p['_analysis'] = analysis
+        return p
+
+    def _split(self, histos, analyses):
+        """
+        The `histos` of each of the `analyses` (`[(analysis, histos)]`,
+        from their paths `/<analysis>/...`).
+        """
+
+        byAnalysis = dict((analysis, []) for analysis in analyses)
+        for histo in histos:
+            name = histo['annotations']['Path'].split('/')[1]
+            if name in byAnalysis:
+                byAnalysis[name].append(histo)
 
-                with open(os.path.join(sys.path[0], 'rivet_err.log'), 'r') as f:
-                    for line in f.readlines():
-                        self._ws.put(['rivet_err', line])
+        return [(analysis, byAnalysis[analysis]) for analysis in analyses]
 
-    def _generate(self, fifofile):
+    def _send_results(self, analysis, histos, yodafile):
         """
-        Create and start `Pythia` thread, generating events.
+        Send the final `histos` of `analysis` (with its reference
+        histograms, if needed) and the name of their `yodafile`.
         """
 
-        self.pythia = Pythia(self.generator, self.params, fifofile, self._ws)
-        self.pythia.start()
+        self._send_plot_headers(histos)
+        self.results.append((analysis, histos, yodafile))
+        self._ws.put(['histos', histos, analysis])
+        self._send_refs(analysis)
+
+        # Send the yoda file name to the client
+        # (used to later compare different runs of an analysis)
+        self._ws.put(['yoda', yodafile.partition('.yoda')[0], analysis])
+
+    def _send_refs(self, analysis):
+        """
+        Send the reference histograms of `analysis` (once, if the client
+        or the clients following the run need them).
+        """
+
+        if isinstance(self.send_refs, list):
+            needed = analysis in self.send_refs
+        else:
+            needed = self.send_refs
+        needed = needed or (self.flight is not None and self.flight.shared())
+
+        if needed and analysis not in self.refs_sent:
+            self.refs_sent.add(analysis)
+            ref_histos = self._ref_histos(analysis)
+            if ref_histos:
+                self._ws.put(['histos', ref_histos, analysis])
+
+    def _send_logs(self, final=False):
+        """
+        Send the new lines of the Rivet logs (`['rivet_out', lines]` and
+        `['rivet_err', lines]`), including the last incomplete line if
+        `final`.
+        """
+
+        for out, err in self.logs:
+            lines = out.read(final)
+            if lines:
+                self._ws.put(['rivet_out', lines])
+            lines = err.read(final)
+            if lines:
+                self._ws.put(['rivet_err', lines])
+
+    def _send_plot_headers(self, histos):
+        """
+        Send the plot options of the `histos` which were not sent yet
+        (`['plot_headers', {path: headers}]`, before the histograms).
+        """
+
+        paths = [h['annotations']['Path'] for h in histos if h['annotations']['Path'] not in self.headers_sent]
+
+        if paths:
+            self._ws.put(['plot_headers', dict((path, plot_headers(path)) for path in paths)])
+            self.headers_sent.update(paths)
+
+    def _ref_histos(self, analysis):
+        """
+        Reference histograms of `analysis` (None if there is no refdata).
+        """
+
+        try:
+            ref_histos = RefDataCache.instance().get(analysis)
+        except IOError:
+            ref_histos = None
+        if ref_histos is None:
+            print "No refdata for {}".format(analysis)
+        return ref_histos
+
+    def _shard_params(self, tmpdir, overlay):
+        """
+        PYTHIA cmnd file of each shard, with the parameters `overlay`.
+
+        With a single shard and no parameters, the cmnd file is used
+        unchanged. Otherwise, a copy with the parameters of the run is
+        written in `tmpdir` for each shard, with a distinct random seed and
+        its share of the number of events (if there are several shards).
+        """
+
+        cmnd = CmndFile.load(self.cmnd_filename())
+
+        if self.shards == 1:
+            if not overlay:
+                return [self.params]
+
+            cmndfile = os.path.join(tmpdir, "run.cmnd")
+            cmnd.write(cmndfile, overlay)
+            return [cmndfile]
+
+        p = cmnd.effective(overlay)
+        nevents = int(p.get('Main:numberOfEvents', 1000))
+        seed = int(p.get('Random:seed', 0)) if p.get('Random:setSeed', 'off').lower() in ['on', 'true', 'yes', '1'] else 0
+
+        cmndfiles = []
+        for i in range(self.shards):
+            cmndfile = os.path.join(tmpdir, "shard-{}.cmnd".format(i))
+            shard = dict(overlay)
+            shard.update({
+                'Main:numberOfEvents': nevents // self.shards + (1 if i < nevents % self.shards else 0),
+                'Random:setSeed': 'on',
+                'Random:seed': max(seed, 0) + i + 1
+                })
+            cmnd.write(cmndfile, shard)
+            cmndfiles.append(cmndfile)
+
+        return cmndfiles
+
+    def _collect(self, analyses, nevents):
+        """
+        Collect the histograms sent by the Rivet processes until they
+        all have finished.
+
+        Intermediate histograms are merged and sent to the web socket (as
+        deltas by analysis, normalized by the client) once every shard has
+        sent a new snapshot. The progress of the shards is summed up and sent at most
+        every `PROGRESS_INTERVAL` (with an ETA computed from the expected
+        number of events `nevents`), as well as the new lines of the Rivet
+        logs. Return the merged final histograms (None if a Rivet process
+        did not finish) and the number of events analysed.
+
+        The time spent on the intermediate histograms is recorded in the
+        `Metrics` of the server.
+        """
+
+        metrics = Metrics.instance()
+
+        streams = dict((analysis, HistoStream(normalize=True)) for analysis in analyses)
+        self.streams = streams
+        snapshots = [None] * self.shards
+        updated = set()
+        finals = dict()
+        progress = dict()
+        meter = ProgressMeter()
+        logmeter = ProgressMeter()
+
+        while len(finals) < self.shards:
+            # Live output of Rivet
+            if logmeter.due():
+                self._send_logs()
+
+            try:
+                msg = self._h.get(True, 0.5)
+            except Queue.Empty:
+                # Only stop waiting when the processes are gone (the last
+                # messages are read before their exit is noticed)
+                if not any(r.is_alive() for r in self.rivets) and self._h.empty():
+                    break
+                continue
+
+            if msg[0] == 'snapshot':
+                snapshots[msg[1]] = msg[2]
+                updated.add(msg[1])
+                metrics.observe('t4t_histogram_update_seconds', msg[3], (('stage', 'snapshot'),))
+
+                if updated.issuperset(set(range(self.shards)) - set(finals)):
+                    updated.clear()
+                    start = time.time()
+                    histos = merge_histos([h for h in snapshots if h])
+                    metrics.observe('t4t_histogram_update_seconds', time.time() - start, (('stage', 'merge'),))
+                    self._send_plot_headers(histos)
+
+                    for analysis, analysis_histos in self._split(histos, analyses):
+                        start = time.time()
+                        delta = streams[analysis].encode(analysis_histos)
+                        metrics.observe('t4t_histogram_update_seconds', time.time() - start, (('stage', 'delta'),))
+                        self._ws.put(['histos_update', delta, analysis])
+                        self._send_refs(analysis)
+            elif msg[0] == 'progress':
+                progress[msg[1]] = (msg[2], msg[3])
+                self.progress = self._progress(progress, nevents)
+
+                if meter.due():
+                    self._ws.put(['progress', self.progress])
+            elif msg[0] == 'final':
+                finals[msg[1]] = (msg[2], msg[3])
+            elif msg[0] == 'ws':
+                self._ws.put(msg[1])
+
+        if progress:
+            self.progress = self._progress(progress, nevents)
+            self._ws.put(['progress', self.progress])
+            metrics.inc('t4t_events_total', value=self.progress['events'])
+
+        if len(finals) < self.shards:
+            return None, 0
+        if self.shards == 1:
+            return finals[0]
+
+        # Finalized histograms are normalized per event by Rivet: average
+        # them, weighted by the number of events of each shard
+        nevents = sum(n for h, n in finals.values())
+        runs = [finals[i][0] for i in range(self.shards)]
+        weights = [float(finals[i][1]) / nevents if nevents else 1. / self.shards for i in range(self.shards)]
+
+        return merge_histos(runs, weights), nevents
+
+    def _progress(self, progress, nevents):
+        """
+        Overall progress of the run from the `progress` of each shard
+        (number of events processed, events per second).
+        """
+
+        events = sum(n for n, rate in progress.values())
+        rate = sum(rate for n, rate in progress.values())
+
+        return {
+            'events': events,
+            'total': nevents,
+            'rate': rate,
+            'eta': max(nevents - events, 0) / rate if rate > 0 else None
+            }
+
+    def _generate(self, transports, cmndfiles, replayable=True):
+        """
+        Create and start `Pythia` threads, generating events (or
+        `EventReplay` threads, if the events of the same settings are in
+        the `EventStore`). The events are kept in the `EventStore` only if
+        they are `replayable` (same events for the same settings).
+        """
+
+        store = EventStore.instance()
+
+        self.started = time.time()
+        for transport, cmndfile in zip(transports, cmndfiles):
+            key = store.key(self.generator, os.path.join(config.get('paths', 'pythia'), cmndfile)) if store.enabled and replayable else None
+            events = store.get(key) if key else None
+
+            if events:
+                pythia = EventReplay(events, transport, self._ws)
+            else:
+                pythia = Pythia(self.generator, cmndfile, transport, self._ws, store.recorder(key) if key else None)
+            pythia.start()
+            self.pythias.append(pythia)
         self._ws.put(['signal', PYT_RUN])
 
-    def _analyse(self, fifofile):
+    def _wait_ready(self, transports):
         """
-        Create and start `Rivet` process, analysing events.
+        Wait until the events of every PYTHIA instance are available (see
+        `Transport.wait_ready`), return False if an instance exited
+        without generating events (or did not start in time).
         """
 
-        self.rivet = Rivet(self.analysis, fifofile, self.histointerval, self._q, self._ws, self._y)
-        self.rivet.start()
+        timeout = config.getfloat('transport', 'ready_timeout') or None
+        for transport, pythia in zip(transports, self.pythias):
+            if not transport.wait_ready(pythia.is_alive, timeout):
+                return False
+
+        self._ws.put(['rivet', "First events after {:.3f} s ({} transport)\n".format(time.time() - self.started, transports[0].name)])
+        return True
+
+    def _analyse(self, transports, tmpdir, analyses):
+        """
+        Start the `RivetJob`s analysing the events for the `analyses`.
+        """
+
+        for i, transport in enumerate(transports):
+            yodafile = os.path.join(tmpdir, "final-{}.yoda".format(i))
+            logfiles = (os.path.join(tmpdir, "rivet-{}.out.log".format(i)), os.path.join(tmpdir, "rivet-{}.err.log".format(i)))
+            self.logs.append((LogTail(logfiles[0]), LogTail(logfiles[1])))
+            job = {
+                'analyses': analyses,
+                'reader': transport.reader_path,
+                'histointerval': self.histointerval,
+                'yodafile': yodafile,
+                'logfiles': logfiles,
+                'shard': i
+                }
+            r = RivetJob(RivetPool.instance(), job, self._h)
+            r.start()
+            self.rivets.append(r)
         self._ws.put(['signal', RIV_RUN])
 
     def pause(self):
-        if self.rivet:
-            self.rivet.pause()
+        """
+        Pause Rivet, or only the updates sent to the client if other
+        clients follow the same run (see `follow`).
+        """
+
+        if self.flight is not None and self.flight.shared():
+            self.flight.pause(self._client)
+        else:
+            for r in (self.leader or self).rivets:
+                r.pause()
 
     def resume(self):
-        if self.rivet:
-            self.rivet.resume()
+        if self.flight is None or not self.flight.resume(self._client):
+            for r in (self.leader or self).rivets:
+                r.resume()
 
     def stop(self):
         """
         Kill PYTHIA and let Rivet finish gracefully.
         """
 
-        if self.pythia:
-            self.pythia.terminate()
-        if self.rivet:
-            self.rivet.resume()
-            self.rivet.stop()
+        for pythia in self.pythias:
+            pythia.terminate()
+        for r in self.rivets:
+            r.resume()
+            r.stop()
 
         self.stopped = True
 
+    def cmnd_filename(self):
+        return os.path.join(config.get('paths', 'pythia'), self.params)
+
     def read_cmnd_file(self):
         """
-        Read PYTHIA cmnd file and return params as a dict.
+        Parameters of the run (PYTHIA cmnd file with the overlay) as a dict.
         """
 
-        p = dict()
-
-        with open(os.path.join(config.get('paths', 'pythia'), self.params), 'r') as f:
-            for line in f:
-                if line[0] not in ['', '#', '!'] and '=' in line:
-                    part = line.partition('=')
-                    name = part[0].strip()
-                    value = part[2].partition('#')[0].partition('!')[0].strip()
-                    p[name] = value
-
-        return p
+        return CmndFile.load(self.cmnd_filename()).effective(self.overlay)
 
     def load_params(self, params):
         """
-        Load parameters from the `params` PYTHIA cmnd file.
+        Load parameters from the `params` PYTHIA cmnd file (with the
+        parameters saved during the session).
         """
 
-        with open(os.path.join(config.get('paths', 'pythia'), self.params), 'r') as f:
-            for line in f:
-                # For every line, try to find a matching parameter
-                for param in params:
-                    # On the Javascript side, param names use '-' instead of ':'
-                    name = param['name'].replace('-', ':')
-                    if line.partition('=')[0].strip() == name:
-                        param['currentValue'] = line.partition('=')[2].partition('#')[0].partition('!')[0].strip()
-                        break
+        values = CmndFile.load(self.cmnd_filename()).effective(self.session_params)
+
+        for param in params:
+            # On the Javascript side, param names use '-' instead of ':'
+            name = param['name'].replace('-', ':')
+            if name in values:
+                param['currentValue'] = values[name]
 
-        self._ws.put(['params', params])
+        self._client.put(['params', params])
 
     def save_params(self, params):
         """
-        Save parameters to the `params` PYTHIA cmnd file.
+        Save parameters for the next runs of the session.
+
+        The shared cmnd file is not modified: the parameters are an
+        overlay applied to a copy of the file written for each run.
         """
 
-        params_presence = dict()
-        for param in params:
-            name = param['name'].replace('-', ':')
-            params_presence[name] = False
         try:
-            # Inplace update of the file
-            for line in fileinput.input(os.path.join(config.get('paths', 'pythia'), self.params), inplace=1):
-                found = False
-                for param in params:
-                    # On the Javascript side, param names use '-' instead of ':'
-                    name = param['name'].replace('-', ':')
-                    value = param['currentValue']
-                    if line.partition('=')[0].strip() == name:
-                        found = True
-                        if not params_presence[name]:
-                            params_presence[name] = True
-                            # Inplace update means stdout redirected to the file
-                            print "{} = {}".format(name, value)
-                            break
-                if not found:
-                    # Keep line unchanged
-                    print line.strip()
-            # Save not yet defined parameters at the end of the file
-            with open(os.path.join(config.get('paths', 'pythia'), self.params), 'a') as f:
-                for param in params:
-                    name = param['name'].replace('-', ':')
-                    value = param['currentValue']
-                    if not params_presence[name]:
-                        f.write("{} = {}\n".format(name, value))
-            self._ws.put(['signal', PARAMS_SAVED])
-        except:
-            self._ws.put(['signal', PARAMS_ERROR])
-            self._ws.put(['error', "Failed to save parameters"])
+            for param in params:
+                # On the Javascript side, param names use '-' instead of ':'
+                name = param['name'].replace('-', ':')
+                self.session_params[name] = str(param['currentValue']).strip()
+            self._client.put(['signal', PARAMS_SAVED])
+        except (KeyError, TypeError):
+            self._client.put(['signal', PARAMS_ERROR])
+            self._client.put(['error', "Failed to save parameters"])
 
     def required_beams(self, analysis):
         """
         Get the required beams for an `analysis`.
         """
 
-        ana = rivet.AnalysisLoader.getAnalysis(analysis)
+        details = AnalysisCatalogue.instance().get(analysis)
 
-        if ana:
-            beams = ana.requiredBeams()
+        # The analysis is likely to be run next
+        if details:
+            RivetPool.instance().preload(analysis)
+
+        if details and details['requiredBeams']:
+            beams = details['requiredBeams']
             idA = beams[0][1]
             idB = beams[0][0]
-            self._ws.put(['param', ['Beams-idA', idA]])
-            self._ws.put(['param', ['Beams-idB', idB]])
+            self._client.put(['param', ['Beams-idA', idA]])
+            self._client.put(['param', ['Beams-idB', idB]])
 
     def compare(self, yoda_files):
         """
         Compare histograms from different `yoda_files`.
+
+        The files are loaded by the `FinalResultCache` (in parallel, without
+        blocking the other actions) and sent in the requested order.
         """
 
-        for yodafile in yoda_files:
-            try:
-                histos = convert_histos(yoda.readYODA(os.path.join(config.get('paths', 'rivet_output'), yodafile)))
-                self._ws.put(['compare_histos', histos])
-            except IOError:
-                print "Simulation.compare: error reading yoda file {}".format(yodafile)
+        def send(results):
+            for yodafile, histos in zip(yoda_files, results):
+                if histos is None:
+                    print "Simulation.compare: error reading yoda file {}".format(yodafile)
+                else:
+                    self._client.put(['compare_histos', histos], block=False)
+
+        filenames = [os.path.join(config.get('paths', 'rivet_output'), yodafile) for yodafile in yoda_files]
+        FinalResultCache.instance().load(filenames, send)
 
     def analysis_details(self, analysis):
         """
         Get the details of an `analysis`.
         """
 
-        ana = rivet.AnalysisLoader.getAnalysis(analysis)
-
-        if ana:
-            details = {
-                'authors': ana.authors(),
-                'bibKey': ana.bibKey(),
-                'bibTeX': ana.bibTeX(),
-                'collider': ana.collider(),
-                'description': ana.description(),
-                'experiment': ana.experiment(),
-                'inspireId': ana.inspireId(),
-                'name': ana.name(),
-                'references': ana.references(),
-                'requiredBeams': ana.requiredBeams(),
-                'requiredEnergies': ana.requiredEnergies(),
-                'runInfo': ana.runInfo(),
-                'spiresId': ana.spiresId(),
-                'status': ana.status(),
-                'summary': ana.summary(),
-                'year': ana.year()
-                }
-            self._ws.put(['analysis_details', details])
+        details = AnalysisCatalogue.instance().get(analysis)
+
+        if details:
+            self._client.put(['analysis_details', details])
 
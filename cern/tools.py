@@ -4,11 +4,21 @@
 Tools used for communication.
 """
 
+from metrics import Metrics
+
 import tornado.ioloop
 import threading
-import os
-import tempfile
+import itertools
+import collections
+import array
+import json
+import struct
+import sys
+import time
+import sqlite3
+import contextlib
 import pymongo
+import pymongo.errors
 
 # Signals
 SIM_END = 0
@@ -20,77 +30,723 @@ SIM_ERR = 5
 PARAMS_SAVED = 6
 PARAMS_ERROR = 7
 SIM_STP = 8
+SIM_QUE = 9
+
+# Minimum time (in seconds) between two progress messages
+PROGRESS_INTERVAL = 0.25
+
+# Messages sent as binary frames to the clients which asked for it
+BINARY_MESSAGES = ['histos', 'histos_update', 'compare_histos']
+
+# Number of messages waiting for a web socket above which the
+# simulation threads block (see `WSChannel`)
+WS_QUEUE_SIZE = 100
+
+# Messages which a client following a shared run can miss, while its
+# updates are paused or its queue is full (see `Broadcast`)
+LOSSY_MESSAGES = ['histos_update', 'progress', 'pythia', 'rivet', 'rivet_out', 'rivet_err']
+
+# Messages of which the last one is sent to the clients joining a run
+RETAINED_MESSAGES = ['queue', 'signal', 'progress']
+
+# Attempts to build the state of a run for a joining client without
+# holding the lock of the run (see `Broadcast.subscribe`)
+JOIN_ATTEMPTS = 3
+
+# Errors raised by the stores (`PythiaDB`, `SQLiteDB`)
+DB_ERRORS = (pymongo.errors.PyMongoError, sqlite3.Error)
+
+
+def json_default(obj):
+    """
+    JSON serialization of the histogram columns (`array.array`).
+    """
+
+    if isinstance(obj, array.array):
+        return obj.tolist()
+    raise TypeError("{!r} is not JSON serializable".format(obj))
+
+
+def encode_binary(message):
+    """
+    Binary web socket frame for `message` (a dict).
+
+    The frame starts with the length of a JSON header (uint32, little
+    endian), followed by the header, i.e. the message in which each
+    histogram column (`array.array`) is replaced by `{"$a": [offset,
+    length]}`. The columns follow as raw float64 (little endian) blocks,
+    the offsets being counted from the first multiple of 8 after the
+    header, so that the client can use them as `Float64Array` views.
+    """
+
+    blocks = []
+    offset = [0]
+
+    def default(obj):
+        if isinstance(obj, array.array):
+            if obj.typecode != 'd' or sys.byteorder != 'little':
+                obj = array.array('d', obj)
+                if sys.byteorder != 'little':
+                    obj.byteswap()
+            blocks.append(obj)
+            ref = {'$a': [offset[0], len(obj)]}
+            offset[0] += len(obj) * obj.itemsize
+            return ref
+        raise TypeError("{!r} is not JSON serializable".format(obj))
+
+    header = json.dumps(message, default=default)
+    padding = -(4 + len(header)) % 8
+
+    return ''.join([struct.pack('<I', len(header)), header, '\0' * padding] + [block.tostring() for block in blocks])
+
+
+class ProgressMeter(object):
+    """
+    Rate limiter for the progress messages of a loop (events processed,
+    lines of output...): instead of one message per item, a message is
+    due at most every `interval` seconds.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.start = time.time()
+        self.last = self.start
+
+    def due(self):
+        """
+        Whether a new message should be sent (resets the timer if so).
+        """
+
+        now = time.time()
+        if now - self.last < self.interval:
+            return False
+        self.last = now
+        return True
+
+    def rate(self, count):
+        """
+        Average number of items per second since the start.
+        """
+
+        elapsed = time.time() - self.start
+        return count / elapsed if elapsed > 0 else 0.
+
+
+class LatencyStats(object):
+    """
+    Durations of an operation (count, mean, maximum and percentiles of
+    the `window` most recent ones, in milliseconds).
+    """
+
+    def __init__(self, window=1000):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self):
+        """
+        Context manager recording the duration of its block.
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record((time.time() - start) * 1000)
 
+    def record(self, ms):
+        with self._lock:
+            self.count += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+            self.recent.append(ms)
 
-class FIFOFile(object):
+    def stats(self):
+        with self._lock:
+            recent = sorted(self.recent)
+
+        def percentile(q):
+            return recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.
+
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else 0.,
+            'max_ms': self.max,
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99)
+            }
+
+
+class LogTail(object):
     """
-    Context manager to handle the FIFO file used by PYTHIA and Rivet.
+    Follow a log file while it is written: `read` returns the complete
+    lines written since the previous call.
     """
 
-    def __init__(self, name):
-        self.name = name
-        self.tmpdir = tempfile.mkdtemp()
-        self.filename = os.path.join(self.tmpdir, self.name)
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0
+        self.partial = ''
+
+    def read(self, final=False):
+        """
+        New complete lines (and the last incomplete one if `final`).
+        """
 
-    def __enter__(self):
-        os.mkfifo(self.filename)
-        return self.filename
+        try:
+            with open(self.filename, 'r') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except IOError:
+            return ''
 
-    def __exit__(self, type, value, traceback):
-        os.remove(self.filename)
-        os.rmdir(self.tmpdir)
+        self.offset += len(data)
+        data = self.partial + data
 
+        if final:
+            self.partial = ''
+            return data
 
-class WSComm(threading.Thread):
+        lines, sep, self.partial = data.rpartition('\n')
+        return lines + sep
+
+
+class WSChannel(object):
     """
-    Web Socket Communication thread.
+    Queue of the messages to send through a web socket.
+
+    Messages are serialized by the thread calling `put` and delivered to
+    the web socket by the `WSPump` running in the IOLoop. When more than
+    `maxsize` messages are waiting (slow client), `put` blocks until the
+    pump catches up (backpressure), except when called from the IOLoop
+    itself or with `block=False`.
 
-    A little framework to send messages via the web socket.
+    The channels count the messages and bytes delivered to their web
+    socket (see `channels`).
     """
 
-    add_callback = tornado.ioloop.IOLoop.instance().add_callback
+    _ids = itertools.count()
+
+    # Open channels, by id
+    _open = dict()
+    _open_lock = threading.Lock()
+
+    def __init__(self, pump, handler, binary=False, maxsize=WS_QUEUE_SIZE):
+        """
+        `pump` the `WSPump` delivering the messages
+        `handler` the `WebSocketHandler` of the web socket
+        `binary` whether the client accepts binary frames for the
+            `BINARY_MESSAGES` (see `encode_binary`)
+        `maxsize` the number of waiting messages above which `put` blocks
+        """
+
+        self.pump = pump
+        self.handler = handler
+        self.binary = binary
+        self.maxsize = maxsize
+
+        self.closed = False
+        self._frames = collections.deque()
+        self._cond = threading.Condition()
+
+        # Delivered messages and bytes (updated by the `WSPump` only)
+        self.id = next(WSChannel._ids)
+        self.messages = 0
+        self.bytes = 0
+
+        with WSChannel._open_lock:
+            WSChannel._open[self.id] = self
+
+    @classmethod
+    def channels(cls):
+        """
+        The open channels.
+        """
+
+        with cls._open_lock:
+            return cls._open.values()
+
+    def put(self, msg, block=True):
+        """
+        Send `msg` (`[type, content]`, or `[type, content, analysis]` for
+        the messages of an analysis) to the web socket.
+
+        Messages put after `close` are dropped.
+        """
+
+        self.put_frame(self.encode(msg), block)
 
-    def __init__(self, write_message, _ws):
-        threading.Thread.__init__(self)
-        self.write_message = write_message
-        self._ws = _ws
+    def encode(self, msg):
+        """
+        Frame of `msg` for the web socket (see `put_frame`).
+        """
 
-        self._run = threading.Event()
+        message = {'type': msg[0], 'content': msg[1]}
+        if len(msg) > 2:
+            message['analysis'] = msg[2]
+        start = time.time()
+        if self.binary and msg[0] in BINARY_MESSAGES:
+            frame = (encode_binary(message), True)
+        else:
+            frame = (json.dumps(message, default=json_default), False)
+        if msg[0] == 'histos_update':
+            Metrics.instance().observe('t4t_histogram_update_seconds', time.time() - start, (('stage', 'serialization'),))
 
-    def run(self):
-        self._run.set()
+        return frame
+
+    def put_frame(self, frame, block=True):
+        """
+        Send a message already encoded (see `encode`).
+        """
+
+        block = block and not self.pump.in_ioloop()
+
+        with self._cond:
+            while block and not self.closed and len(self._frames) >= self.maxsize:
+                self._cond.wait()
+            if self.closed:
+                return
+
+            self._frames.append(frame)
+            if len(self._frames) == 1:
+                self.pump.wake(self)
+
+    def congested(self):
+        """
+        Whether the web socket still has data to write.
+        """
+
+        connection = self.handler.ws_connection
+        return connection is not None and connection.stream.writing()
+
+    def qsize(self):
+        """
+        Number of messages waiting to be delivered.
+        """
+
+        return len(self._frames)
+
+    def close(self):
+        """
+        Drop the waiting messages and release the blocked writers.
+        """
+
+        with self._cond:
+            self.closed = True
+            self._frames.clear()
+            self._cond.notify_all()
+
+        with WSChannel._open_lock:
+            WSChannel._open.pop(self.id, None)
+
+    def _take(self):
+        """
+        Next waiting frame, None if there is none.
+
+        (called by the `WSPump`)
+        """
+
+        with self._cond:
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            if len(self._frames) < self.maxsize:
+                self._cond.notify_all()
+            return frame
+
+
+class Broadcast(object):
+    """
+    Queue of the messages of a run followed by several web sockets (see
+    `Simulation.follow`).
+
+    The messages are put in the `WSChannel` of every client: with
+    backpressure for the client which started the run, without blocking
+    for the others. A client joining the run first receives its `state`
+    (e.g. the last intermediate histograms) and the last
+    `RETAINED_MESSAGES`. The `LOSSY_MESSAGES` are not sent to the clients
+    which paused their updates or whose queue is full: they receive the
+    state of the run instead of their next histograms update.
+    """
+
+    def __init__(self, owner, state):
+        """
+        `owner` the `WSChannel` of the client which started the run
+        `state` function returning the messages bringing a client up to
+            date (`state(joining)`, `joining` when it joins the run)
+        """
+
+        self.owner = owner
+        self.state = state
+        self.sealed = False
+
+        self._channels = [owner]
+        self._paused = set()
+        self._stale = set()
+        self._retained = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # Number of the messages which a joining client must not miss
+        # (see `subscribe`)
+        self._seq = 0
+
+    def put(self, msg, block=True):
+        """
+        Send `msg` to all the clients following the run.
+        """
+
+        owner = []
+        with self._lock:
+            if msg[0] not in LOSSY_MESSAGES or msg[0] == 'histos_update':
+                self._seq += 1
+            if msg[0] in RETAINED_MESSAGES:
+                if msg[0] == 'signal':
+                    # The run has left the queue
+                    self._retained.pop('queue', None)
+                self._retained.pop(msg[0], None)
+                self._retained[msg[0]] = msg
+
+            for channel in self._channels:
+                if channel is self.owner:
+                    owner = self._messages(channel, msg)
+                else:
+                    for m in self._messages(channel, msg):
+                        channel.put(m, False)
+
+        # Outside the lock: the clients join from the IOLoop, which has
+        # to deliver the messages to unblock the owner
+        for m in owner:
+            self.owner.put(m, block)
+
+    def subscribe(self, channel, greeting=()):
+        """
+        Add the `channel` of a client joining the run (sent the `greeting`
+        messages first). Return False if the run does not accept new
+        clients anymore (see `seal`).
+
+        The clients join from the IOLoop: the state of the run is built and
+        serialized without holding the lock (the owner keeps putting its
+        messages meanwhile), again if a message which the client must not
+        miss was put in the meantime. Only the last of the `JOIN_ATTEMPTS`
+        is made with the lock acquired.
+        """
+
+        greeting = list(greeting)
+
+        for attempt in range(JOIN_ATTEMPTS - 1):
+            if self.sealed:
+                return False
+
+            seq = self._seq
+            frames = [channel.encode(msg) for msg in greeting + self.state(True)]
+            with self._lock:
+                if self._seq == seq and not self.sealed:
+                    self._join(channel, frames)
+                    return True
+
+        with self._lock:
+            if self.sealed:
+                return False
+            self._join(channel, [channel.encode(msg) for msg in greeting + self.state(True)])
+
+        return True
+
+    def _join(self, channel, frames):
+        """
+        Add `channel`, sent the `frames` of the state of the run and the
+        retained messages.
+
+        (must be called with `self._lock` acquired)
+        """
+
+        self._channels.append(channel)
+        for frame in frames:
+            channel.put_frame(frame, False)
+        for msg in self._retained.values():
+            channel.put(msg, False)
+
+    def unsubscribe(self, channel):
+        """
+        Remove the `channel` of a client leaving the run, unless it is the
+        last one: return False in this case (the run has to be stopped, it
+        does not accept new clients anymore).
+        """
+
+        with self._lock:
+            if channel not in self._channels:
+                return True
+            if len(self._channels) == 1:
+                self.sealed = True
+                return False
+
+            self._channels.remove(channel)
+            self._paused.discard(channel)
+            self._stale.discard(channel)
+
+        return True
+
+    def pause(self, channel):
+        """
+        Stop sending the updates of the run to `channel`.
+        """
+
+        with self._lock:
+            if channel in self._channels:
+                self._paused.add(channel)
+                channel.put(['signal', RIV_STP], False)
+
+    def resume(self, channel):
+        """
+        Resume the updates of `channel`, return False if they were not
+        paused.
+        """
+
+        with self._lock:
+            if channel not in self._paused:
+                return False
+
+            self._paused.discard(channel)
+            msgs = [['signal', RIV_RUN]]
+            if channel in self._stale:
+                self._stale.discard(channel)
+                msgs += self.state(False)
+            for msg in msgs:
+                channel.put(msg, False)
+
+        return True
+
+    def seal(self):
+        """
+        Do not accept new clients (the run is finishing).
+        """
+
+        with self._lock:
+            self.sealed = True
+
+    def clients(self):
+        return len(self._channels)
+
+    def shared(self):
+        """
+        Whether several clients follow the run.
+        """
+
+        return len(self._channels) > 1
+
+    def _messages(self, channel, msg):
+        """
+        The messages to put in `channel` for `msg`.
+
+        (must be called with `self._lock` acquired)
+        """
+
+        if msg[0] in LOSSY_MESSAGES:
+            lagging = channel is not self.owner and channel.qsize() >= channel.maxsize
+            if channel in self._paused or lagging:
+                if msg[0] == 'histos_update':
+                    self._stale.add(channel)
+                return []
+
+            if msg[0] == 'histos_update' and channel in self._stale:
+                # The state of the run includes this update
+                self._stale.discard(channel)
+                return self.state(False)
+
+        return [msg]
+
+
+class WSPump(object):
+    """
+    Deliver the messages of all the `WSChannel`s from the IOLoop.
+
+    A single pump serves all the web sockets: writers wake it up with
+    `IOLoop.add_callback` (thread-safe, backed by the IOLoop waker pipe)
+    and there is no thread per connection. A channel whose web socket
+    still has pending writes is paused (its writers block once it is
+    full) and retried every `retry` seconds.
+    """
+
+    def __init__(self, ioloop=None, retry=0.05):
+        self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+        self.retry = retry
+        self._thread = threading.current_thread()
+        self._paused = set()
+        self.metrics = Metrics.instance()
+
+    def in_ioloop(self):
+        """
+        Whether the caller runs in the IOLoop thread (it must not block).
+        """
+
+        return threading.current_thread() is self._thread
+
+    def wake(self, channel):
+        """
+        Schedule the delivery of the messages of `channel` (thread-safe).
+        """
+
+        self.ioloop.add_callback(self._flush, channel)
+
+    def _flush(self, channel):
+        """
+        Write the waiting messages of `channel` until its web socket is
+        congested.
+        """
+
+        self._paused.discard(channel)
+
+        while not channel.closed:
+            if channel.congested():
+                self._paused.add(channel)
+                self.ioloop.call_later(self.retry, lambda: self._resume(channel))
+                return
+
+            frame = channel._take()
+            if frame is None:
+                return
 
-        while self._run.is_set():
             try:
-                msg = self._ws.get(True)
-                self.add_callback(self.write_message, {'type': msg[0], 'content': msg[1]})
-            except EOFError:
-                print "WSComm thread: WebSocket queue has been closed"
+                channel.handler.write_message(*frame)
+            except Exception:
+                # Connection lost, `on_close` will close the channel
+                channel.close()
+            else:
+                channel.messages += 1
+                channel.bytes += len(frame[0])
+                self.metrics.inc('t4t_ws_messages_total')
+                self.metrics.inc('t4t_ws_bytes_total', value=len(frame[0]))
 
-    def stop(self):
-        self._run.clear()
+    def _resume(self, channel):
+        if channel in self._paused:
+            self._flush(channel)
 
 
 class PythiaDB(object):
     """
     MongoDB object store for PYTHIA parameters.
+
+    Each document holds the parameters of a run with its yoda file
+    (`_yoda`) and its number of events (`_events`), indexed by the key
+    of the parameter set (`_key`, see `params_key` in `cern/cache.py`).
     """
 
-    def __init__(self):
-        self.client = pymongo.MongoClient()
+    def __init__(self, key=None, host='localhost', port=27017, pool_size=100, timeout=5000):
+        """
+        `key` the function computing the key of a parameter set, used to
+            index the documents stored before the keys were introduced
+            (see `setup`)
+        `host`, `port` the MongoDB server
+        `pool_size` the maximum number of connections (shared by the
+            threads using this object)
+        `timeout` the connection and server selection timeout (ms)
+        """
+
+        self.key = key
+        self.client = pymongo.MongoClient(host, port, maxPoolSize=pool_size,
+            connectTimeoutMS=timeout, serverSelectionTimeoutMS=timeout)
         self.db = self.client.pythia
         self.params = self.db.params
 
-    def add(self, p):
-        if self.params.find(p).count() == 0:
-            self.params.insert(p)
+    def setup(self):
+        """
+        Index the documents by key (raise one of the `DB_ERRORS` if the
+        server is down).
+        """
+
+        if self.key:
+            self._index_legacy(self.key)
+        self.params.create_index('_key', unique=True)
+
+    def lookup(self, key):
+        """
+        Stored document with the `key`, None if there is none.
+        """
+
+        return self.params.find_one({'_key': key}, {'_id': False})
+
+    def store(self, key, p):
+        """
+        Store the parameters `p` (replacing the document with the `key`).
+        """
+
+        doc = dict(p)
+        doc['_key'] = key
+        self.params.update({'_key': key}, doc, upsert=True)
+
+    def remove(self, key):
+        self.params.remove({'_key': key})
+
+    def ping(self):
+        """
+        Health check (raise one of the `DB_ERRORS` if the server is down).
+        """
+
+        self.client.admin.command('ping')
+
+    def _index_legacy(self, key):
+        """
+        Add their `_key` to the documents without one (duplicates removed).
+        """
+
+        for doc in self.params.find({'_key': {'$exists': False}}):
+            k = key(doc)
+            if self.params.find_one({'_key': k}):
+                self.params.remove({'_id': doc['_id']})
+            else:
+                self.params.update({'_id': doc['_id']}, {'$set': {'_key': k}})
+
+
+class SQLiteDB(object):
+    """
+    SQLite store for PYTHIA parameters, same interface as `PythiaDB`
+    (used when no MongoDB server is available).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS params (key TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+            self.conn.commit()
+
+    def setup(self):
+        """
+        (the table is created with the connection)
+        """
+
+        pass
+
+    def lookup(self, key):
+        """
+        Stored document with the `key`, None if there is none.
+        """
+
+        with self._lock:
+            row = self.conn.execute("SELECT doc FROM params WHERE key = ?", (key,)).fetchone()
+
+        return json.loads(row[0]) if row else None
 
-    def remove(self, p):
-        self.params.remove(p)
+    def store(self, key, p):
+        """
+        Store the parameters `p` (replacing the document with the `key`).
+        """
 
-    def exists(self, p):
-        return self.params.find(p).count() > 0
+        doc = dict(p)
+        doc['_key'] = key
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO params (key, doc) VALUES (?, ?)", (key, json.dumps(doc)))
+            self.conn.commit()
 
-    def get_yoda(self, p):
-        return str(self.params.find_one(p)['_yoda'])
+    def remove(self, key):
+        with self._lock:
+            self.conn.execute("DELETE FROM params WHERE key = ?", (key,))
+            self.conn.commit()
 
+    def ping(self):
+        with self._lock:
+            self.conn.execute("SELECT 1").fetchone()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transport of the events from PYTHIA to Rivet.
+
+PYTHIA writes the HepMC events to a path and Rivet reads them from a path.
+The transports (see the `transport` section of `config.ini`) provide
+these paths:
+
+- `fifo`: a named pipe in the scratch directory of the run
+- `pipe`: an anonymous pipe (opened through `/dev/fd` by PYTHIA, which
+  inherits it, and through `/proc/<pid>/fd` by Rivet)
+- `file`: a regular file, analysed once PYTHIA has generated all the events
+
+Instead of waiting for a fixed time before starting Rivet, `wait_ready`
+waits until the first events are available (or PYTHIA has exited).
+"""
+
+import ConfigParser
+import contextlib
+import errno
+import fcntl
+import os
+import select
+import stat
+import sys
+import threading
+import time
+
+# Import configuration (paths to PYTHIA and Rivet...)
+# See `config.ini` file
+config = ConfigParser.RawConfigParser()
+config.read(os.path.join(sys.path[0], 'config.ini'))
+
+# fcntl command to resize a pipe (Linux)
+F_SETPIPE_SZ = 1031
+
+# Descriptors of the open transports (see `close_inherited`)
+_fds = set()
+_fds_lock = threading.Lock()
+
+
+def set_pipe_size(fd, size):
+    """
+    Resize the buffer of the pipe `fd` (best effort, the size is capped
+    by `/proc/sys/fs/pipe-max-size`).
+    """
+
+    if size:
+        try:
+            fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except (IOError, OSError):
+            pass
+
+
+def _register(*fds):
+    with _fds_lock:
+        for fd in fds:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+            _fds.add(fd)
+
+
+def _close(fd):
+    with _fds_lock:
+        _fds.discard(fd)
+        os.close(fd)
+
+
+def close_inherited(transport=None):
+    """
+    Close the descriptors of the transports (except the one of `transport`)
+    in a forked process (e.g. Rivet), otherwise the readers of the runs
+    would never see the end of their events.
+    """
+
+    keep = transport.reader_fd() if transport else None
+    for fd in list(_fds):
+        if fd != keep:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def write_all(fd, data, stopped):
+    """
+    Write all the `data` to the non-blocking `fd`, unless `stopped()`
+    becomes true while waiting for the reader (return False).
+    """
+
+    view = memoryview(data)
+    while view:
+        if stopped():
+            return False
+        if not select.select([], [fd], [], 0.1)[1]:
+            continue
+        try:
+            view = view[os.write(fd, view):]
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    return True
+
+
+@contextlib.contextmanager
+def attached(path):
+    """
+    Context manager used by the reader to open the transport `path`.
+
+    Opening a pipe for reading waits for a writer, which is gone if all
+    the events fit in the pipe buffer: the pipe is held open for writing
+    until the reader has opened it (and should be closed before reading
+    the end of the events).
+    """
+
+    fd = None
+    if stat.S_ISFIFO(os.stat(path).st_mode):
+        fd = os.open(path, os.O_RDWR)
+    try:
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+
+def make_transport(tmpdir, name):
+    """
+    New transport of the configured type for the events of `name`.
+    """
+
+    backend = config.get('transport', 'backend')
+    return TRANSPORTS[backend](tmpdir, name, config.getint('transport', 'pipe_size'))
+
+
+class Transport(object):
+    """
+    Base class of the transports (context managers creating and removing
+    the underlying pipe or file).
+    """
+
+    name = None
+
+    def __init__(self, tmpdir, name, pipe_size=0):
+        """
+        `tmpdir` the scratch directory of the run
+        `name` the name of the transport (file name)
+        `pipe_size` the size of the pipe buffer (0: system default)
+        """
+
+        self.filename = os.path.join(tmpdir, name)
+        self.pipe_size = pipe_size
+        self.writer_path = self.filename
+        self.reader_path = self.filename
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def reader_fd(self):
+        return None
+
+    def open_writer(self):
+        """
+        Non-blocking descriptor writing to the transport from this process
+        (see `write_all`), to be closed with `close_writer`.
+        """
+
+        fd = os.open(self.writer_path, os.O_WRONLY | os.O_NONBLOCK)
+        _register(fd)
+        return fd
+
+    def close_writer(self, fd):
+        _close(fd)
+
+    def preexec(self):
+        """
+        Called in the PYTHIA subprocess before the generator is executed.
+        """
+
+        pass
+
+    def started(self):
+        """
+        Called once PYTHIA has been started.
+        """
+
+        pass
+
+    def wait_ready(self, alive, timeout=None):
+        """
+        Wait until events can be read, return False if the writer is gone
+        (`alive()` is false) without writing any event, or on timeout.
+        """
+
+        raise NotImplementedError
+
+    def _poll(self, fd, alive, timeout):
+        """
+        Wait until `fd` is readable, checking `alive()` regularly.
+        """
+
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        start = time.time()
+
+        while timeout is None or time.time() - start < timeout:
+            if any(event & select.POLLIN for fd, event in poller.poll(50)):
+                return True
+            if not alive():
+                # Last chance: events written just before the exit
+                return any(event & select.POLLIN for fd, event in poller.poll(0))
+
+        return False
+
+
+class FIFOTransport(Transport):
+    """
+    Named pipe.
+
+    The transport keeps its own (never read) non-blocking reader open: it
+    is used to wait for the first events and to resize the pipe.
+    """
+
+    name = 'fifo'
+
+    def open(self):
+        os.mkfifo(self.filename)
+        self._fd = os.open(self.filename, os.O_RDONLY | os.O_NONBLOCK)
+        _register(self._fd)
+        set_pipe_size(self._fd, self.pipe_size)
+
+    def close(self):
+        _close(self._fd)
+        os.remove(self.filename)
+
+    def reader_fd(self):
+        return self._fd
+
+    def wait_ready(self, alive, timeout=None):
+        return self._poll(self._fd, alive, timeout)
+
+
+class PipeTransport(Transport):
+    """
+    Anonymous pipe.
+
+    The reading end is opened through `/proc/<pid>/fd/<fd>` (so that it
+    can be opened by the Rivet workers forked before the pipe existed).
+    """
+
+    name = 'pipe'
+
+    def open(self):
+        self._r, self._w = os.pipe()
+        _register(self._r, self._w)
+        set_pipe_size(self._w, self.pipe_size)
+
+        self.writer_path = "/dev/fd/{}".format(self._w)
+        self.reader_path = "/proc/{}/fd/{}".format(os.getpid(), self._r)
+
+    def close(self):
+        _close(self._r)
+        if self._w is not None:
+            _close(self._w)
+            self._w = None
+
+    def reader_fd(self):
+        return self._r
+
+    def preexec(self):
+        # Let PYTHIA inherit the writing end
+        fcntl.fcntl(self._w, fcntl.F_SETFD, 0)
+
+    def started(self):
+        # PYTHIA has its own copy of the writing end: the readers see the
+        # end of the events when it exits
+        _close(self._w)
+        self._w = None
+
+    def wait_ready(self, alive, timeout=None):
+        return self._poll(self._r, alive, timeout)
+
+
+class FileTransport(Transport):
+    """
+    Regular file: all the events are generated before being analysed
+    (no streaming, but the events can be kept for debugging).
+    """
+
+    name = 'file'
+
+    def open(self):
+        open(self.filename, 'w').close()
+
+    def close(self):
+        os.remove(self.filename)
+
+    def wait_ready(self, alive, timeout=None):
+        # Wait for the end of PYTHIA (without timeout)
+        while alive():
+            time.sleep(0.05)
+        return os.path.getsize(self.filename) > 0
+
+
+TRANSPORTS = {
+    'fifo': FIFOTransport,
+    'pipe': PipeTransport,
+    'file': FileTransport
+    }
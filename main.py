@@ -8,9 +8,12 @@ requests and messages sent through the web socket.
 Just run `python main.py` to start the server.
 """
 
-from cern.simulation import Simulation
-from cern.tools import WSComm
-from cern.rivettools import get_lhc_analyses
+from cern.simulation import Simulation, RivetPool, SingleFlight
+from cern.pool import SimulationPool
+from cern.cache import RefDataCache, FinalResultCache, ResultCache
+from cern.tools import WSChannel, WSPump, SIM_ERR, SIM_STP
+from cern.metrics import Metrics, Exposition, CONTENT_TYPE
+from cern.rivettools import AnalysisCatalogue, get_lhc_analyses
 
 import tornado.httpserver
 import tornado.websocket
@@ -19,7 +22,10 @@ import tornado.web
 import rivet
 import json
 import ConfigParser
-import multiprocessing
+import threading
+import hashlib
+import mimetypes
+import gzip
 import os
 import sys
 
@@ -28,33 +34,189 @@ import sys
 config = ConfigParser.RawConfigParser()
 config.read(os.path.join(sys.path[0], 'config.ini'))
 
+# Static files served gzipped (see `precompress`)
+PRECOMPRESSED = ('.js', '.css', '.json', '.svg', '.html', '.txt')
+
+
+def precompress(path, minsize=1024):
+    """
+    Write a gzipped copy (`<file>.gz`) of the `PRECOMPRESSED` static
+    files of `path` (if they are larger than `minsize` bytes and the
+    copy is missing or outdated).
+    """
+
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if not name.endswith(PRECOMPRESSED):
+                continue
+
+            filename = os.path.join(root, name)
+            gzipped = "{}.gz".format(filename)
+            try:
+                if os.path.getsize(filename) < minsize:
+                    continue
+                if os.path.exists(gzipped) and os.path.getmtime(gzipped) >= os.path.getmtime(filename):
+                    continue
+
+                with open(filename, 'rb') as src:
+                    data = src.read()
+                tmpfile = "{}.tmp".format(gzipped)
+                with open(tmpfile, 'wb') as dst:
+                    gz = gzip.GzipFile(name, 'wb', 9, dst)
+                    gz.write(data)
+                    gz.close()
+                os.rename(tmpfile, gzipped)
+            except (IOError, OSError):
+                print "Unable to precompress {}".format(filename)
+
+
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    """
+    Static file handler serving the gzipped copy of the files (see
+    `precompress`) to the clients which accept it.
+
+    The versioned URLs (`static_url` in the templates, with a hash of
+    the content) are cached by the browsers without revalidation.
+    """
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(root, absolute_path)
+        self.original_path = absolute_path
+
+        if absolute_path and 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            gzipped = "{}.gz".format(absolute_path)
+            if os.path.isfile(gzipped) and os.path.getmtime(gzipped) >= os.path.getmtime(absolute_path):
+                self.set_header('Content-Encoding', 'gzip')
+                return gzipped
+
+        return absolute_path
+
+    def get_content_type(self):
+        mime_type, encoding = mimetypes.guess_type(self.original_path)
+        return mime_type or 'application/octet-stream'
+
+    def set_extra_headers(self, path):
+        self.set_header('Vary', 'Accept-Encoding')
+        if self.get_argument('v', None):
+            self.set_header('Cache-Control', 'public, max-age={}, immutable'.format(self.CACHE_MAX_AGE))
+
 
 class MainHandler(tornado.web.RequestHandler):
     """
     The request handler which renders the main template
     and passes some parameters to it (see `templates/home.html`).
+
+    The page is rendered once (and again when `params.json` changes),
+    the browsers revalidate it with its ETag.
     """
 
+    # (mtime of `params.json`, page, ETag)
+    page = None
+
     def get(self):
         """
         Response to the GET request to http://localhost:8888/
         """
 
-        paramsJSONFile = open(os.path.join(config.get('paths', 'static'), 'js', 'params.json'), 'r')
-        paramsJSON = paramsJSONFile.read()
-        paramsJSONFile.close()
+        paramsJSONFilename = os.path.join(config.get('paths', 'static'), 'js', 'params.json')
+        mtime = os.path.getmtime(paramsJSONFilename)
+
+        page = MainHandler.page
+        if page is None or page[0] != mtime:
+            with open(paramsJSONFilename, 'r') as paramsJSONFile:
+                paramsJSON = paramsJSONFile.read()
 
-        kwargs = {
-            'title': "CERN LHC on the web",
-            'header': {
+            kwargs = {
                 'title': "CERN LHC on the web",
-                'headline': "Interactive Test4Theory"
-                },
-            'rivetVersion': rivet.version(),
-            'analyses': get_lhc_analyses(),
-            'paramsJSON': paramsJSON
-            }
-        self.render('templates/home.html', **kwargs)
+                'header': {
+                    'title': "CERN LHC on the web",
+                    'headline': "Interactive Test4Theory"
+                    },
+                'rivetVersion': rivet.version(),
+                'analyses': get_lhc_analyses(),
+                'paramsJSON': paramsJSON
+                }
+            body = self.render_string('templates/home.html', **kwargs)
+            page = (mtime, body, '"{}"'.format(hashlib.sha1(body).hexdigest()))
+            MainHandler.page = page
+
+        self.etag = page[2]
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(page[1])
+
+    def compute_etag(self):
+        return self.etag
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+    Operational metrics of the server, in the Prometheus text format
+    (see `cern/metrics.py`).
+
+    The counters of the `Metrics` are summed up and the state of the
+    pools, caches and web sockets is read on request.
+    """
+
+    def get(self):
+        """
+        Response to the GET request to http://localhost:8888/metrics
+        """
+
+        metrics = Metrics.instance()
+        out = Exposition()
+
+        stats = pool.stats()
+        out.add('t4t_simulations_running', 'gauge', "Simulations running", [((), stats['running'])])
+        out.add('t4t_simulations_queued', 'gauge', "Simulations waiting for a worker", [((), stats['queued'])])
+        out.add('t4t_simulation_workers', 'gauge', "Workers of the simulation pool", [((), stats['workers'])])
+
+        flights = SingleFlight.instance().stats()
+        out.add('t4t_runs_in_progress', 'gauge', "Runs which can be followed by identical requests", [((), flights['runs'])])
+        out.add('t4t_run_clients', 'gauge', "Clients following the runs in progress", [((), flights['clients'])])
+
+        # Progress of the running simulations, by key of their run
+        runs = [((('run', (s.key or '')[:12]),), s.progress) for s in pool.running() if s.progress]
+        out.add('t4t_run_events', 'gauge', "Events analysed by the running simulations, by run",
+            [(labels, progress['events']) for labels, progress in runs])
+        out.add('t4t_run_events_per_second', 'gauge', "Events analysed per second by the running simulations, by run",
+            [(labels, progress['rate']) for labels, progress in runs])
+        out.add('t4t_events_per_second', 'gauge', "Events analysed per second by all the running simulations",
+            [((), sum(progress['rate'] for labels, progress in runs))])
+
+        channels = sorted(WSChannel.channels(), key=lambda channel: channel.id)
+        out.add('t4t_ws_connections', 'gauge', "Open web sockets", [((), len(channels))])
+        out.add('t4t_ws_queue_depth', 'gauge', "Messages waiting to be sent, by web socket",
+            [((('socket', channel.id),), channel.qsize()) for channel in channels])
+        out.add('t4t_ws_socket_messages_total', 'counter', "Messages sent, by web socket",
+            [((('socket', channel.id),), channel.messages) for channel in channels])
+        out.add('t4t_ws_socket_bytes_total', 'counter', "Bytes sent, by web socket",
+            [((('socket', channel.id),), channel.bytes) for channel in channels])
+
+        # (the cache is not created from the IOLoop: not healthy until a
+        # simulation has created it)
+        cache = ResultCache.current()
+        results = cache.stats() if cache else None
+        hits = metrics.value('t4t_result_cache_lookups_total', (('result', 'hit'),))
+        misses = metrics.value('t4t_result_cache_lookups_total', (('result', 'miss'),))
+        out.add('t4t_result_cache_hit_ratio', 'gauge', "Share of the lookups of the stored results which were hits",
+            [((), hits / (hits + misses) if hits + misses else 0.)])
+        out.add('t4t_result_cache_healthy', 'gauge', "Whether the store of the results is reachable",
+            [((), int(results['healthy']) if results else 0)])
+        if results:
+            out.add('t4t_result_cache_lru_hits_total', 'counter', "Lookups answered by the in-memory cache", [((), results['lru']['hits'])])
+            out.add('t4t_result_cache_lru_misses_total', 'counter', "Lookups not answered by the in-memory cache", [((), results['lru']['misses'])])
+            out.summary('t4t_result_cache_latency_seconds', "Latency of the result cache, by operation (get: in-memory "
+                "cache then store, lookup: store, ping: health check)", [((('op', op),), results[op]) for op in ['get', 'lookup', 'ping']])
+
+        rivets = RivetPool.instance().stats()
+        out.add('t4t_rivet_workers', 'gauge', "Rivet processes kept ready by the pool", [((), rivets['size'])])
+        out.add('t4t_rivet_workers_idle', 'gauge', "Idle Rivet processes", [((), rivets['idle'])])
+
+        metrics.export(out)
+
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.set_header('Cache-Control', 'no-cache')
+        self.write(out.text())
 
 
 class WSHandler(tornado.websocket.WebSocketHandler):
@@ -74,16 +236,24 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         """
 
         self.simulation = None
+        self.job = None
 
-        # Use a queue with a `WSComm` thread to send messages through
-        # the web socket. Useful to avoid unexpected loss of connection
-        # when different threads try to write messages at the same time.
-        self._ws = multiprocessing.Queue()
-        self._wscomm = WSComm(self.write_message, self._ws)
-        self._wscomm.start()
+        # Parameters saved by the user (applied to the runs of this
+        # session only, the shared cmnd file is never modified)
+        self.session_params = dict()
 
-        # Register client
-        clients.append((self._ws, self._wscomm))
+        # Paths of the plot headers already sent (the client keeps them
+        # between the runs, see `Simulation._send_plot_headers`)
+        self.headers_sent = set()
+
+        # The client can ask for histograms to be sent as binary frames
+        # (`ws://.../ws?binary=1`, see `encode_binary` in `cern/tools.py`)
+        binary = self.get_argument('binary', '0') == '1'
+
+        # Messages are sent through a `WSChannel`, delivered by the
+        # shared `WSPump` from the IOLoop (so that different threads
+        # never write to the web socket at the same time)
+        self._ws = WSChannel(pump, self, binary)
 
     def on_message(self, message):
         """
@@ -99,24 +269,24 @@ class WSHandler(tornado.websocket.WebSocketHandler):
 
     def on_close(self):
         """
-        Properly stop the simulation when the connection is closed.
+        Properly stop the simulation when the connection is closed (unless
+        other clients follow the same run).
         """
 
-        if self.simulation:
+        if self.simulation and not self.simulation.detach():
+            if self.job:
+                pool.cancel(self.job)
             self.simulation.stop()
 
-        self._wscomm.stop()
+        # Drop the pending messages (and release the blocked threads)
         self._ws.close()
-        self._wscomm.join()
-
-        clients.remove((self._ws, self._wscomm))
 
     def init(self, data):
         """
-        Create a new `Simulation` thread.
+        Create a new `Simulation` object.
         """
 
-        self.simulation = Simulation(data['generator'], data['params'], data['fifo'], self._ws)
+        self.simulation = Simulation(data['generator'], data['params'], data['fifo'], self._ws, self.session_params, self.headers_sent)
 
     def load_params(self, data):
         """
@@ -130,13 +300,32 @@ class WSHandler(tornado.websocket.WebSocketHandler):
 
     def run(self, data):
         """
-        Run the simulation with the specified analysis and update interval.
+        Run the simulation with the specified analysis and update interval
+        (or add more events to the stored results, `more`).
+
+        If an identical run (same parameters and analyses) is in progress,
+        the client follows it. Otherwise the simulation is queued on the
+        `SimulationPool` and starts as soon as a worker is available.
         """
 
         if self.simulation:
             self.simulation.set_analysis(data['analysis'])
             self.simulation.set_histointerval(data['histointerval'])
-            self.simulation.start()
+            self.simulation.set_more_events(data.get('more', 0))
+            self.simulation.set_send_refs(data.get('refs', True))
+            self.simulation.freeze_params()
+
+            if self.simulation.follow():
+                self.job = None
+                return
+
+            self.job = pool.submit(self.simulation)
+            self.simulation.job = self.job
+
+            if not self.job:
+                self.simulation.unregister()
+                self._ws.put(['error', "Server busy - too many simulations waiting, please try again later"])
+                self._ws.put(['signal', SIM_ERR])
 
     def pause(self, data):
         """
@@ -156,15 +345,22 @@ class WSHandler(tornado.websocket.WebSocketHandler):
 
     def stop(self, data):
         """
-        Stop the simulation (PYTHIA and Rivet).
+        Stop the simulation (PYTHIA and Rivet), or remove it from
+        the queue if it has not started yet. A run followed by other
+        clients goes on without this one.
         """
 
-        if self.simulation:
+        if self.simulation and self.simulation.detach():
+            self.simulation = self.simulation.renew()
+            self.job = None
+        elif self.job and pool.cancel(self.job):
+            self._ws.put(['signal', SIM_STP])
+        elif self.simulation:
             self.simulation.stop()
 
     def save_params(self, data):
         """
-        Save parameters to PYTHIA cmnd file.
+        Save parameters for the next runs of the session.
         """
 
         if self.simulation:
@@ -209,12 +405,36 @@ if __name__ == "__main__":
     specified in `config.ini`.
     """
 
-    clients = []
+    # Single pump delivering the messages of all the web sockets
+    pump = WSPump()
+
+    # Processes loading the final histograms (forked before any thread is started)
+    finals = FinalResultCache.instance()
+
+    # Pre-initialized Rivet processes (forked before any thread is started)
+    rivets = RivetPool.instance()
+
+    # Simulations are scheduled on a bounded pool of workers
+    pool = SimulationPool(config.getint('pool', 'workers'), config.getint('pool', 'max_queued'))
+
+    # Index of the installed analyses, used by the home page
+    AnalysisCatalogue.instance()
+
+    # Load the reference histograms of the most used analyses
+    prewarm = [a.strip() for a in config.get('refdata', 'prewarm').split(',') if a.strip()]
+    if prewarm:
+        refdata = threading.Thread(target=RefDataCache.instance().prewarm, args=(prewarm,))
+        refdata.daemon = True
+        refdata.start()
+
+    # Gzipped copies of the static files
+    precompress(config.get('paths', 'static'))
 
     application = tornado.web.Application([
         (r'/', MainHandler),
+        (r'/metrics', MetricsHandler),
         (r'/ws', WSHandler),
-    ], static_path=config.get('paths', 'static'))
+    ], static_path=config.get('paths', 'static'), static_handler_class=StaticFileHandler, gzip=True)
 
     http_server = tornado.httpserver.HTTPServer(application)
     http_server.listen(8888)
@@ -222,9 +442,8 @@ if __name__ == "__main__":
     try:
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt:
-        for _ws, _wscomm in clients:
-            _wscomm.stop()
-            _ws.close()
-            _wscomm.join()
+        pool.shutdown()
+        rivets.shutdown()
+        finals.workers.terminate()
         tornado.ioloop.IOLoop.instance().stop()
 
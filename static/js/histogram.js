@@ -86,6 +86,147 @@ var cc = {
         }
     };
 
+// Derived values of the histograms (height, errors, mean...), computed
+// from the raw statistics sent by the server
+var HistoStats = {
+    dbnStats: function(dbn) {
+        var stats = {effNumEntries: 0, mean: 0, rms: 0, stdDev: 0, stdErr: 0, variance: 0};
+
+        if (dbn.sumW2 !== 0) {
+            stats.effNumEntries = dbn.sumW * dbn.sumW / dbn.sumW2;
+        }
+        if (dbn.sumW !== 0) {
+            stats.mean = dbn.sumWX / dbn.sumW;
+            if (dbn.sumWX2 / dbn.sumW >= 0) {
+                stats.rms = Math.sqrt(dbn.sumWX2 / dbn.sumW);
+            }
+        }
+        if (dbn.sumW * dbn.sumW !== dbn.sumW2) {
+            stats.variance = (dbn.sumWX2 * dbn.sumW - dbn.sumWX * dbn.sumWX) / (dbn.sumW * dbn.sumW - dbn.sumW2);
+            if (stats.variance > 0) {
+                stats.stdDev = Math.sqrt(stats.variance);
+                if (stats.effNumEntries > 0) {
+                    stats.stdErr = stats.stdDev / Math.sqrt(stats.effNumEntries);
+                }
+            }
+        }
+        return stats;
+    },
+    scaleDbn: function(dbn, factor) {
+        return {
+            sumW: factor * dbn.sumW,
+            sumW2: factor * factor * dbn.sumW2,
+            sumWX: factor * dbn.sumWX,
+            sumWX2: factor * dbn.sumWX2,
+            numEntries: dbn.numEntries
+        };
+    },
+    histo1DBin: function(edgeLow, edgeHigh, dbn) {
+        var width = edgeHigh - edgeLow;
+        var midpoint = (edgeLow + edgeHigh) / 2;
+        var height = dbn.sumW / width;
+        var heightErr = Math.sqrt(dbn.sumW2) / width;
+        var stats = this.dbnStats(dbn);
+
+        return {
+            _type: 'Histo1D',
+            _yRangeLow: height - heightErr,
+            _yRangeHigh: height + heightErr,
+            area: dbn.sumW,
+            areaErr: Math.sqrt(dbn.sumW2),
+            edgeLow: edgeLow,
+            edgeHigh: edgeHigh,
+            effNumEntries: stats.effNumEntries,
+            focus: dbn.sumW !== 0 ? stats.mean : midpoint,
+            height: height,
+            heightErr: heightErr,
+            mean: stats.mean,
+            midpoint: midpoint,
+            numEntries: dbn.numEntries,
+            relErr: dbn.sumW !== 0 ? Math.sqrt(dbn.sumW2) / dbn.sumW : 0,
+            rms: stats.rms,
+            stdDev: stats.stdDev,
+            stdErr: stats.stdErr,
+            sumW: dbn.sumW,
+            sumW2: dbn.sumW2,
+            sumWX: dbn.sumWX,
+            sumWX2: dbn.sumWX2,
+            width: width
+        };
+    },
+    derive: function(raw, normalize) {
+        /*
+         * Drawable histogram (one object per bin or point) from the `raw`
+         * columnar histogram (one array per field, see `cern/histogramming.py`),
+         * normalized to unit area if `normalize`.
+         */
+
+        var histo = $.extend({}, raw);
+        var i;
+
+        if (raw.type === 'Histo1D') {
+            var factor = (normalize && raw.totalDbn.sumW !== 0) ? 1 / raw.totalDbn.sumW : 1;
+            var totalDbn = this.scaleDbn(raw.totalDbn, factor);
+            var columns = raw.bins;
+
+            histo.bins = [];
+            for (i = 0; i < columns.sumW.length; i++) {
+                histo.bins.push(this.histo1DBin(columns.edgeLow[i], columns.edgeHigh[i], this.scaleDbn({
+                    sumW: columns.sumW[i],
+                    sumW2: columns.sumW2[i],
+                    sumWX: columns.sumWX[i],
+                    sumWX2: columns.sumWX2[i],
+                    numEntries: columns.numEntries[i]
+                }, factor)));
+            }
+            histo.totalDbn = $.extend(totalDbn, this.dbnStats(totalDbn));
+        } else {
+            var p = raw.points;
+
+            histo.points = [];
+            for (i = 0; i < p.x.length; i++) {
+                histo.points.push({
+                    _type: 'Scatter2D',
+                    x: p.x[i],
+                    y: p.y[i],
+                    xErrMinus: p.xErrMinus[i],
+                    xErrPlus: p.xErrPlus[i],
+                    yErrMinus: p.yErrMinus[i],
+                    yErrPlus: p.yErrPlus[i],
+                    xRangeLow: p.x[i] - p.xErrMinus[i],
+                    xRangeHigh: p.x[i] + p.xErrPlus[i],
+                    yRangeLow: p.y[i] - p.yErrMinus[i],
+                    yRangeHigh: p.y[i] + p.yErrPlus[i]
+                });
+            }
+        }
+        return histo;
+    },
+    applyDelta: function(raw, delta, fields) {
+        /*
+         * Update the `raw` columnar histogram with the changed values
+         * of `delta` (see `HistoStream` in `cern/histogramming.py`).
+         */
+
+        var el = cc[raw.type].el;
+        var f = fields[raw.type];
+
+        for (var i = 0; i < delta[el].length; i++) {
+            var index = delta[el][i][0];
+            for (var j = 0; j < f.length; j++) {
+                raw[el][f[j]][index] = delta[el][i][j + 1];
+            }
+        }
+        ['totalDbn', 'underflow', 'overflow'].forEach(function(dbn) {
+            if (delta.hasOwnProperty(dbn)) {
+                for (var j = 0; j < f.length; j++) {
+                    raw[dbn][f[j]] = delta[dbn][j];
+                }
+            }
+        });
+    }
+};
+
 var Histogram = function(analysis, path, headers, type) {
     this.analysis = analysis;
     this.path = path;
@@ -1,5 +1,30 @@
 /* Main script for the control of the UI */
 
+var decodeBinaryMessage = function(buffer) {
+    /*
+     * Decode a binary web socket frame (see `encode_binary` in `cern/tools.py`).
+     *
+     * The histogram columns are returned as `Float64Array` views on `buffer`.
+     */
+
+    var headerLength = new DataView(buffer).getUint32(0, true);
+    var bytes = new Uint8Array(buffer, 4, headerLength);
+    var dataStart = Math.ceil((4 + headerLength) / 8) * 8;
+    var header = '';
+
+    // The JSON header is ASCII (non-ASCII characters are escaped)
+    for (var i = 0; i < bytes.length; i += 8192) {
+        header += String.fromCharCode.apply(null, bytes.subarray(i, i + 8192));
+    }
+
+    return JSON.parse(header, function(key, value) {
+        if (value !== null && typeof value === 'object' && value.hasOwnProperty('$a')) {
+            return new Float64Array(buffer, dataStart + value.$a[0], value.$a[1]);
+        }
+        return value;
+    });
+};
+
 var Simulation = function(ws, generator, params, fifo) {
     /*
      * `ws` the web socket object
@@ -28,11 +53,19 @@ Simulation.prototype = {
         var message = {action: 'load_params', params: params};
         this.ws.send(JSON.stringify(message));
     },
-    run: function() {
+    run: function(refs, more) {
+        /*
+         * `refs` the analyses whose reference histograms are needed
+         * (not received during a previous run of the analysis)
+         * `more` whether to add new events to the stored results
+         */
+
         var message = {
             action: 'run',
-            analysis: this.analysis,
-            histointerval: this.histointerval
+            analysis: this.analyses,
+            histointerval: this.histointerval,
+            refs: refs,
+            more: more || false
             };
         this.ws.send(JSON.stringify(message));
     },
@@ -52,8 +85,12 @@ Simulation.prototype = {
         var message = {action: 'compare', yoda_files: yodaFiles};
         this.ws.send(JSON.stringify(message));
     },
-    setAnalysis: function(analysis) {
-        this.analysis = analysis;
+    setAnalyses: function(analyses) {
+        /*
+         * `analyses` the analyses run together (on the same events)
+         */
+
+        this.analyses = analyses;
     },
     setHistoInterval: function(histointerval) {
         this.histointerval = histointerval;
@@ -90,95 +127,112 @@ var SimulationControl = function(simulation, analysisSelector, histoIntervalSlid
 };
 
 SimulationControl.prototype = {
-    runAction: function() {
+    runAction: function(more) {
         /*
-         * When the user clicks on the "Run" button.
+         * When the user clicks on the "Run" button (or on the "More events"
+         * button, `more`).
          */
 
         // If the parameters have been modified but not saved, a modal window warns the user
         if (this.parameters.changed) {
             $('#params-changed-modal').modal('show');
         } else {
-            // Get the analysis and histo interval chosen by the user
-            var analysis = this.analysisSelector.val();
+            // Get the analyses and histo interval chosen by the user
+            var analyses = this.selectedAnalyses();
             var histoInterval = this.histoIntervalSlider.slider('value');
+            var refs = [];
 
-            // DOM elements (depending on the chosen analysis)
-            var analysesTableEntry = $('#' + analysis);
-            var analysesTableStatus = $('#' + analysis + ' .status');
-            var runNumber = $('#' + analysis + ' .run-number');
-            var histogramsDiv = $('#histograms-' + analysis);
-
-            this.simulation.setAnalysis(analysis);
+            this.simulation.setAnalyses(analyses);
             this.simulation.setHistoInterval(histoInterval);
 
             // Empty the "consoles" from precedent runs
             this.pythiaFullOutput.empty();
             this.rivetFullOutput.empty();
 
-            // Create or update table entry corresponding to the analysis
-            if (analysesTableEntry.length) {
-                analysesTableEntry.attr('class', 'warning');
-                analysesTableStatus.text('Started');
-                runNumber.text(parseInt(runNumber.text()) + 1);
-                $('#' + analysis + ' .delete').prop('disabled', true);
+            for (var i = 0; i < analyses.length; i++) {
+                this._prepareAnalysis(analyses[i]);
+                if (!this.histograms.hasRefs(analyses[i])) {
+                    refs.push(analyses[i]);
+                }
+            }
 
-                this._updateModal();
-            } else {
-                var tableEntry = '<tr id="' + analysis + '" class="warning">';
-                tableEntry += '<td><strong>' + analysis + '</strong></td>';
-                tableEntry += '<td class="run-number">1</td>';
-                tableEntry += '<td class="status">Started</td>';
-                tableEntry += '<td>';
-                tableEntry += '<button type="button" class="params btn">Compare runs</button>';
-                tableEntry += '<button type="button" class="delete btn btn-danger" disabled="disabled">Delete</button>';
-                tableEntry += '</td>';
-                tableEntry += '</tr>';
-
-                this.analysesTable.append(tableEntry);
-
-                // Need a closure to access `histograms` for the event handler
-                (function(histograms) {
-                    $('#' + analysis + ' .delete').click(function() {
-                        histograms.remove(analysis);
-                        if ($('#histograms-' + analysis).length) {
-                            $('#histograms-' + analysis).remove();
-                        }
-                        $(this).parent().parent().remove();
-                        $('#' + analysis + '-modal').remove();
-                    });
-                })(this.histograms);
+            // New events can be added to the stored results only once
+            // this run has ended (see `endAction`)
+            $('#simulation-more').prop('disabled', true);
 
-                this._createModal();
+            this.simulation.init();
+            this.simulation.run(refs, more);
+        }
+    },
+    _prepareAnalysis: function(analysis) {
+        /*
+         * Create or update the DOM elements of an analysis before a run.
+         */
+
+        var analysesTableEntry = $('#' + analysis);
+        var analysesTableStatus = $('#' + analysis + ' .status');
+        var runNumber = $('#' + analysis + ' .run-number');
+        var histogramsDiv = $('#histograms-' + analysis);
+
+        // Create or update table entry corresponding to the analysis
+        if (analysesTableEntry.length) {
+            analysesTableEntry.attr('class', 'warning');
+            analysesTableStatus.text('Started');
+            runNumber.text(parseInt(runNumber.text()) + 1);
+            $('#' + analysis + ' .delete').prop('disabled', true);
 
-                $('#' + analysis + ' .params').click(function() {
-                    $('#' + analysis + '-modal').modal('show');
+            this._updateModal(analysis);
+        } else {
+            var tableEntry = '<tr id="' + analysis + '" class="warning">';
+            tableEntry += '<td><strong>' + analysis + '</strong></td>';
+            tableEntry += '<td class="run-number">1</td>';
+            tableEntry += '<td class="status">Started</td>';
+            tableEntry += '<td>';
+            tableEntry += '<button type="button" class="params btn">Compare runs</button>';
+            tableEntry += '<button type="button" class="delete btn btn-danger" disabled="disabled">Delete</button>';
+            tableEntry += '</td>';
+            tableEntry += '</tr>';
+
+            this.analysesTable.append(tableEntry);
+
+            // Need a closure to access `histograms` for the event handler
+            (function(histograms) {
+                $('#' + analysis + ' .delete').click(function() {
+                    histograms.remove(analysis);
+                    if ($('#histograms-' + analysis).length) {
+                        $('#histograms-' + analysis).remove();
+                    }
+                    $(this).parent().parent().remove();
+                    $('#' + analysis + '-modal').remove();
                 });
-            }
+            })(this.histograms);
 
-            // Create the div for the histograms of this analysis if it doesn't exist
-            if (!histogramsDiv.length) {
-                var histogramContainer = $(document.createElement('div')).appendTo('#histograms')
-                    .attr('id', 'histograms-' + analysis)
-                    .attr('class', 'histogram-container')
-                    .attr('data-analysis', analysis);
+            this._createModal(analysis);
 
-                $(document.createElement('h2')).appendTo(histogramContainer)
-                    .text(analysis);
+            $('#' + analysis + ' .params').click(function() {
+                $('#' + analysis + '-modal').modal('show');
+            });
+        }
 
-                var rowFluid = $(document.createElement('div')).appendTo(histogramContainer)
-                    .attr('class', 'row-fluid');
+        // Create the div for the histograms of this analysis if it doesn't exist
+        if (!histogramsDiv.length) {
+            var histogramContainer = $(document.createElement('div')).appendTo('#histograms')
+                .attr('id', 'histograms-' + analysis)
+                .attr('class', 'histogram-container')
+                .attr('data-analysis', analysis);
 
-                $(document.createElement('div')).appendTo(rowFluid)
-                    .attr('class', 'first-histogram span7')
-                    .append('<svg class="histogram"></svg>');
+            $(document.createElement('h2')).appendTo(histogramContainer)
+                .text(analysis);
 
-                $(document.createElement('div')).appendTo(rowFluid)
-                    .attr('class', 'histogram-selector span5');
-            }
+            var rowFluid = $(document.createElement('div')).appendTo(histogramContainer)
+                .attr('class', 'row-fluid');
 
-            this.simulation.init();
-            this.simulation.run();
+            $(document.createElement('div')).appendTo(rowFluid)
+                .attr('class', 'first-histogram span7')
+                .append('<svg class="histogram"></svg>');
+
+            $(document.createElement('div')).appendTo(rowFluid)
+                .attr('class', 'histogram-selector span5');
         }
     },
     pauseAction: function() {
@@ -223,28 +277,48 @@ SimulationControl.prototype = {
     },
     updateAnalysesTable: function(state, status) {
         /*
-         * Update the status and color of the row corresponding
-         * to the currently running analysis.
+         * Update the status and color of the rows corresponding
+         * to the currently running analyses.
          */
 
-        var analysesTableEntry = $('#' + this.simulation.analysis);
-        var analysesTableStatus = $('#' + this.simulation.analysis + ' .status');
+        for (var i = 0; i < this.simulation.analyses.length; i++) {
+            var analysis = this.simulation.analyses[i];
+            var analysesTableEntry = $('#' + analysis);
+            var analysesTableStatus = $('#' + analysis + ' .status');
 
-        if (analysesTableEntry.length) {
-            analysesTableEntry.attr('class', state);
-            analysesTableStatus.text(status);
+            if (analysesTableEntry.length) {
+                analysesTableEntry.attr('class', state);
+                analysesTableStatus.text(status);
+            }
+
+            if (state === 'error' || state === 'success') {
+                $('#' + analysis + ' .delete').prop('disabled', false);
+            }
         }
+    },
+    updateCurrentRun: function(labelClass, text, done) {
+        /*
+         * Update the label of the current run in the modal windows
+         * "Compare runs" of the running analyses (detached from the
+         * run once it is `done`).
+         */
+
+        for (var i = 0; i < this.simulation.analyses.length; i++) {
+            var analysis = this.simulation.analyses[i];
+            var label = $('#current-simulation-label-' + analysis);
 
-        if (state === 'error' || state === 'success') {
-            $('#' + this.simulation.analysis + ' .delete').prop('disabled', false);
+            label.removeClass().addClass(labelClass).text(text);
+            if (done) {
+                label.removeAttr('id');
+                $('#current-simulation-checkbox-' + analysis).removeAttr('id');
+            }
         }
     },
-    _createModal: function() {
+    _createModal: function(analysis) {
         /*
-         * Create the modal window "Compare runs" for the selected analysis.
+         * Create the modal window "Compare runs" for `analysis`.
          */
 
-        var analysis = this.simulation.analysis;
         var analyses = $('#analyses');
 
         var modal = '<div id="' + analysis + '-modal" class="modal hide fade" tabindex="-1" role="dialog" aria-labelledby="' + analysis + '-modal-title" aria-hidden="true">';
@@ -261,7 +335,7 @@ SimulationControl.prototype = {
         modal += '<tbody>';
         modal += '<tr id="' + analysis + '-compare">';
         modal += '<th class="red">Compare runs</th>';
-        modal += '<td><label class="checkbox"><input type="checkbox" id="current-simulation-checkbox" disabled="disabled"><span id="current-simulation-label" class="label">Running</span></label></td>';
+        modal += '<td><label class="checkbox"><input type="checkbox" id="current-simulation-checkbox-' + analysis + '" disabled="disabled"><span id="current-simulation-label-' + analysis + '" class="label">Running</span></label></td>';
         modal += '</tr>';
         for (var i = 0; i < this.parameters.params.length; i++) {
             modal += '<tr id="' + analysis + '-' + this.parameters.params[i].name + '">';
@@ -293,17 +367,16 @@ SimulationControl.prototype = {
             });
         })(this);
     },
-    _updateModal: function() {
+    _updateModal: function(analysis) {
         /*
-         * Update the modal window "Compare runs" for the selected analysis (new run params).
+         * Update the modal window "Compare runs" for `analysis` (new run params).
          */
 
-        var analysis = this.simulation.analysis;
         var modalTH = $('#' + analysis + '-modal-th');
         var runNumber = $('#' + analysis + ' .run-number');
         var modalCompare = $('#' + analysis + '-compare');
 
-        modalCompare.append('<td><label class="checkbox"><input type="checkbox" id="current-simulation-checkbox" disabled="disabled"><span id="current-simulation-label" class="label">Running</span></label></td>');
+        modalCompare.append('<td><label class="checkbox"><input type="checkbox" id="current-simulation-checkbox-' + analysis + '" disabled="disabled"><span id="current-simulation-label-' + analysis + '" class="label">Running</span></label></td>');
         modalTH.append('<th>No. ' + runNumber.text() + '</th>');
 
         for (var i = 0; i < this.parameters.params.length; i++) {
@@ -320,7 +393,7 @@ SimulationControl.prototype = {
          * be updated accordingly).
          */
 
-        var analysis = this.analysisSelector.val();
+        var analysis = this.selectedAnalyses()[0];
 
         this.simulation.requiredBeams(analysis);
     },
@@ -332,9 +405,17 @@ SimulationControl.prototype = {
          * in the modal dialog "Analysis details".
          */
 
-        var analysis = this.analysisSelector.val();
+        var analysis = this.selectedAnalyses()[0];
 
         this.simulation.analysisDetails(analysis);
+    },
+    selectedAnalyses: function() {
+        /*
+         * The analyses selected by the user (several analyses can be run
+         * together on the same events).
+         */
+
+        return [].concat(this.analysisSelector.val() || []);
     }
 };
 
@@ -380,6 +461,7 @@ Parameters.prototype = {
                             paramValue.text(ui.value);
                             context.params[i].currentValue = ui.value;
                             $('#save-params').prop('disabled', false);
+                            $('#simulation-more').prop('disabled', true);
                             context.changed = true;
                         }
                     });
@@ -397,6 +479,7 @@ Parameters.prototype = {
                         paramValue.text(newVal);
                         context.params[i].currentValue = newVal;
                         $('#save-params').prop('disabled', false);
+                        $('#simulation-more').prop('disabled', true);
                         context.changed = true;
                     });
                     break;
@@ -419,6 +502,7 @@ Parameters.prototype = {
                         paramValue.text(newVal);
                         context.params[i].currentValue = newVal;
                         $('#save-params').prop('disabled', false);
+                        $('#simulation-more').prop('disabled', true);
                         context.changed = true;
                     });
                     break;
@@ -497,6 +581,7 @@ Parameters.prototype = {
 
         if (changed) {
             $('#save-params').prop('disabled', false);
+            $('#simulation-more').prop('disabled', true);
             this.changed = true;
         } else {
             $('#save-params').prop('disabled', true);
@@ -551,6 +636,13 @@ var Histograms = function(simulation) {
     this.simulation = simulation;
 
     this.histograms = {};
+
+    // Raw intermediate histograms of the current run, by analysis (the
+    // server keeps a stream of versions per analysis, see `update`)
+    this.streams = {};
+
+    // Plot options (title, labels...) by path, sent once by the server
+    this.headers = {};
 };
 
 Histograms.prototype = {
@@ -583,6 +675,33 @@ Histograms.prototype = {
             return this.histograms.hasOwnProperty(analysis) && this.histograms[analysis].hasOwnProperty(path);
         }
     },
+    setHeaders: function(headers) {
+        /*
+         * Keep the plot options of the histograms (by path).
+         */
+
+        for (var path in headers) {
+            if (headers.hasOwnProperty(path)) {
+                this.headers[path] = headers[path];
+            }
+        }
+    },
+    hasRefs: function(analysis) {
+        /*
+         * Whether the reference histograms of `analysis` were received.
+         */
+
+        var histos = this.get(analysis);
+
+        if (histos) {
+            for (var path in histos) {
+                if (histos.hasOwnProperty(path) && histos[path] instanceof Histogram && histos[path].refHisto) {
+                    return true;
+                }
+            }
+        }
+        return false;
+    },
     selected: function(analysis, path) {
         /*
          * Select a path or get a selected path.
@@ -629,17 +748,19 @@ Histograms.prototype = {
             })(this);
         }
     },
-    drawAll: function(analysis, histos) {
+    drawAll: function(analysis, rawHistos, normalize) {
         /*
-         * Draw all `histos` for `analysis`.
+         * Draw all `rawHistos` (columnar histograms sent by the server)
+         * for `analysis`, normalized to unit area if `normalize`.
          */
 
         var paused = false;
+        var histos = rawHistos.map(function(h) { return HistoStats.derive(h, normalize); });
 
         for (var i = 0; i < histos.length; i++) {
             var ref = false;
             var path = histos[i].annotations.Path;
-            var headers = histos[i].plotHeaders;
+            var headers = this.headers[path] || {};
             var type = histos[i].type;
 
             // Reference histograms path begin with "/REF/"
@@ -687,6 +808,40 @@ Histograms.prototype = {
         }
         this.histogramChooser(true);
     },
+    update: function(analysis, update) {
+        /*
+         * Apply an intermediate histograms `update` (full snapshot or
+         * delta of the previous version) and draw all histograms.
+         */
+
+        var stream = this.streams[analysis];
+
+        if (update.full) {
+            stream = {version: update.version, normalize: update.normalize, fields: update.fields, histos: {}};
+            for (var i = 0; i < update.histos.length; i++) {
+                stream.histos[update.histos[i].annotations.Path] = update.histos[i];
+            }
+            this.streams[analysis] = stream;
+        } else if (stream && update.version === stream.version + 1) {
+            for (var path in update.histos) {
+                if (update.histos.hasOwnProperty(path) && stream.histos.hasOwnProperty(path)) {
+                    HistoStats.applyDelta(stream.histos[path], update.histos[path], stream.fields);
+                }
+            }
+            stream.version = update.version;
+        } else {
+            // Missing base version, wait for the next full snapshot
+            return;
+        }
+
+        var histos = [];
+        for (var path in stream.histos) {
+            if (stream.histos.hasOwnProperty(path)) {
+                histos.push(stream.histos[path]);
+            }
+        }
+        this.drawAll(analysis, histos, stream.normalize);
+    },
     reset: function(analysis) {
         /*
          * Remove all simulation data from the histograms of `analysis`.
@@ -702,11 +857,13 @@ Histograms.prototype = {
             }
         }
     },
-    compare: function(histos) {
+    compare: function(rawHistos) {
         /*
-         * Add `histos` to the histograms for comparison.
+         * Add `rawHistos` to the histograms for comparison.
          */
 
+        var histos = rawHistos.map(function(h) { return HistoStats.derive(h, false); });
+
         for (var i = 0; i < histos.length; i++) {
             var path = histos[i].annotations.Path;
             var analysis = path.split('/')[1];
@@ -724,13 +881,16 @@ Histograms.prototype = {
 };
 
 $(function() {
-    var ws = new WebSocket('ws://localhost:8888/ws');
+    // Ask for binary histogram frames if typed arrays are supported
+    var ws = new WebSocket('ws://localhost:8888/ws' + (window.Float64Array && window.DataView ? '?binary=1' : ''));
+    ws.binaryType = 'arraybuffer';
     var simulation = new Simulation(ws, 'main42.exe', 'main42.cmnd', 'hepmc.fifo');
     var histograms = new Histograms(simulation);
 
     // DOM elements
     var simulationControlBtn = $('#simulation-control');
     var simulationStopBtn = $('#simulation-stop');
+    var simulationMoreBtn = $('#simulation-more');
     var analysisLabel = $('#ana-label');
     var analysisSelector = $('#analysis');
     var wsStatus = $('#ws-status');
@@ -784,6 +944,7 @@ $(function() {
     });
 
     analysisSelector.change(function() {
+        simulationMoreBtn.prop('disabled', true);
         simulationControl.retrieveAnalysisDetails();
     });
 
@@ -791,6 +952,10 @@ $(function() {
         simulationControl.runAction();
     });
 
+    simulationMoreBtn.click(function() {
+        simulationControl.runAction(true);
+    });
+
     pythiaOutput.click(function() {
         pythiaModal.modal('show');
     });
@@ -834,7 +999,12 @@ $(function() {
         MathJax.Hub.Queue(["Typeset", MathJax.Hub]);
     });
 
-    function endAction() {
+    function endAction(stored) {
+        /*
+         * At the end of a run (`stored` whether its results were stored,
+         * so that new events can be added to them).
+         */
+
         simulationControlBtn.unbind();
         simulationControlBtn.text('Run');
         simulationControlBtn.prop('disabled', false);
@@ -843,9 +1013,9 @@ $(function() {
         });
         simulationStopBtn.unbind();
         simulationStopBtn.prop('disabled', true);
+        simulationMoreBtn.prop('disabled', !stored);
         pythiaOutputCL.text('Not running');
         rivetOutputCL.text('Not running');
-        $('#current-simulation-checkbox').removeAttr('id');
         MathJax.Hub.Queue(["Typeset", MathJax.Hub]);
     }
 
@@ -880,19 +1050,29 @@ $(function() {
     };
 
     ws.onmessage = function(evt) {
-        var received_msg = JSON.parse(evt.data);
+        var received_msg = (evt.data instanceof ArrayBuffer) ? decodeBinaryMessage(evt.data) : JSON.parse(evt.data);
         switch(received_msg.type) {
         case 'error':
             wsError.text(received_msg.content);
             wsError.stop().fadeIn().delay(5000).fadeOut();
             break;
         case 'pythia':
-            pythiaOutputCL.text(received_msg.content);
+            // Several lines of output are batched in a single message
+            var lines = $.trim(received_msg.content).split('\n');
+            pythiaOutputCL.text(lines[lines.length - 1]);
             pythiaFullOutput.append(document.createTextNode(received_msg.content));
             break;
         case 'rivet':
             rivetOutputCL.text(received_msg.content);
             break;
+        case 'progress':
+            var progress = received_msg.content;
+            var status = 'Event no. ' + progress.events + ' processed (' + Math.round(progress.rate) + ' events/s';
+            if (progress.eta !== null) {
+                status += ', ' + Math.ceil(progress.eta) + ' s remaining';
+            }
+            rivetOutputCL.text(status + ')');
+            break;
         case 'rivet_out':
             rivetFullOutput.append(document.createTextNode(received_msg.content));
             break;
@@ -909,10 +1089,16 @@ $(function() {
             }
             break;
         case 'yoda':
-            $('#current-simulation-checkbox').attr('id', received_msg.content).prop('disabled', false);
+            $('#current-simulation-checkbox-' + received_msg.analysis).attr('id', received_msg.content).prop('disabled', false);
             break;
         case 'histos':
-            histograms.drawAll(simulation.analysis, received_msg.content);
+            histograms.drawAll(received_msg.analysis, received_msg.content);
+            break;
+        case 'plot_headers':
+            histograms.setHeaders(received_msg.content);
+            break;
+        case 'histos_update':
+            histograms.update(received_msg.analysis, received_msg.content);
             break;
         case 'compare_histos':
             histograms.compare(received_msg.content);
@@ -920,13 +1106,17 @@ $(function() {
         case 'analysis_details':
             writeAnalysisDetails(received_msg.content);
             break;
+        case 'queue':
+            pythiaOutputCL.text('Waiting for a free worker (position ' + received_msg.content + ' in queue)');
+            simulationControl.updateAnalysesTable('info', 'Queued (' + received_msg.content + ')');
+            break;
         case 'signal':
             switch(received_msg.content) {
             // SIM_END (simulation finished)
             case 0:
-                endAction();
+                endAction(true);
                 simulationControl.updateAnalysesTable('success', 'Success');
-                $('#current-simulation-label').removeClass().addClass('label label-success').text('Success').removeAttr('id');
+                simulationControl.updateCurrentRun('label label-success', 'Success', true);
                 break;
             // PYT_RUN (PYTHIA started)
             case 1:
@@ -951,7 +1141,7 @@ $(function() {
                     simulationControl.stopAction();
                 });
                 simulationControl.updateAnalysesTable('warning', 'Running');
-                $('#current-simulation-label').removeClass().addClass('label').text('Running');
+                simulationControl.updateCurrentRun('label', 'Running', false);
                 break;
             // RIV_STP (Rivet stopped)
             case 4:
@@ -963,18 +1153,19 @@ $(function() {
                 });
                 rivetOutputCL.text('Paused');
                 simulationControl.updateAnalysesTable('info', 'Paused');
-                $('#current-simulation-label').removeClass().addClass('label label-info').text('Paused');
+                simulationControl.updateCurrentRun('label label-info', 'Paused', false);
                 break;
             // SIM_ERR (error during simulation)
             case 5:
-                endAction();
+                endAction(false);
                 simulationControl.updateAnalysesTable('error', 'Error');
-                $('#current-simulation-label').removeClass().addClass('label label-important').text('Error').removeAttr('id');
+                simulationControl.updateCurrentRun('label label-important', 'Error', true);
                 break;
             // PARAMS_SAVED
             case 6:
                 parameters.changed = false;
                 saveParamsBtn.prop('disabled', true);
+                simulationMoreBtn.prop('disabled', true);
                 saveParamsBtn.addClass('btn-success');
                 setTimeout(function() { saveParamsBtn.removeClass('btn-success'); }, 1000);
                 break;
@@ -985,9 +1176,21 @@ $(function() {
                 break;
             // SIM_STP (simulation stopped by user)
             case 8:
-                endAction();
+                endAction(false);
                 simulationControl.updateAnalysesTable('success', 'Stopped (unfinished)');
-                $('#current-simulation-label').removeClass().addClass('label label-warning').text('Partial').removeAttr('id');
+                simulationControl.updateCurrentRun('label label-warning', 'Partial', true);
+                break;
+            // SIM_QUE (simulation waiting for a free worker)
+            case 9:
+                simulationControlBtn.unbind();
+                simulationControlBtn.text('Queued');
+                simulationControlBtn.prop('disabled', true);
+                simulationMoreBtn.prop('disabled', true);
+                simulationStopBtn.unbind();
+                simulationStopBtn.prop('disabled', false);
+                simulationStopBtn.click(function() {
+                    simulationControl.stopAction();
+                });
                 break;
             }
             break;
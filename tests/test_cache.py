@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the keys of the parameter sets and of the result cache
+(`cern/cache.py`).
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from cern import cache
+from cern.cache import LRUCache, ResultCache, normalize_params, params_key
+from cern.tools import SQLiteDB
+
+
+class ParamsKeyTest(unittest.TestCase):
+    def test_equivalent_spellings(self):
+        p = {'Beams:eCM': '7000', 'HardQCD:all': 'on', '_analysis': 'ATLAS_2010_S8817516'}
+        q = {'beams:ecm ': '7.0e3', 'HardQCD:all': 'Yes', '_analysis': 'ATLAS_2010_S8817516'}
+
+        self.assertEqual(normalize_params(p), normalize_params(q))
+        self.assertEqual(params_key(p), params_key(q))
+
+    def test_different_values(self):
+        p = {'Beams:eCM': '7000', '_analysis': 'ATLAS_2010_S8817516'}
+
+        self.assertNotEqual(params_key(p), params_key(dict(p, **{'Beams:eCM': '8000'})))
+        self.assertNotEqual(params_key(p), params_key(dict(p, _analysis='CMS_2011_S8884919')))
+
+    def test_result_fields_ignored(self):
+        p = {'Beams:eCM': '7000', '_analysis': 'ATLAS_2010_S8817516'}
+        doc = dict(p, _id=1, _key='key', _yoda='final.yoda', _events=1000)
+
+        self.assertEqual(params_key(p), params_key(doc))
+
+    def test_internal_entries_kept(self):
+        self.assertEqual(normalize_params({'_analyses': ['A', 'B'], '_more': 500}), {'_analyses': ['A', 'B'], '_more': 500})
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        lru = LRUCache(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.get('a')
+        lru.put('c', 3)
+
+        self.assertEqual(lru.keys(), ['a', 'c'])
+        self.assertIsNone(lru.get('b'))
+
+    def test_sizeof(self):
+        lru = LRUCache(10, len)
+        lru.put('a', 'x' * 6)
+        lru.put('b', 'x' * 6)
+
+        self.assertEqual(lru.keys(), ['b'])
+        self.assertEqual(lru.size, 6)
+
+
+class FailingDB(object):
+    """
+    Backend whose operations fail (counted).
+    """
+
+    calls = 0
+
+    def lookup(self, *args):
+        self.calls += 1
+        raise sqlite3.OperationalError("database is locked")
+
+    setup = store = remove = ping = lookup
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.p = {'Beams:eCM': '7000', '_analysis': 'ATLAS_2010_S8817516'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store(self):
+        results = ResultCache(SQLiteDB(os.path.join(self.tmpdir, 'results.db')))
+        results.add(self.p, 'final.yoda', 1000)
+
+        # Read back from the backend
+        results.lru.clear()
+        self.assertEqual(results.get(dict(self.p, **{'Beams:eCM': '7.0e3'})), ('final.yoda', 1000))
+
+        results.remove(self.p)
+        self.assertIsNone(results.get(self.p))
+
+    def test_retry_after_error(self):
+        results = ResultCache(FailingDB())
+        self.assertFalse(results.healthy)
+        self.assertFalse(results.ready)
+
+        # The backend is not used until `RETRY_INTERVAL` has elapsed
+        results.add(self.p, 'final.yoda', 1000)
+        results.remove(self.p)
+        self.assertIsNone(results.get(self.p))
+        self.assertEqual(results.backend.calls, 1)
+
+        # Used again `RETRY_INTERVAL` seconds after the error
+        results.backend = SQLiteDB(os.path.join(self.tmpdir, 'results.db'))
+        results.failed -= cache.RETRY_INTERVAL
+        results.add(self.p, 'final.yoda', 1000)
+        results.lru.clear()
+
+        self.assertEqual(results.get(self.p), ('final.yoda', 1000))
+        self.assertTrue(results.healthy)
+        self.assertTrue(results.ready)
+
+    def test_setup_after_check(self):
+        results = ResultCache(FailingDB())
+        results.backend = SQLiteDB(os.path.join(self.tmpdir, 'results.db'))
+
+        self.assertTrue(results.check())
+        self.assertTrue(results.ready)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the PYTHIA cmnd files (`cern/cmnd.py`).
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cern.cmnd import CmndFile, parse_line
+
+CMND = """! Settings of the run
+Main:numberOfEvents = 1000   ! number of events
+Beams:eCM = 7000.
+# HardQCD:all = on
+HardQCD:all = off
+"""
+
+
+class CmndFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'main42.cmnd')
+        with open(self.filename, 'w') as f:
+            f.write(CMND)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_line(self):
+        self.assertEqual(parse_line("Beams:eCM = 7000. ! energy\n"), ('Beams:eCM', '7000.'))
+        self.assertIsNone(parse_line("# Beams:eCM = 7000.\n"))
+        self.assertIsNone(parse_line("Main:timesAllowErrors\n"))
+
+    def test_effective(self):
+        cmnd = CmndFile(self.filename)
+        params = {'Main:numberOfEvents': '1000', 'Beams:eCM': '7000.', 'HardQCD:all': 'off'}
+
+        self.assertEqual(cmnd.effective(), params)
+        self.assertEqual(cmnd.effective({'HardQCD:all': 'on', 'Random:seed': 5}), dict(params, **{'HardQCD:all': 'on', 'Random:seed': 5}))
+
+        # The parsed file is not modified by the overlays
+        self.assertEqual(cmnd.effective(), params)
+
+    def test_write(self):
+        copy = os.path.join(self.tmpdir, 'run.cmnd')
+        CmndFile(self.filename).write(copy, {'Beams:eCM': 8000})
+
+        self.assertEqual(CmndFile(copy).effective(), {'Main:numberOfEvents': '1000', 'Beams:eCM': '8000', 'HardQCD:all': 'off'})
+        self.assertEqual(CmndFile(self.filename).effective()['Beams:eCM'], '7000.')
+
+    def test_load_cached(self):
+        cmnd = CmndFile.load(self.filename)
+        self.assertIs(CmndFile.load(self.filename), cmnd)
+
+        with open(self.filename, 'a') as f:
+            f.write("Random:setSeed = on\n")
+        os.utime(self.filename, (cmnd.mtime + 1, cmnd.mtime + 1))
+
+        self.assertEqual(CmndFile.load(self.filename).effective()['Random:setSeed'], 'on')
+
+
+if __name__ == '__main__':
+    unittest.main()
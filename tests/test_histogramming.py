@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the merging and streaming of the histogram dicts
+(`cern/histogramming.py`).
+"""
+
+import array
+import unittest
+
+from cern.histogramming import HistoStream, merge_histos
+
+
+def dbn(sumW=0., sumW2=0., sumWX=0., sumWX2=0., numEntries=0):
+    return {'sumW': sumW, 'sumW2': sumW2, 'sumWX': sumWX, 'sumWX2': sumWX2, 'numEntries': numEntries}
+
+
+def histo1d(path, sumW, sumW2=None):
+    """
+    Histo1D dict with unit bins and the `sumW` (and `sumW2`) of each bin.
+    """
+
+    sumW2 = sumW2 or sumW
+    n = len(sumW)
+    return {
+        'type': 'Histo1D',
+        'annotations': {'Path': path},
+        'bins': {
+            'edgeLow': array.array('d', range(n)),
+            'edgeHigh': array.array('d', range(1, n + 1)),
+            'sumW': array.array('d', sumW),
+            'sumW2': array.array('d', sumW2),
+            'sumWX': array.array('d', [w * (i + .5) for i, w in enumerate(sumW)]),
+            'sumWX2': array.array('d', [w * (i + .5) ** 2 for i, w in enumerate(sumW)]),
+            'numEntries': array.array('d', sumW)
+            },
+        'totalDbn': dbn(sum(sumW), sum(sumW2), numEntries=sum(sumW)),
+        'underflow': dbn(),
+        'overflow': dbn()
+        }
+
+
+class MergeHistosTest(unittest.TestCase):
+    def test_sum(self):
+        merged, = merge_histos([[histo1d('/A/h', [1., 2.])], [histo1d('/A/h', [3., 4.])]])
+
+        self.assertEqual(list(merged['bins']['sumW']), [4., 6.])
+        self.assertEqual(list(merged['bins']['sumW2']), [4., 6.])
+        self.assertEqual(merged['totalDbn']['numEntries'], 10)
+
+    def test_weights(self):
+        # Scaling by `w` multiplies sumW by `w` and sumW2 by `w` squared
+        merged, = merge_histos([[histo1d('/A/h', [2., 4.], [4., 8.])], [histo1d('/A/h', [6., 2.], [12., 4.])]], [.25, .75])
+
+        self.assertEqual(list(merged['bins']['sumW']), [.25 * 2 + .75 * 6, .25 * 4 + .75 * 2])
+        self.assertEqual(list(merged['bins']['sumW2']), [.0625 * 4 + .5625 * 12, .0625 * 8 + .5625 * 4])
+        self.assertEqual(list(merged['bins']['numEntries']), [8., 6.])
+        self.assertEqual(merged['totalDbn']['sumW2'], .0625 * 12 + .5625 * 16)
+        self.assertEqual(merged['totalDbn']['numEntries'], 14)
+
+    def test_mismatch(self):
+        first = histo1d('/A/h', [1., 2.])
+        merged = merge_histos([[first, histo1d('/A/g', [1.])], [histo1d('/A/h', [1., 2., 3.])]])
+
+        # Different binning or missing from a run: taken from the first run
+        self.assertIs(merged[0], first)
+        self.assertEqual([h['annotations']['Path'] for h in merged], ['/A/h', '/A/g'])
+
+
+class HistoStreamTest(unittest.TestCase):
+    def test_deltas(self):
+        stream = HistoStream()
+
+        first = stream.encode([histo1d('/A/h', [1., 2., 3.])])
+        self.assertTrue(first['full'])
+        self.assertEqual(first['version'], 1)
+
+        update = stream.encode([histo1d('/A/h', [1., 5., 3.])])
+        self.assertFalse(update['full'])
+        self.assertEqual(update['version'], 2)
+        bins = update['histos']['/A/h']['bins']
+        self.assertEqual([row[0] for row in bins], [1])
+        self.assertEqual(bins[0][1:], [5., 5., 7.5, 11.25, 5.])
+        self.assertEqual(update['histos']['/A/h']['totalDbn'][0], 9.)
+
+        # Unchanged histograms are not sent
+        self.assertEqual(stream.encode([histo1d('/A/h', [1., 5., 3.])])['histos'], {})
+
+    def test_full_when_incompatible(self):
+        stream = HistoStream()
+        stream.encode([histo1d('/A/h', [1., 2.])])
+
+        self.assertTrue(stream.encode([histo1d('/A/h', [1., 2., 3.])])['full'])
+        self.assertTrue(stream.encode([histo1d('/A/h', [1., 2., 3.]), histo1d('/A/g', [1.])])['full'])
+
+    def test_snapshot(self):
+        stream = HistoStream(normalize=True)
+        self.assertIsNone(stream.snapshot())
+
+        stream.encode([histo1d('/A/h', [1., 2.])])
+        last = [histo1d('/A/h', [1., 3.])]
+        stream.encode(last)
+
+        snapshot = stream.snapshot()
+        self.assertTrue(snapshot['full'])
+        self.assertTrue(snapshot['normalize'])
+        self.assertEqual(snapshot['version'], 2)
+        self.assertIs(snapshot['histos'], last)
+
+    def test_independent_streams(self):
+        # One stream per analysis: the versions of an analysis do not
+        # depend on the updates of the others (see `Histograms.update` in
+        # `static/js/main.js`)
+        a, b = HistoStream(), HistoStream()
+        a.encode([histo1d('/A/h', [1.])])
+        a.encode([histo1d('/A/h', [2.])])
+
+        self.assertEqual(b.encode([histo1d('/B/h', [1.])])['version'], 1)
+        self.assertEqual(a.encode([histo1d('/A/h', [3.])])['version'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
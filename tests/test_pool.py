@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the scheduling of the simulations (`cern/pool.py`).
+"""
+
+import threading
+import unittest
+
+from cern.pool import SimulationPool, JOB_CANCELLED, JOB_DONE, JOB_QUEUED, JOB_RUNNING
+from cern.tools import SIM_END, SIM_QUE
+
+
+class Channel(object):
+    """
+    Web socket queue of a client (see `WSChannel`).
+    """
+
+    def __init__(self):
+        self.msgs = []
+
+    def put(self, msg, block=True):
+        self.msgs.append(msg)
+
+
+class FakeSimulation(object):
+    """
+    Simulation running until it is released (or stopped).
+    """
+
+    def __init__(self):
+        self._ws = Channel()
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def run(self):
+        self.started.set()
+        self.released.wait(5)
+        self._ws.put(['signal', SIM_END])
+
+    def stop(self):
+        self.released.set()
+
+
+class SimulationPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = SimulationPool(1, 2)
+        self.simulations = []
+
+    def tearDown(self):
+        self.pool.shutdown()
+        for simulation in self.simulations:
+            simulation.released.set()
+        for worker in self.pool._workers:
+            worker.join(5)
+
+    def submit(self):
+        simulation = FakeSimulation()
+        self.simulations.append(simulation)
+        return self.pool.submit(simulation)
+
+    def test_admission(self):
+        running = self.submit()
+        self.assertTrue(running.simulation.started.wait(5))
+
+        queued = [self.submit(), self.submit()]
+        self.assertEqual([job.status for job in queued], [JOB_QUEUED, JOB_QUEUED])
+        self.assertEqual([self.pool.position(job) for job in queued], [1, 2])
+        self.assertEqual(queued[1].simulation._ws.msgs[-1], ['queue', 2])
+
+        # Queue full
+        self.assertIsNone(self.submit())
+        self.assertEqual(self.pool.stats(), {'running': 1, 'queued': 2, 'workers': 1})
+
+        running.simulation.released.set()
+        self.assertTrue(queued[0].simulation.started.wait(5))
+        self.assertEqual(queued[1].simulation._ws.msgs[-1], ['queue', 1])
+
+    def test_queued_signal_first(self):
+        # A fast run must not end before the client knows it is queued
+        for i in range(20):
+            simulation = FakeSimulation()
+            simulation.released.set()
+            self.pool.submit(simulation)
+            self.assertTrue(simulation.started.wait(5))
+            self.assertEqual(simulation._ws.msgs[0], ['signal', SIM_QUE])
+
+    def test_rejected(self):
+        running = self.submit()
+        self.assertTrue(running.simulation.started.wait(5))
+        self.submit()
+        self.submit()
+
+        simulation = FakeSimulation()
+        self.assertIsNone(self.pool.submit(simulation))
+        self.assertEqual(simulation._ws.msgs, [])
+
+    def test_cancel(self):
+        running = self.submit()
+        self.assertTrue(running.simulation.started.wait(5))
+        first, second = self.submit(), self.submit()
+
+        self.assertTrue(self.pool.cancel(first))
+        self.assertEqual(first.status, JOB_CANCELLED)
+        self.assertEqual(self.pool.position(second), 1)
+        self.assertEqual(second.simulation._ws.msgs[-1], ['queue', 1])
+
+        # Running jobs have to be stopped instead
+        self.assertFalse(self.pool.cancel(running))
+        self.assertEqual(running.status, JOB_RUNNING)
+
+        running.simulation.released.set()
+        self.assertTrue(second.simulation.started.wait(5))
+        self.assertFalse(first.simulation.started.is_set())
+        second.simulation.released.set()
+
+        # Not in the queue anymore once done
+        self.pool.shutdown()
+        for worker in self.pool._workers:
+            worker.join(5)
+        self.assertEqual(running.status, JOB_DONE)
+        self.assertFalse(self.pool.cancel(running))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the binary web socket frames (`encode_binary` in `cern/tools.py`).
+"""
+
+import array
+import json
+import struct
+import unittest
+
+from cern.tools import encode_binary
+
+
+def decode_binary(frame):
+    """
+    Message of a binary frame (as decoded by the client).
+    """
+
+    length, = struct.unpack('<I', frame[:4])
+    header = frame[4:4 + length]
+    start = 4 + length + (-(4 + length) % 8)
+
+    def column(obj):
+        if '$a' in obj:
+            offset, n = obj['$a']
+            return list(struct.unpack('<{}d'.format(n), frame[start + offset:start + offset + 8 * n]))
+        return obj
+
+    return start, json.loads(header, object_hook=column)
+
+
+class EncodeBinaryTest(unittest.TestCase):
+    def test_framing(self):
+        message = {'type': 'histos', 'content': [{'bins': {'sumW': array.array('d', [1., 2.5]), 'sumW2': array.array('d', [.5])}}]}
+        frame = encode_binary(message)
+        start, decoded = decode_binary(frame)
+
+        # Columns aligned on 8 bytes, right after the header
+        self.assertEqual(start % 8, 0)
+        self.assertEqual(len(frame), start + 3 * 8)
+        self.assertEqual(decoded, {'type': 'histos', 'content': [{'bins': {'sumW': [1., 2.5], 'sumW2': [.5]}}]})
+
+    def test_other_typecodes(self):
+        frame = encode_binary({'content': array.array('i', [1, 2])})
+
+        self.assertEqual(decode_binary(frame)[1], {'content': [1., 2.]})
+
+    def test_no_columns(self):
+        frame = encode_binary({'type': 'signal', 'content': 0})
+        start, decoded = decode_binary(frame)
+
+        self.assertEqual(len(frame), start)
+        self.assertEqual(decoded, {'type': 'signal', 'content': 0})
+
+    def test_not_serializable(self):
+        self.assertRaises(TypeError, encode_binary, {'content': object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the transports of the events (`cern/transport.py`).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from cern.transport import TRANSPORTS, attached
+
+EVENTS = "E 0 1\nP 1 2212 0. 0. 3500. 3500.\n"
+
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_after_writer_exit(self, backend):
+        """
+        Events read by Rivet when PYTHIA has written them all (within the
+        pipe buffer) and exited before Rivet opens the transport.
+        """
+
+        result = []
+
+        with TRANSPORTS[backend](self.tmpdir, 'events', 0) as transport:
+            transport.started()
+
+            fd = transport.open_writer()
+            os.write(fd, EVENTS)
+            transport.close_writer(fd)
+            self.assertTrue(transport.wait_ready(lambda: False, 1))
+
+            def read():
+                with attached(transport.reader_path):
+                    f = open(transport.reader_path)
+                result.append(f.read())
+                f.close()
+
+            reader = threading.Thread(target=read)
+            reader.daemon = True
+            reader.start()
+            reader.join(5)
+
+            self.assertFalse(reader.is_alive(), "the reader is blocked opening the transport")
+
+        return result[0]
+
+    def test_fifo_writer_gone(self):
+        self.assertEqual(self.read_after_writer_exit('fifo'), EVENTS)
+
+    def test_file_writer_gone(self):
+        self.assertEqual(self.read_after_writer_exit('file'), EVENTS)
+
+
+if __name__ == '__main__':
+    unittest.main()